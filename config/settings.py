@@ -28,3 +28,38 @@ DB_CONFIG_SQLITE_DOCKER = {
     'database': os.path.join(os.getenv('DATA_DIR', 'data'), 'medicaldatabase.db'),
     'schema': os.getenv('SQLITE_SCHEMA', 'etl')
 }
+
+# Configurações do pipeline de ETL
+ETL_CONFIG = {
+    'download_workers': int(os.getenv('ETL_DOWNLOAD_WORKERS', '8')),  # Workers de download simultâneos
+    'http_timeout': int(os.getenv('ETL_HTTP_TIMEOUT', '30')),         # Timeout (s) das requisições HTTP
+    'http_retries': int(os.getenv('ETL_HTTP_RETRIES', '3')),          # Retentativas por requisição
+    'cache_dir': os.getenv('ETL_CACHE_DIR', os.path.join('data', 'cache')),  # Cache por sha do blob
+    'source': os.getenv('ETL_SOURCE', ''),                            # Diretório ou .tar/.zip local; vazio = GitHub
+    'source_format': os.getenv('ETL_SOURCE_FORMAT', 'bundle'),        # 'bundle' ou 'ndjson' (FHIR Bulk Data $export)
+    'ndjson_chunk_bytes': int(os.getenv('ETL_NDJSON_CHUNK_BYTES', str(16 * 1024 * 1024))),  # Faixa por tarefa
+    'fetch_engine': os.getenv('ETL_FETCH_ENGINE', 'threads'),         # 'threads' ou 'asyncio'
+    'async_concurrency': int(os.getenv('ETL_ASYNC_CONCURRENCY', '64')),   # Downloads simultâneos (asyncio)
+    'async_limit_per_host': int(os.getenv('ETL_ASYNC_LIMIT_PER_HOST', '16')),  # Conexões por host (asyncio)
+    'parse_workers': int(os.getenv('ETL_PARSE_WORKERS', str(os.cpu_count() or 1))),  # Processos de parsing (1 = sequencial)
+    'parse_chunksize': int(os.getenv('ETL_PARSE_CHUNKSIZE', '4')),    # Arquivos enviados por vez a cada processo
+    'parse_ordered': os.getenv('ETL_PARSE_ORDERED', 'true').lower() == 'true',  # false = resultados fora de ordem
+    'commit_files': int(os.getenv('ETL_COMMIT_FILES', '200')),        # Arquivos por commit no SQLite
+    'commit_interval_ms': int(os.getenv('ETL_COMMIT_INTERVAL_MS', '1000')),  # Tempo máximo de um commit pendente
+    'journal_sync_every': int(os.getenv('ETL_JOURNAL_SYNC_EVERY', '256')),  # Eventos de download por fsync do diário
+    'bulk_load': os.getenv('ETL_BULK_LOAD', 'auto'),                  # 'auto' (primeira carga), 'always' ou 'never'
+    'bulk_cache_kb': int(os.getenv('ETL_BULK_CACHE_KB', str(256 * 1024))),  # page cache do SQLite na carga em massa
+    'stream_parse_min_bytes': int(os.getenv('ETL_STREAM_PARSE_MIN_BYTES', str(8 * 1024 * 1024))),  # Streaming (ijson) a partir deste tamanho; -1 desliga
+    'resource_types': os.getenv('ETL_RESOURCE_TYPES', 'Condition,MedicationRequest'),  # Extratores habilitados (ex.: ...,Observation)
+    'in_memory': os.getenv('ETL_IN_MEMORY', 'false').lower() == 'true',  # Bytes baixados vão direto ao parsing, sem disco
+    'memory_queue_files': int(os.getenv('ETL_MEMORY_QUEUE_FILES', '64')),  # Limite da fila em memória (backpressure)
+    'archive_raw': os.getenv('ETL_ARCHIVE_RAW', 'false').lower() == 'true',  # Arquiva os brutos no cache em segundo plano
+    'write_shards': int(os.getenv('ETL_WRITE_SHARDS', '1')),          # Shards do SQLite por hash de patient_id (1 = desligado)
+    'copy_format': os.getenv('ETL_COPY_FORMAT', 'csv'),               # Migração: COPY em 'csv' ou 'binary'
+    'migration_workers': int(os.getenv('ETL_MIGRATION_WORKERS', '0')),  # Conexões de COPY simultâneas (0 = nº de CPUs)
+    'migration_chunk_rows': int(os.getenv('ETL_MIGRATION_CHUNK_ROWS', '250000')),  # Linhas por faixa de id na migração
+    'pg_pool_max': int(os.getenv('ETL_PG_POOL_MAX', '16')),           # Limite de conexões do pool do PostgreSQL (acima disso, espera)
+    'pg_pool_check_idle_s': int(os.getenv('ETL_PG_POOL_CHECK_IDLE_S', '30')),  # Health check (SELECT 1) após este ócio
+    'pg_synchronous_commit': os.getenv('ETL_PG_SYNCHRONOUS_COMMIT', 'off'),  # synchronous_commit das sessões do pool
+    'index_build_mem_mb': int(os.getenv('ETL_INDEX_BUILD_MEM_MB', '1024'))  # maintenance_work_mem total da reconstrução de índices
+}
@@ -0,0 +1,214 @@
+import os
+import json
+import queue
+import asyncio
+import threading
+from urllib.parse import urljoin, urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import aiohttp
+
+from etl import downloads
+
+# Motor de download assíncrono (alternativa ao pool de threads com requests).
+# Não depende do estado global do loader_pipeline: recebe URLs, diretório de
+# destino, cache e a fila de saída, o que permite testá-lo contra um servidor
+# local. O cache por sha do blob é o mesmo do motor de threads (etl.downloads).
+
+
+async def put_item(out_queue, item):
+    """Publica na fila; se ela estiver cheia, espera fora do event loop (backpressure)"""
+    try:
+        out_queue.put_nowait(item)
+    except queue.Full:
+        await asyncio.to_thread(out_queue.put, item)
+
+
+async def download_file_async(session, raw_base_url, name, dest_dir, out_queue,
+                              meta=None, cache_dir=None):
+    """Baixa um arquivo e o publica na fila
+
+    Sem dest_dir o conteúdo não vai para o disco: publica (nome, memoryview).
+    Com cache_dir e o sha do blob na listagem, um acerto de cache é publicado
+    sem download (0 bytes) e o conteúdo baixado só é aceito se conferir com o
+    sha. No disco a resposta é gravada em blocos num .part, como em
+    stream_download, e publicada no cache (ligada em dest_dir) ou direto em
+    dest_dir. O worker só passa ao próximo arquivo após a publicação, então
+    com a fila cheia no máximo `concurrency` arquivos ficam retidos em memória.
+    """
+    blob_sha = (meta or {}).get('sha')
+    if cache_dir and blob_sha:
+        cached = await asyncio.to_thread(downloads.get_cached_file, cache_dir, blob_sha, name)
+        if cached:
+            item = cached
+            if dest_dir is not None:
+                item = await asyncio.to_thread(
+                    downloads.link_into_process_dir, cached, os.path.join(dest_dir, name)
+                )
+            await put_item(out_queue, item)
+            return item, 0
+
+    if dest_dir is None:
+        async with session.get(urljoin(raw_base_url, name)) as response:
+            response.raise_for_status()
+            content = await response.read()
+        if blob_sha:
+            await asyncio.to_thread(downloads.check_blob_sha, content, blob_sha)
+        item = (name, memoryview(content))
+        await put_item(out_queue, item)
+        return item, len(content)
+
+    use_cache = bool(cache_dir and blob_sha)
+    if use_cache:
+        file_path = downloads.get_cache_path(cache_dir, blob_sha, name)
+    else:
+        file_path = os.path.join(dest_dir, name)
+
+    async with session.get(urljoin(raw_base_url, name)) as response:
+        response.raise_for_status()
+        size = (meta or {}).get('size')
+        if size is None:
+            size = response.content_length
+        download = await asyncio.to_thread(downloads.open_download, file_path, blob_sha, size)
+        try:
+            async for chunk in response.content.iter_chunked(downloads.HASH_CHUNK_SIZE):
+                await asyncio.to_thread(downloads.write_download_chunk, download, chunk)
+            digest = await asyncio.to_thread(downloads.finish_download, download)
+        except Exception:
+            await asyncio.to_thread(downloads.abort_download, download)
+            raise
+
+    item = file_path
+    if use_cache:
+        await asyncio.to_thread(downloads.write_cache_hash, file_path, digest)
+        item = await asyncio.to_thread(
+            downloads.link_into_process_dir, file_path, os.path.join(dest_dir, name)
+        )
+
+    await put_item(out_queue, item)
+    return item, download['written']
+
+
+async def fetch_files_async(file_names, dest_dir, out_queue, raw_base_url,
+                            concurrency=64, limit_per_host=16, timeout=30,
+                            on_downloaded=None, on_error=None, file_meta=None, cache_dir=None):
+    """Baixa os arquivos com `concurrency` workers e publica os caminhos na fila
+
+    Como no motor de threads, um número fixo de workers consome a fila de
+    pendentes, em vez de uma tarefa por arquivo criada de antemão. Segue o
+    mesmo contrato consumido por process_files: cada arquivo baixado é
+    colocado em out_queue (caminho, ou (nome, memoryview) sem dest_dir).
+    file_meta ({nome: metadados da listagem}) fornece o sha do blob usado no
+    cache_dir e na conferência do conteúdo. O sentinela final fica a cargo
+    do chamador.
+    """
+    file_meta = file_meta or {}
+    pending = asyncio.Queue()
+    for name in file_names:
+        pending.put_nowait(name)
+
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=limit_per_host)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    downloaded = 0
+
+    async def worker(session):
+        nonlocal downloaded
+        while True:
+            try:
+                name = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            try:
+                item, size = await download_file_async(
+                    session, raw_base_url, name, dest_dir, out_queue, file_meta.get(name), cache_dir
+                )
+            except Exception as e:
+                if on_error:
+                    on_error(e)
+                continue
+
+            downloaded += 1
+            if on_downloaded:
+                on_downloaded(item, size)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        num_workers = max(1, min(concurrency, pending.qsize()))
+        await asyncio.gather(*(worker(session) for _ in range(num_workers)))
+
+    return downloaded
+
+
+def fetch_files(file_names, dest_dir, out_queue, raw_base_url, **kwargs):
+    """Versão síncrona de fetch_files_async, para uso a partir de uma thread"""
+    return asyncio.run(
+        fetch_files_async(file_names, dest_dir, out_queue, raw_base_url, **kwargs)
+    )
+
+
+def serve_bundle_directory(directory, host='127.0.0.1', port=0):
+    """Sobe um servidor HTTP local que imita a API do GitHub sobre um diretório
+
+    GET /contents?page=N&per_page=M lista os JSONs (com cabeçalho Link "next")
+    e GET /raw/<nome> devolve o arquivo. Retorna (server, data_url, raw_base_url);
+    encerre com server.shutdown().
+    """
+    directory = os.path.abspath(directory)
+
+    class BundleHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, body, content_type, extra_headers=None):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (extra_headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+
+            if parsed.path == '/contents':
+                params = parse_qs(parsed.query)
+                page = int(params.get('page', ['1'])[0])
+                per_page = int(params.get('per_page', ['100'])[0])
+                names = sorted(n for n in os.listdir(directory) if n.endswith('.json'))
+                chunk = names[(page - 1) * per_page:page * per_page]
+
+                listing = []
+                for name in chunk:
+                    with open(os.path.join(directory, name), 'rb') as f:
+                        content = f.read()
+                    listing.append({
+                        'name': name,
+                        'type': 'file',
+                        'size': len(content),
+                        'sha': downloads.git_blob_sha(content)
+                    })
+
+                headers = {}
+                if page * per_page < len(names):
+                    next_url = f"http://{host}:{self.server.server_port}/contents?page={page + 1}&per_page={per_page}"
+                    headers['Link'] = f'<{next_url}>; rel="next"'
+                self.send_body(json.dumps(listing).encode(), 'application/json', headers)
+
+            elif parsed.path.startswith('/raw/'):
+                name = os.path.basename(parsed.path[len('/raw/'):])
+                file_path = os.path.join(directory, name)
+                if not os.path.isfile(file_path):
+                    self.send_error(404)
+                    return
+                with open(file_path, 'rb') as f:
+                    self.send_body(f.read(), 'application/json')
+
+            else:
+                self.send_error(404)
+
+    server = ThreadingHTTPServer((host, port), BundleHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    base_url = f"http://{host}:{server.server_port}"
+    return server, f"{base_url}/contents?ref=main", f"{base_url}/raw/"
@@ -0,0 +1,102 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import time
+import sqlite3
+import argparse
+
+from config.settings import DB_CONFIG_SQLITE, DB_CONFIG_POSTGRES
+from etl import pg_copy
+
+# Compara o COPY em CSV e em formato binário nas tabelas conditions e
+# medications. Sem --postgres mede apenas a codificação no cliente (tempo,
+# vazão e volume enviado); com --postgres executa o COPY em tabelas
+# temporárias, medindo também o custo no servidor.
+#   python -m etl.benchmark_copy
+#   python -m etl.benchmark_copy --postgres --repeat 3
+
+TABLES = {
+    'conditions': (['patient_id', 'condition_text', 'data_inclusao'],
+                   "SELECT patient_id, condition_text, data_inclusao FROM conditions"),
+    'medications': (['patient_id', 'medication_text', 'data_inclusao'],
+                    "SELECT patient_id, medication_text, data_inclusao FROM medications")
+}
+COLUMN_TYPES = ['text', 'text', 'timestamp']
+
+
+def measure_encoding(sqlite_conn, query, copy_format):
+    """Retorna (segundos, bytes) para gerar todo o fluxo do COPY no cliente"""
+    cursor = sqlite_conn.execute(query)
+    started = time.perf_counter()
+    if copy_format == 'binary':
+        chunks = pg_copy.iter_binary_chunks(cursor, COLUMN_TYPES)
+    else:
+        chunks = pg_copy.iter_csv_chunks(cursor)
+    total = sum(len(chunk) for chunk in chunks)
+    return time.perf_counter() - started, total
+
+
+def measure_copy(sqlite_conn, pg_conn, table, columns, query, copy_format):
+    """Retorna os segundos do COPY completo para uma tabela temporária (descartada)"""
+    temp_table = f"bench_{table}_{copy_format}"
+    with pg_conn.cursor() as pg_cursor:
+        pg_cursor.execute(
+            f"CREATE TEMP TABLE {temp_table} "
+            f"(LIKE {DB_CONFIG_POSTGRES['schema']}.{table} INCLUDING DEFAULTS)"
+        )
+        cursor = sqlite_conn.execute(query)
+        started = time.perf_counter()
+        if copy_format == 'binary':
+            pg_copy.copy_binary_from_cursor(pg_cursor, temp_table, columns, COLUMN_TYPES, cursor)
+        else:
+            pg_copy.copy_csv_from_cursor(pg_cursor, temp_table, columns, cursor)
+        elapsed = time.perf_counter() - started
+    pg_conn.rollback()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do COPY em CSV x binário")
+    parser.add_argument('--database', default=DB_CONFIG_SQLITE['database'], help="Banco SQLite de origem")
+    parser.add_argument('--postgres', action='store_true', help="Executa o COPY no PostgreSQL configurado")
+    parser.add_argument('--repeat', type=int, default=3, help="Repetições (vale a melhor)")
+    args = parser.parse_args()
+
+    sqlite_conn = sqlite3.connect(args.database)
+    pg_conn = None
+    if args.postgres:
+        import psycopg2
+        pg_conn = psycopg2.connect(
+            dbname=DB_CONFIG_POSTGRES['dbname'],
+            user=DB_CONFIG_POSTGRES['user'],
+            password=DB_CONFIG_POSTGRES['password'],
+            host=DB_CONFIG_POSTGRES['host'],
+            port=DB_CONFIG_POSTGRES['port']
+        )
+
+    try:
+        print(f"{'tabela':<13}{'formato':<9}{'linhas':>10}{'MB':>9}{'cliente (s)':>13}{'linhas/s':>12}"
+              + (f"{'COPY (s)':>11}" if pg_conn else ''))
+        for table, (columns, query) in TABLES.items():
+            rows = sqlite_conn.execute(f"SELECT COUNT(*) FROM ({query})").fetchone()[0]
+            for copy_format in ('csv', 'binary'):
+                results = [measure_encoding(sqlite_conn, query, copy_format) for _ in range(args.repeat)]
+                elapsed = min(seconds for seconds, _ in results)
+                size = results[0][1]
+                line = (f"{table:<13}{copy_format:<9}{rows:>10,}{size / 1024 / 1024:>9.2f}"
+                        f"{elapsed:>13.3f}{rows / (elapsed or 1e-9):>12,.0f}")
+                if pg_conn:
+                    copy_elapsed = min(
+                        measure_copy(sqlite_conn, pg_conn, table, columns, query, copy_format)
+                        for _ in range(args.repeat)
+                    )
+                    line += f"{copy_elapsed:>11.3f}"
+                print(line)
+    finally:
+        sqlite_conn.close()
+        if pg_conn:
+            pg_conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+from etl import fhir_stream
+from etl.loader_pipeline import parse_bundle_json, parse_bundle_stream
+
+# Compara o parsing com json.load e a extração incremental (ijson) em
+# tempo, vazão e memória de pico por arquivo.
+#   python -m etl.benchmark_parse data/data_process_<timestamp>
+#   python -m etl.benchmark_parse --synthetic 5 --observations 50000
+
+
+def build_synthetic_bundle(file_path, observations):
+    """Gera um bundle no estilo Synthea dominado por Observations"""
+    entries = [{'resource': {'resourceType': 'Patient', 'id': 'synthetic-patient', 'gender': 'female'}}]
+    for i in range(observations):
+        entries.append({'resource': {
+            'resourceType': 'Observation',
+            'id': f'obs-{i}',
+            'status': 'final',
+            'code': {'coding': [{'system': 'http://loinc.org', 'code': '8302-2', 'display': 'Body Height'}],
+                     'text': 'Body Height'},
+            'valueQuantity': {'value': 170.0 + i % 10, 'unit': 'cm'}
+        }})
+        if i % 100 == 0:
+            entries.append({'resource': {'resourceType': 'Condition', 'code': {'text': f'Condition {i % 7}'}}})
+            entries.append({'resource': {'resourceType': 'MedicationRequest',
+                                         'medicationCodeableConcept': {'text': f'Medication {i % 5}'}}})
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump({'resourceType': 'Bundle', 'type': 'transaction', 'entry': entries}, f)
+
+
+def measure(parse, file_paths):
+    """Retorna (segundos, memória de pico em bytes) de um caminho de parsing"""
+    started = time.perf_counter()
+    for file_path in file_paths:
+        parse(file_path)
+    elapsed = time.perf_counter() - started
+
+    peak = 0
+    for file_path in file_paths:
+        tracemalloc.start()
+        parse(file_path)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de parsing dos bundles FHIR")
+    parser.add_argument('directory', nargs='?', help="Diretório com bundles JSON")
+    parser.add_argument('--synthetic', type=int, default=0, help="Quantidade de bundles sintéticos")
+    parser.add_argument('--observations', type=int, default=20000, help="Observations por bundle sintético")
+    args = parser.parse_args()
+
+    if not fhir_stream.is_available():
+        print("ijson não está instalado: pip install ijson")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.directory:
+            file_paths = [os.path.join(args.directory, n) for n in sorted(os.listdir(args.directory))
+                          if n.endswith('.json')]
+        else:
+            file_paths = []
+            for i in range(args.synthetic or 3):
+                file_path = os.path.join(tmp_dir, f'synthetic_{i}.json')
+                build_synthetic_bundle(file_path, args.observations)
+                file_paths.append(file_path)
+
+        if not file_paths:
+            print("Nenhum bundle encontrado.")
+            return
+
+        for file_path in file_paths:
+            if parse_bundle_json(file_path) != parse_bundle_stream(file_path):
+                print(f"Divergência entre os caminhos em {file_path}")
+                return
+
+        total_mb = sum(os.path.getsize(p) for p in file_paths) / 1024 / 1024
+        print(f"{len(file_paths)} arquivos, {total_mb:.2f} MB")
+        print(f"{'caminho':<12}{'tempo (s)':>12}{'arq/s':>10}{'MB/s':>10}{'pico (MB)':>12}")
+        for label, parse in (('json.load', parse_bundle_json), ('streaming', parse_bundle_stream)):
+            elapsed, peak = measure(parse, file_paths)
+            print(f"{label:<12}{elapsed:>12.3f}{len(file_paths) / elapsed:>10.1f}"
+                  f"{total_mb / elapsed:>10.2f}{peak / 1024 / 1024:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+import os
+import time
+import queue
+import hashlib
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config.settings import ETL_CONFIG
+
+# Pool de workers de download compartilhado por loader e loader_pipeline.
+# Cada worker mantém sua própria sessão HTTP (conexões keep-alive
+# reaproveitadas) e seus contadores de vazão. O que fazer com cada arquivo
+# (onde gravar, cache, fila de saída) fica a cargo de quem chama, pelas
+# funções fetch e on_fetched.
+#
+# O cache de brutos também fica aqui, compartilhado pelos motores de
+# threads e asyncio: cada arquivo é guardado sob o sha do blob do git
+# informado pela listagem, com o SHA-256 do conteúdo ao lado.
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+# Sessão HTTP de cada worker de download
+http_local = threading.local()
+
+# Contadores de vazão por worker de download
+stats_lock = threading.Lock()
+download_stats = {}
+
+
+def get_http_session():
+    """Retorna a sessão HTTP do worker atual, criando-a no primeiro uso"""
+    session = getattr(http_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        retries = Retry(
+            total=ETL_CONFIG['http_retries'],
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504)
+        )
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=2, max_retries=retries)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        http_local.session = session
+    return session
+
+
+def download_worker(worker_name, pending, fetch, on_fetched):
+    """Consome a fila de pendentes até o sentinela None
+
+    fetch(session, nome, metadados) retorna (item, bytes baixados), com 0
+    bytes quando o arquivo veio do cache; on_fetched(nome, item) publica o
+    resultado. Falhas são contadas e não interrompem o worker.
+    """
+    session = get_http_session()
+    stats = {'files': 0, 'cached': 0, 'bytes': 0, 'errors': 0, 'seconds': 0.0}
+    with stats_lock:
+        download_stats[worker_name] = stats
+
+    try:
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+
+            name, meta = item
+            started = time.time()
+
+            try:
+                result, written = fetch(session, name, meta)
+                on_fetched(name, result)
+                if written:
+                    stats['files'] += 1
+                    stats['bytes'] += written
+                else:
+                    stats['cached'] += 1
+            except Exception as e:
+                stats['errors'] += 1
+                print(f"\nErro ao baixar {name}: {str(e)}")
+            finally:
+                stats['seconds'] += time.time() - started
+    finally:
+        session.close()
+        http_local.session = None
+
+
+def run_download_workers(files, fetch, on_fetched, num_workers):
+    """Distribui {nome: metadados} entre num_workers threads e espera todas terminarem"""
+    pending = queue.Queue()
+    for item in files.items():
+        pending.put(item)
+    for _ in range(num_workers):
+        pending.put(None)
+
+    with stats_lock:
+        download_stats.clear()
+    workers = [
+        threading.Thread(target=download_worker, args=(f"worker-{i + 1}", pending, fetch, on_fetched))
+        for i in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def print_download_stats():
+    """Exibe a vazão de cada worker de download para dimensionar o pool"""
+    print("\nVazão por worker:")
+    for worker_name, stats in sorted(download_stats.items()):
+        seconds = stats['seconds'] or 1e-9
+        print(
+            f"- {worker_name}: {stats['files']} arquivos, "
+            f"{stats['bytes'] / 1024 / 1024:.2f} MB, "
+            f"{stats['files'] / seconds:.1f} arq/s, "
+            f"{stats['bytes'] / 1024 / 1024 / seconds:.2f} MB/s, "
+            f"{stats['cached']} do cache, "
+            f"{stats['errors']} erros"
+        )
+
+
+def git_blob_sha(content):
+    """Calcula o sha de blob do git, o mesmo exposto pela API do GitHub"""
+    sha1 = hashlib.sha1(f"blob {len(content)}\0".encode())
+    sha1.update(content)
+    return sha1.hexdigest()
+
+
+def check_blob_sha(content, blob_sha):
+    """Rejeita conteúdo truncado ou corrompido: o sha do blob deve conferir com a listagem"""
+    actual = git_blob_sha(content)
+    if actual != blob_sha:
+        raise ValueError(f"sha do blob divergente (esperado {blob_sha}, obtido {actual})")
+
+
+def calculate_file_hash(file_path):
+    """Calcula hash SHA-256 do arquivo"""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_cache_path(cache_dir, blob_sha, name):
+    """Caminho do arquivo no cache endereçado pelo sha do blob"""
+    return os.path.join(cache_dir, blob_sha[:2], blob_sha, name)
+
+
+def get_cached_file(cache_dir, blob_sha, name):
+    """Retorna o arquivo em cache se existir e o SHA-256 gravado conferir"""
+    cache_path = get_cache_path(cache_dir, blob_sha, name)
+    hash_path = f"{cache_path}.sha256"
+    if not (os.path.exists(cache_path) and os.path.exists(hash_path)):
+        return None
+
+    with open(hash_path, 'r', encoding='utf-8') as f:
+        expected = f.read().strip()
+    if calculate_file_hash(cache_path) == expected:
+        return cache_path
+
+    print(f"\nCache corrompido para {name}, baixando novamente...")
+    os.remove(cache_path)
+    os.remove(hash_path)
+    return None
+
+
+def open_download(file_path, blob_sha=None, size=None):
+    """Abre um .part ao lado de file_path para gravar um download em blocos
+
+    Retorna o estado usado por write_download_chunk/finish_download. O
+    SHA-256 e, com o sha do blob e o tamanho conhecidos, o sha do git são
+    calculados bloco a bloco, sem reter o conteúdo em memória.
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    part_path = f"{file_path}.part-{threading.get_ident()}"
+    return {
+        'path': file_path,
+        'part_path': part_path,
+        'file': open(part_path, 'wb'),
+        'sha256': hashlib.sha256(),
+        'blob': hashlib.sha1(f"blob {size}\0".encode()) if blob_sha and size is not None else None,
+        'blob_sha': blob_sha,
+        'written': 0
+    }
+
+
+def write_download_chunk(download, chunk):
+    """Grava um bloco no .part e atualiza os hashes"""
+    download['sha256'].update(chunk)
+    if download['blob']:
+        download['blob'].update(chunk)
+    download['file'].write(chunk)
+    download['written'] += len(chunk)
+
+
+def finish_download(download):
+    """Confere o sha do blob e publica o .part por os.replace; retorna o SHA-256
+
+    Um leitor nunca vê o arquivo pela metade; conteúdo divergente não é
+    publicado (o .part fica para abort_download).
+    """
+    download['file'].close()
+    blob = download['blob']
+    if blob and blob.hexdigest() != download['blob_sha']:
+        raise ValueError(f"sha do blob divergente (esperado {download['blob_sha']}, obtido {blob.hexdigest()})")
+    os.replace(download['part_path'], download['path'])
+    return download['sha256'].hexdigest()
+
+
+def abort_download(download):
+    """Descarta o .part de um download que falhou"""
+    download['file'].close()
+    if os.path.exists(download['part_path']):
+        os.remove(download['part_path'])
+
+
+def write_cache_hash(cache_path, digest):
+    """Grava o .sha256 que valida a entrada do cache em get_cached_file"""
+    with open(f"{cache_path}.sha256", 'w', encoding='utf-8') as f:
+        f.write(digest)
+
+
+def store_cached_file(cache_dir, blob_sha, name, chunks, size):
+    """Grava no cache, bloco a bloco, um conteúdo de `size` bytes; retorna o caminho
+
+    O conteúdo só vira entrada de cache se conferir com o sha do blob.
+    """
+    cache_path = get_cache_path(cache_dir, blob_sha, name)
+    download = open_download(cache_path, blob_sha, size)
+    try:
+        for chunk in chunks:
+            write_download_chunk(download, chunk)
+        write_cache_hash(cache_path, finish_download(download))
+    except Exception:
+        abort_download(download)
+        raise
+    return cache_path
+
+
+def link_into_process_dir(source_path, file_path):
+    """Expõe o arquivo do cache no diretório da execução sem copiar os dados"""
+    try:
+        os.link(source_path, file_path)
+        return file_path
+    except OSError:
+        return source_path
@@ -0,0 +1,73 @@
+import functools
+
+# Registro de extratores de recursos FHIR. Cada resourceType habilitado é
+# ligado a uma função que devolve uma linha (tupla) ou None, e à tabela de
+# destino. O bundle é percorrido uma única vez, independentemente de quantos
+# tipos estejam habilitados: cada recurso é despachado pelo seu resourceType.
+
+EXTRACTORS = {}
+
+
+@functools.lru_cache(maxsize=65536)
+def clean_text(text):
+    """Substitui barras e colchetes nos textos (memoizado por texto distinto)."""
+    return text.replace("/", "-").replace("\\", "-").replace("[", "(").replace("]", ")")
+
+
+def register_extractor(resource_type, target, extract):
+    """Registra o extrator de um resourceType e a tabela de destino das linhas
+
+    A primeira posição da linha é o texto codificado no vocabulário do
+    destino; as demais correspondem às colunas extras declaradas para ele.
+    """
+    EXTRACTORS[resource_type] = {'target': target, 'extract': extract}
+
+
+def get_enabled_extractors(resource_types):
+    """Filtra o registro pelos tipos habilitados (ex.: 'Condition,Observation')"""
+    enabled = {t.strip() for t in resource_types.split(',') if t.strip()}
+    unknown = enabled - set(EXTRACTORS)
+    if unknown:
+        raise ValueError(f"Tipos de recurso sem extrator registrado: {', '.join(sorted(unknown))}")
+    return {t: spec for t, spec in EXTRACTORS.items() if t in enabled}
+
+
+def get_concept_text(concept):
+    """Texto de um CodeableConcept: 'text' ou, na falta dele, o primeiro display"""
+    text = concept.get('text')
+    if not text:
+        text = next((c.get('display') for c in concept.get('coding', []) if c.get('display')), '')
+    return text or ''
+
+
+def extract_condition(resource):
+    """Condition -> (condition_text,)"""
+    condition_text = clean_text(resource.get('code', {}).get('text', ''))
+    return (condition_text,) if condition_text else None
+
+
+def extract_medication_request(resource):
+    """MedicationRequest -> (medication_text,)"""
+    medication_text = clean_text(resource.get('medicationCodeableConcept', {}).get('text', ''))
+    return (medication_text,) if medication_text else None
+
+
+def extract_observation(resource):
+    """Observation -> (observation_text, value, unit, effective_at)"""
+    observation_text = clean_text(get_concept_text(resource.get('code', {})))
+    if not observation_text:
+        return None
+
+    quantity = resource.get('valueQuantity', {})
+    value = quantity.get('value')
+    return (
+        observation_text,
+        float(value) if isinstance(value, (int, float)) else None,
+        quantity.get('unit'),
+        resource.get('effectiveDateTime')
+    )
+
+
+register_extractor('Condition', 'conditions', extract_condition)
+register_extractor('MedicationRequest', 'medications', extract_medication_request)
+register_extractor('Observation', 'observations', extract_observation)
@@ -0,0 +1,79 @@
+import io
+
+try:
+    import ijson
+except ImportError:  # Dependência opcional: sem ela o pipeline usa json.load
+    ijson = None
+
+# Extração incremental de bundles FHIR: percorre o array "entry" em streaming
+# e materializa apenas os recursos dos tipos pedidos. Recursos de outros
+# tipos (Observation, Encounter...) são descartados assim que o resourceType
+# é lido, sem construir objetos Python para o restante da subárvore.
+
+RESOURCE_PREFIX = 'entry.item.resource'
+RESOURCE_TYPE_PREFIX = 'entry.item.resource.resourceType'
+
+
+def is_available():
+    """Indica se o backend de streaming (ijson) está instalado"""
+    return ijson is not None
+
+
+def iter_bundle_resources(f, resource_types):
+    """Gera os recursos do bundle cujo resourceType está em resource_types
+
+    f deve ser um arquivo aberto em modo binário. A memória de pico fica
+    limitada ao maior recurso materializado, não ao tamanho do arquivo.
+    """
+    builder = None
+    skipping = False
+    depth = 0
+
+    for prefix, event, value in ijson.parse(f, use_float=True):
+        if builder is None and not skipping:
+            if prefix != RESOURCE_PREFIX or event != 'start_map':
+                continue
+            builder = ijson.ObjectBuilder()
+            depth = 0
+
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+
+        if builder is not None:
+            if prefix == RESOURCE_TYPE_PREFIX and event == 'string' and value not in resource_types:
+                builder = None
+                skipping = True
+            else:
+                builder.event(event, value)
+
+        if depth == 0:
+            if builder is not None:
+                resource = builder.value
+                builder = None
+                if resource.get('resourceType') in resource_types:
+                    yield resource
+            skipping = False
+
+
+class MemoryViewReader(io.RawIOBase):
+    """Leitor de arquivo sobre um memoryview, copiando apenas o bloco pedido"""
+
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), len(self.view) - self.position)
+        buffer[:size] = self.view[self.position:self.position + size]
+        self.position += size
+        return size
+
+
+def open_memory(view):
+    """Abre um memoryview como arquivo binário sem duplicar o conteúdo"""
+    return io.BufferedReader(MemoryViewReader(view))
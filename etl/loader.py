@@ -11,7 +11,8 @@ import queue
 from datetime import datetime
 import subprocess
 import webbrowser
-from config.settings import DB_CONFIG_SQLITE, DB_CONFIG_POSTGRES
+from config.settings import DB_CONFIG_SQLITE, DB_CONFIG_POSTGRES, ETL_CONFIG
+from etl import downloads
 
 # Configurações de URL e diretórios
 DATA_URL = "https://api.github.com/repos/wandersondsm/teste_engenheiro/contents/data?ref=main"
@@ -79,9 +80,12 @@ def create_sqlite_schema(conn):
         )
     """)
 
-    # Criar índices
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conditions_text ON conditions(condition_text)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_medications_text ON medications(medication_text)")
+    # Criar índices; em bancos convertidos pelo loader_pipeline conditions e
+    # medications são views sobre vocabulários (já indexados) e não aceitam índice
+    for table, column in (('conditions', 'condition_text'), ('medications', 'medication_text')):
+        cursor.execute("SELECT type FROM sqlite_master WHERE name = ?", (table,))
+        if cursor.fetchone()[0] == 'table':
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_text ON {table}({column})")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_patients_gender ON patients(gender)")
     
     conn.commit()
@@ -275,8 +279,31 @@ def print_progress(current, total, prefix=""):
     percent = int(fraction * 100)
     print(f"\r{prefix} [{arrow}{spaces}] {percent}% ({current}/{total})", end="", flush=True)
 
+def fetch_file(session, name, meta):
+    """Baixa um arquivo para o diretório da execução; retorna (caminho, bytes baixados)"""
+    file_path = os.path.join(LOCAL_DATA_DIR, name)
+    try:
+        response = session.get(urljoin(RAW_BASE_URL, name), timeout=ETL_CONFIG['http_timeout'])
+        response.raise_for_status()
+
+        with open(file_path, 'wb') as f:
+            f.write(response.content)
+    except Exception:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    return file_path, len(response.content)
+
+def publish_download(name, file_path):
+    """Entrega o arquivo baixado ao processamento"""
+    global downloaded_count
+    download_queue.put(file_path)
+    with counter_lock:
+        downloaded_count += 1
+        print_progress(downloaded_count, total_to_download, prefix="Download")
+
 def download_files():
-    """Baixa os arquivos JSON do repositório e os adiciona à fila"""
+    """Baixa os arquivos JSON do repositório com um pool de workers e os adiciona à fila"""
     global downloaded_count, total_to_download, total_to_process
     start_time = time.time()
     conn = get_sqlite_connection()
@@ -297,32 +324,16 @@ def download_files():
         total_to_download = len(files_to_download)
         total_to_process = total_to_download
 
-        print(f"\nTotal de arquivos a baixar: {total_to_download}")
+        num_workers = max(1, min(ETL_CONFIG['download_workers'], total_to_download))
+        print(f"\nTotal de arquivos a baixar: {total_to_download} ({num_workers} workers)")
 
-        for name, meta in files_to_download.items():
-            file_url = urljoin(RAW_BASE_URL, name)
-            file_path = os.path.join(LOCAL_DATA_DIR, name)
-            
-            try:
-                response = requests.get(file_url)
-                response.raise_for_status()
-                
-                with open(file_path, 'wb') as f:
-                    f.write(response.content)
-                    
-                download_queue.put(file_path)
-                with counter_lock:
-                    downloaded_count += 1
-                    print_progress(downloaded_count, total_to_download, prefix="Download")
-            except Exception as e:
-                print(f"\nErro ao baixar {name}: {str(e)}")
-                if os.path.exists(file_path):
-                    os.remove(file_path)
+        downloads.run_download_workers(files_to_download, fetch_file, publish_download, num_workers)
         
         download_queue.put(None)
         elapsed = time.time() - start_time
         print(f"\nDownload concluído: {downloaded_count} novos arquivos")
         print(f"Tempo total: {int(elapsed // 60)}m {int(elapsed % 60)}s")
+        downloads.print_download_stats()
     finally:
         conn.close()
 
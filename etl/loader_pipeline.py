@@ -1,32 +1,57 @@
-import csv
 import os
+import glob
 import sys 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import io
 import json
 import sqlite3
 import psycopg2
-import requests
 import hashlib
+import zlib
 import time
 from urllib.parse import urljoin
 import threading
 import queue
+import multiprocessing
 from datetime import datetime
 import subprocess
 import webbrowser
-from config.settings import DB_CONFIG_SQLITE, DB_CONFIG_POSTGRES
+from config.settings import DB_CONFIG_SQLITE, DB_CONFIG_POSTGRES, ETL_CONFIG
 from app import routes
+from etl import async_fetch, downloads, extractors, fhir_stream, pg_copy, pg_pool, sources
+from etl.extractors import clean_text
 import traceback
 from psycopg2.extras import execute_batch
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Configurações de URL e diretórios
 DATA_URL = "https://api.github.com/repos/wandersondsm/teste_engenheiro/contents/data?ref=main"
 RAW_BASE_URL = "https://raw.githubusercontent.com/wandersondsm/teste_engenheiro/main/data/"
+# Só a subárvore data/ (sem recursive): o restante do repositório não entra na resposta
+TREE_URL = "https://api.github.com/repos/wandersondsm/teste_engenheiro/git/trees/main:data"
+DATA_PATH_PREFIX = "data/"
 LOCAL_DATA_DIR = None
+CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', ETL_CONFIG['cache_dir']))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+LISTING_CACHE_FILE = os.path.join(CACHE_DIR, 'remote_listing.json')
+RUN_JOURNAL_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'run_journal.jsonl'))
+
+def new_download_queue():
+    """Cria a fila entre download e parsing
+
+    Ela é limitada quando os itens carregam conteúdo, no modo em memória ou
+    com uma fonte tar/zip (membros entram como (nome, bytes)): se o parsing
+    atrasa, quem publica bloqueia (backpressure) em vez de acumular o
+    arquivo compactado inteiro em memória.
+    """
+    carries_content = ETL_CONFIG['in_memory'] or os.path.isfile(ETL_CONFIG['source'] or '')
+    return queue.Queue(maxsize=ETL_CONFIG['memory_queue_files'] if carries_content else 0)
 
 # Fila para armazenar arquivos baixados
-download_queue = queue.Queue()
+download_queue = new_download_queue()
+
+# Arquivamento assíncrono dos brutos baixados em memória (ETL_CONFIG['archive_raw'])
+archive_queue = queue.Queue(maxsize=ETL_CONFIG['memory_queue_files'])
 
 # Variáveis globais para controle de progresso
 downloaded_count = 0
@@ -37,6 +62,47 @@ total_to_process = 0
 
 counter_lock = threading.Lock()
 
+# Hash de conteúdo (sha do blob) de cada arquivo listado, gravado em processed_files
+listed_hashes = {}
+
+# Diário da execução corrente: arquivo aberto para append e último estado de cada arquivo
+run_journal = None
+journal_states = {}
+journal_lock = threading.Lock()
+journal_unsynced = 0  # Registros gravados desde o último fsync do diário
+
+# Vocabulários codificados por dicionário: os textos ficam uma única vez em
+# <vocab> e as tabelas de fatos guardam apenas inteiros. As views com os
+# nomes originais (conditions, medications) mantêm as consultas existentes.
+# 'columns' lista as colunas extras dos fatos, na ordem das linhas geradas
+# pelo extrator (etl/extractors.py) após o texto.
+SQLITE_VOCABULARIES = {
+    'conditions': {'vocab': 'condition_vocab', 'facts': 'condition_facts',
+                   'text': 'condition_text', 'id': 'condition_id'},
+    'medications': {'vocab': 'medication_vocab', 'facts': 'medication_facts',
+                    'text': 'medication_text', 'id': 'medication_id'},
+    'observations': {'vocab': 'observation_vocab', 'facts': 'observation_facts',
+                     'text': 'observation_text', 'id': 'observation_id',
+                     'columns': [('value', 'REAL'), ('unit', 'TEXT'), ('effective_at', 'TEXT')]}
+}
+
+# Domínios que existiam como tabelas antes dos vocabulários (upgrade e trigger)
+LEGACY_VOCABULARIES = ('conditions', 'medications')
+
+# Índices secundários do SQLite (removidos durante a carga em massa)
+SQLITE_INDEXES = {
+    'idx_condition_facts_condition': "CREATE INDEX IF NOT EXISTS idx_condition_facts_condition ON condition_facts(condition_id)",
+    'idx_condition_facts_patient': "CREATE INDEX IF NOT EXISTS idx_condition_facts_patient ON condition_facts(patient_key)",
+    'idx_medication_facts_medication': "CREATE INDEX IF NOT EXISTS idx_medication_facts_medication ON medication_facts(medication_id)",
+    'idx_medication_facts_patient': "CREATE INDEX IF NOT EXISTS idx_medication_facts_patient ON medication_facts(patient_key)",
+    'idx_observation_facts_observation': "CREATE INDEX IF NOT EXISTS idx_observation_facts_observation ON observation_facts(observation_id)",
+    'idx_observation_facts_patient': "CREATE INDEX IF NOT EXISTS idx_observation_facts_patient ON observation_facts(patient_key)",
+    'idx_patients_gender': "CREATE INDEX IF NOT EXISTS idx_patients_gender ON patients(gender)"
+}
+
+# Indica se a execução atual está em modo de carga em massa
+bulk_load_active = False
+
 def get_sqlite_connection():
     """Cria uma conexão com o banco de dados SQLite"""
     conn = sqlite3.connect(
@@ -46,63 +112,245 @@ def get_sqlite_connection():
     conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
+def get_sqlite_object_type(cursor, name):
+    """Retorna 'table', 'view' ou None para um objeto do SQLite"""
+    cursor.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
 def create_sqlite_schema(conn):
     """Cria as tabelas no SQLite com verificação de existência"""
     cursor = conn.cursor()
+
+    upgrade_sqlite_schema(conn)
     
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS patients (
-            patient_id TEXT PRIMARY KEY,
+            patient_key INTEGER PRIMARY KEY,
+            patient_id TEXT NOT NULL UNIQUE,
             gender TEXT,
             data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS conditions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_id TEXT,
-            condition_text TEXT,
-            data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(patient_id) REFERENCES patients(patient_id)
-        )
-    """)
+    for domain in SQLITE_VOCABULARIES.values():
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {domain['vocab']} (
+                id INTEGER PRIMARY KEY,
+                {domain['text']} TEXT NOT NULL UNIQUE
+            )
+        """)
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS medications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_id TEXT,
-            medication_text TEXT,
-            data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(patient_id) REFERENCES patients(patient_id)
-        )
-    """)
+        extra_columns = ''.join(f"{name} {sql_type},\n                "
+                                for name, sql_type in domain.get('columns', []))
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {domain['facts']} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patient_key INTEGER NOT NULL,
+                {domain['id']} INTEGER NOT NULL,
+                {extra_columns}data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(patient_key) REFERENCES patients(patient_key),
+                FOREIGN KEY({domain['id']}) REFERENCES {domain['vocab']}(id)
+            )
+        """)
+
+    for view, domain in SQLITE_VOCABULARIES.items():
+        # LEFT JOIN em patients permite ao SQLite omitir a junção quando
+        # patient_id não é usado (ex.: agregações por texto)
+        extra_columns = ''.join(f"f.{name} AS {name},\n                   "
+                                for name, _ in domain.get('columns', []))
+        cursor.execute(f"""
+            CREATE VIEW IF NOT EXISTS {view} AS
+            SELECT f.id AS id,
+                   p.patient_id AS patient_id,
+                   v.{domain['text']} AS {domain['text']},
+                   {extra_columns}f.data_inclusao AS data_inclusao
+            FROM {domain['facts']} f
+            JOIN {domain['vocab']} v ON v.id = f.{domain['id']}
+            LEFT JOIN patients p ON p.patient_key = f.patient_key
+        """)
+
+        # Compatibilidade com escritores antigos (ex.: etl/loader.py) que
+        # ainda inserem textos diretamente em conditions/medications; o
+        # create_sqlite_schema do loader não indexa essas views
+        if view not in LEGACY_VOCABULARIES:
+            continue
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {view}_insert INSTEAD OF INSERT ON {view}
+            BEGIN
+                INSERT OR IGNORE INTO {domain['vocab']} ({domain['text']}) VALUES (NEW.{domain['text']});
+                INSERT INTO {domain['facts']} (patient_key, {domain['id']})
+                SELECT p.patient_key, v.id
+                FROM patients p, {domain['vocab']} v
+                WHERE p.patient_id = NEW.patient_id AND v.{domain['text']} = NEW.{domain['text']};
+            END
+        """)
 
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS processed_files (
             file_name TEXT PRIMARY KEY,
+            content_hash TEXT,
+            patient_id TEXT,
             data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
 
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conditions_text ON conditions(condition_text)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_medications_text ON medications(medication_text)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_patients_gender ON patients(gender)")
+    # Bancos anteriores à detecção de alterações: as colunas novas ficam NULL
+    cursor.execute("PRAGMA table_info(processed_files)")
+    existing_columns = {row[1] for row in cursor.fetchall()}
+    for column in ('content_hash', 'patient_id'):
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE processed_files ADD COLUMN {column} TEXT")
+
+    for index_ddl in SQLITE_INDEXES.values():
+        cursor.execute(index_ddl)
     
     conn.commit()
     cursor.close()
 
+def upgrade_sqlite_schema(conn):
+    """Converte um banco no formato antigo (textos repetidos) para os vocabulários
+
+    Reconstrói patients com chave inteira, move os textos distintos para os
+    vocabulários, copia as linhas para as tabelas de fatos mantendo os ids e
+    troca as tabelas conditions/medications por views. Linhas sem paciente
+    correspondente ou sem texto não têm como ser ligadas: elas são guardadas
+    em quarentena (conditions_orphans/medications_orphans, com as colunas
+    originais) e informadas, para revisão ou recarga manual.
+    """
+    cursor = conn.cursor()
+    if get_sqlite_object_type(cursor, 'conditions') != 'table':
+        cursor.close()
+        return
+
+    print("\nAtualizando o SQLite para vocabulários codificados (executado uma única vez)...")
+    conn.commit()
+    cursor.execute("PRAGMA foreign_keys = OFF")
+    try:
+        cursor.execute("BEGIN")
+        cursor.execute("ALTER TABLE patients RENAME TO patients_old")
+        cursor.execute("""
+            CREATE TABLE patients (
+                patient_key INTEGER PRIMARY KEY,
+                patient_id TEXT NOT NULL UNIQUE,
+                gender TEXT,
+                data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            INSERT INTO patients (patient_id, gender, data_inclusao)
+            SELECT patient_id, gender, data_inclusao FROM patients_old
+            WHERE patient_id IS NOT NULL
+        """)
+
+        for view in LEGACY_VOCABULARIES:
+            domain = SQLITE_VOCABULARIES[view]
+            cursor.execute(f"""
+                CREATE TABLE {domain['vocab']} (
+                    id INTEGER PRIMARY KEY,
+                    {domain['text']} TEXT NOT NULL UNIQUE
+                )
+            """)
+            cursor.execute(f"""
+                CREATE TABLE {domain['facts']} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    patient_key INTEGER NOT NULL,
+                    {domain['id']} INTEGER NOT NULL,
+                    data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(patient_key) REFERENCES patients(patient_key),
+                    FOREIGN KEY({domain['id']}) REFERENCES {domain['vocab']}(id)
+                )
+            """)
+            cursor.execute(f"""
+                INSERT INTO {domain['vocab']} ({domain['text']})
+                SELECT DISTINCT {domain['text']} FROM {view}
+                WHERE {domain['text']} IS NOT NULL
+            """)
+            cursor.execute(f"""
+                INSERT INTO {domain['facts']} (id, patient_key, {domain['id']}, data_inclusao)
+                SELECT t.id, p.patient_key, v.id, t.data_inclusao
+                FROM {view} t
+                JOIN patients p ON p.patient_id = t.patient_id
+                JOIN {domain['vocab']} v ON v.{domain['text']} = t.{domain['text']}
+            """)
+            unlinked = f"FROM {view} WHERE id NOT IN (SELECT id FROM {domain['facts']})"
+            cursor.execute(f"SELECT COUNT(*) {unlinked}")
+            orphans = cursor.fetchone()[0]
+            if orphans:
+                cursor.execute(f"CREATE TABLE {view}_orphans AS SELECT * {unlinked}")
+                print(f"AVISO: {orphans} linhas de {view} sem paciente correspondente "
+                      f"ou sem texto foram guardadas em {view}_orphans")
+            cursor.execute(f"DROP TABLE {view}")
+
+        cursor.execute("DROP TABLE patients_old")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("PRAGMA foreign_keys = ON")
+        cursor.close()
+
+def apply_write_pragmas(conn):
+    """Aplica na conexão de escrita os pragmas do modo de carga em massa, se ativo"""
+    if bulk_load_active:
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{ETL_CONFIG['bulk_cache_kb']}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+def start_bulk_load_if_needed(conn):
+    """Ativa o modo de carga em massa na primeira carga (ou se forçado)
+
+    Passa o banco para WAL e remove os índices secundários; os escritores
+    usam synchronous=NORMAL e cache ampliado (apply_write_pragmas).
+    """
+    global bulk_load_active
+    mode = ETL_CONFIG['bulk_load']
+    if mode == 'never':
+        return False
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT EXISTS(SELECT 1 FROM processed_files)")
+    if mode != 'always' and cursor.fetchone()[0]:
+        cursor.close()
+        return False
+
+    print("\nModo de carga em massa ativado (WAL, sem índices secundários).")
+    cursor.execute("PRAGMA journal_mode = WAL")
+    for index_name in SQLITE_INDEXES:
+        cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+    conn.commit()
+    cursor.close()
+    bulk_load_active = True
+    return True
+
+def finish_bulk_load():
+    """Reconstrói os índices, executa ANALYZE e deixa o banco durável em disco"""
+    global bulk_load_active
+    start_time = time.time()
+    conn = get_sqlite_connection()
+    try:
+        print("\nReconstruindo índices do SQLite...")
+        cursor = conn.cursor()
+        cursor.execute(f"PRAGMA cache_size = -{ETL_CONFIG['bulk_cache_kb']}")
+        for index_ddl in SQLITE_INDEXES.values():
+            cursor.execute(index_ddl)
+        cursor.execute("ANALYZE")
+        conn.commit()
+        cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        cursor.execute("PRAGMA journal_mode = DELETE")
+        cursor.close()
+        elapsed = time.time() - start_time
+        print(f"Índices reconstruídos em {format_time(elapsed)}")
+    finally:
+        conn.close()
+        bulk_load_active = False
+
 def get_postgres_connection():
-    """Cria uma conexão com o banco de dados PostgreSQL"""
+    """Empresta uma conexão do pool do PostgreSQL (devolver com release_postgres_connection)"""
     try:
-        conn = psycopg2.connect(
-            dbname=DB_CONFIG_POSTGRES['dbname'],
-            user=DB_CONFIG_POSTGRES['user'],
-            password=DB_CONFIG_POSTGRES['password'],
-            host=DB_CONFIG_POSTGRES['host'],
-            port=DB_CONFIG_POSTGRES['port']
-        )
-        return conn
+        return pg_pool.get_connection()
     except psycopg2.Error as e:
         print(f"Erro ao conectar ao PostgreSQL: {e}")
         print("\n❌ ERRO DE CONEXÃO COM O POSTGRESQL:")
@@ -111,6 +359,10 @@ def get_postgres_connection():
         print(f"\nArquivo de configuração: config/settings.py")
         return None
 
+def release_postgres_connection(conn):
+    """Devolve ao pool uma conexão obtida por get_postgres_connection"""
+    pg_pool.release_connection(conn)
+
 def create_postgres_schema(conn):
     """Cria o schema e as tabelas no PostgreSQL com a coluna data_inclusao"""
     try:
@@ -132,6 +384,7 @@ def create_postgres_schema(conn):
         cursor.execute(f"""
             CREATE TABLE IF NOT EXISTS {DB_CONFIG_POSTGRES['schema']}.conditions (
                 id SERIAL PRIMARY KEY,
+                source_id BIGINT,
                 patient_id TEXT,
                 condition_text TEXT,
                 data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -142,6 +395,7 @@ def create_postgres_schema(conn):
         cursor.execute(f"""
             CREATE TABLE IF NOT EXISTS {DB_CONFIG_POSTGRES['schema']}.medications (
                 id SERIAL PRIMARY KEY,
+                source_id BIGINT,
                 patient_id TEXT,
                 medication_text TEXT,
                 data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -152,6 +406,7 @@ def create_postgres_schema(conn):
         cursor.execute(f"""
             CREATE TABLE IF NOT EXISTS {DB_CONFIG_POSTGRES['schema']}.processed_files (
                 file_name TEXT PRIMARY KEY,
+                source_rowid BIGINT,
                 data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
@@ -212,6 +467,7 @@ def create_postgres_schema(conn):
             f"""
             CREATE TABLE IF NOT EXISTS {DB_CONFIG_POSTGRES['schema']}.conditions (
                 id SERIAL PRIMARY KEY,
+                source_id BIGINT,
                 patient_id TEXT REFERENCES {DB_CONFIG_POSTGRES['schema']}.patients(patient_id),
                 condition_text TEXT,
                 data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -220,6 +476,7 @@ def create_postgres_schema(conn):
             f"""
             CREATE TABLE IF NOT EXISTS {DB_CONFIG_POSTGRES['schema']}.medications (
                 id SERIAL PRIMARY KEY,
+                source_id BIGINT,
                 patient_id TEXT REFERENCES {DB_CONFIG_POSTGRES['schema']}.patients(patient_id),
                 medication_text TEXT,
                 data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -228,6 +485,7 @@ def create_postgres_schema(conn):
             f"""
             CREATE TABLE IF NOT EXISTS {DB_CONFIG_POSTGRES['schema']}.processed_files (
                 file_name TEXT PRIMARY KEY,
+                source_rowid BIGINT,
                 data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
             """,
@@ -251,18 +509,64 @@ def create_postgres_schema(conn):
                 count INTEGER,
                 data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
+            """,
+            # Controle da migração incremental: faixas de chave do SQLite já
+            # copiadas por tabela (a maior range_end é a marca d'água)
+            f"""
+            CREATE TABLE IF NOT EXISTS {DB_CONFIG_POSTGRES['schema']}.migration_watermarks (
+                table_name TEXT,
+                range_start BIGINT,
+                range_end BIGINT,
+                data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (table_name, range_start)
+            )
+            """,
+            # Variações de contagem (delta com sinal) por chave (texto/gênero)
+            # desde o último refresh dos agregados; sem chave única para que
+            # faixas paralelas não se bloqueiem ao registrar o mesmo texto
+            f"""
+            CREATE TABLE IF NOT EXISTS {DB_CONFIG_POSTGRES['schema']}.aggregate_changes (
+                table_name TEXT,
+                key TEXT,
+                delta INTEGER,
+                data_inclusao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
             """
         ]
         
         # Executar todas as DDLs
         for table_ddl in tables:
             cursor.execute(table_ddl)
-        
+
+        # source_id (id da linha no SQLite) em bancos criados antes da coluna
+        for table in ('conditions', 'medications'):
+            cursor.execute(f"ALTER TABLE {DB_CONFIG_POSTGRES['schema']}.{table} ADD COLUMN IF NOT EXISTS source_id BIGINT")
+        # source_rowid (rowid do arquivo no SQLite) identifica a versão migrada de cada arquivo
+        cursor.execute(f"ALTER TABLE {DB_CONFIG_POSTGRES['schema']}.processed_files ADD COLUMN IF NOT EXISTS source_rowid BIGINT")
+        # delta em aggregate_changes: registros anteriores (só a chave) ficam NULL e forçam recontagem
+        cursor.execute(f"ALTER TABLE {DB_CONFIG_POSTGRES['schema']}.aggregate_changes ADD COLUMN IF NOT EXISTS delta INTEGER")
+
+        # FKs removidas por uma carga inicial interrompida antes de rebuild_indexes
+        for table in ('conditions', 'medications'):
+            cursor.execute("""
+                SELECT 1 FROM pg_constraint
+                WHERE conrelid = to_regclass(%s) AND contype = 'f'
+            """, (f"{DB_CONFIG_POSTGRES['schema']}.{table}",))
+            if cursor.fetchone() is None:
+                cursor.execute(f"""
+                    ALTER TABLE {DB_CONFIG_POSTGRES['schema']}.{table}
+                    ADD CONSTRAINT {table}_patient_id_fkey FOREIGN KEY (patient_id)
+                    REFERENCES {DB_CONFIG_POSTGRES['schema']}.patients(patient_id)
+                """)
+
         # 3. Criar índices com nomes qualificados
         indexes = [
             f"CREATE INDEX IF NOT EXISTS idx_conditions_text ON {DB_CONFIG_POSTGRES['schema']}.conditions(condition_text)",
             f"CREATE INDEX IF NOT EXISTS idx_medications_text ON {DB_CONFIG_POSTGRES['schema']}.medications(medication_text)",
-            f"CREATE INDEX IF NOT EXISTS idx_patients_gender ON {DB_CONFIG_POSTGRES['schema']}.patients(gender)"
+            f"CREATE INDEX IF NOT EXISTS idx_patients_gender ON {DB_CONFIG_POSTGRES['schema']}.patients(gender)",
+            # Chaves de conflito da mesclagem a partir da staging (ON CONFLICT)
+            f"CREATE UNIQUE INDEX IF NOT EXISTS idx_conditions_source_id ON {DB_CONFIG_POSTGRES['schema']}.conditions(source_id)",
+            f"CREATE UNIQUE INDEX IF NOT EXISTS idx_medications_source_id ON {DB_CONFIG_POSTGRES['schema']}.medications(source_id)"
         ]
         
         for index_ddl in indexes:
@@ -277,44 +581,39 @@ def create_postgres_schema(conn):
         if cursor:
             cursor.close()
 
+def postgres_table_exists(conn, table_name):
+    """Verifica se a tabela existe no schema do PostgreSQL"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", (f"{DB_CONFIG_POSTGRES['schema']}.{table_name}",))
+        return cursor.fetchone()[0] is not None
+
 def check_migration_status():
-    """Verifica de forma segura se a migração foi completada"""
+    """Verifica se o PostgreSQL está em dia com o SQLite
+
+    Em dia significa nenhuma linha do SQLite fora das faixas já registradas
+    em migration_watermarks; linhas ingeridas depois da última migração
+    tornam a migração (incremental) pendente de novo.
+    """
+    sqlite_conn = None
+    conn = None
     try:
         conn = get_postgres_connection()
-        cursor = conn.cursor()
-        
-        # Verificar existência do schema
-        cursor.execute("SELECT EXISTS(SELECT 1 FROM information_schema.schemata WHERE schema_name = %s)", 
-                      (DB_CONFIG_POSTGRES['schema'],))
-        if not cursor.fetchone()[0]:
+        if conn is None:
             return False
-            
-        # Verificar existência das tabelas
-        required_tables = {'patients', 'conditions', 'medications', 'processed_files'}
-        cursor.execute("""
-            SELECT table_name 
-            FROM information_schema.tables 
-            WHERE table_schema = %s
-        """, (DB_CONFIG_POSTGRES['schema'],))
-        existing_tables = {row[0] for row in cursor.fetchall()}
-        
-        if not required_tables.issubset(existing_tables):
+        # Sem a tabela de controle nada foi migrado com marca d'água ainda
+        if not postgres_table_exists(conn, 'migration_watermarks'):
             return False
-            
-        # Verificar dados
-        for table in required_tables:
-            cursor.execute(f"SELECT EXISTS(SELECT 1 FROM {DB_CONFIG_POSTGRES['schema']}.{table} LIMIT 1)")
-            if not cursor.fetchone()[0]:
-                return False
-                
-        return True
-        
-    except psycopg2.Error as e:
-        print(f"\nERRO POSTGRESQL: {str(e)}")
+
+        sqlite_conn = get_sqlite_connection()
+        pending = get_pending_migration(sqlite_conn, conn)
+        return not any(count for ranges in pending.values() for _, _, count in ranges)
+
+    except (psycopg2.Error, sqlite3.Error) as e:
+        print(f"\nERRO AO VERIFICAR A MIGRAÇÃO: {str(e)}")
         return False
     finally:
-        if 'cursor' in locals(): cursor.close()
-        if 'conn' in locals(): conn.close()
+        if sqlite_conn: sqlite_conn.close()
+        if conn: release_postgres_connection(conn)
 
 def validate_data_for_postgres(conn):
     """Valida os dados do SQLite para migração para o PostgreSQL"""
@@ -418,21 +717,25 @@ def check_cancel():
     return False
 
 def disable_indexes(conn):
-    """Desabilita índices durante a migração (Ajustado para PostgreSQL)"""
+    """Remove os índices secundários antes da carga inicial e devolve [(nome, definição)]
+
+    As definições (CREATE INDEX ...) são lidas de pg_indexes antes do DROP,
+    para a reconstrução em rebuild_indexes.
+    """
     cursor = conn.cursor()
     try:
-        # Consulta corrigida com comentário PostgreSQL válido
         cursor.execute(f"""
-            SELECT indexname 
+            SELECT indexname, indexdef
             FROM pg_indexes 
             WHERE schemaname = %s
             AND tablename IN ('patients', 'conditions', 'medications')
             AND indexname NOT LIKE '%%_pkey'  -- Não remove chaves primárias
+            AND indexdef NOT LIKE 'CREATE UNIQUE%%'  -- Nem as chaves do ON CONFLICT
         """, (DB_CONFIG_POSTGRES['schema'],))
         
-        indexes = [row[0] for row in cursor.fetchall()]
+        indexes = cursor.fetchall()
         
-        for index in indexes:
+        for index, _ in indexes:
             # Usar IF EXISTS para evitar erros
             cursor.execute(f"DROP INDEX IF EXISTS {DB_CONFIG_POSTGRES['schema']}.{index}")
         
@@ -443,29 +746,393 @@ def disable_indexes(conn):
         print(f"Erro ao desabilitar índices: {str(e)}")
         return []
 
-def rebuild_indexes(conn, indexes):
-    """Recria índices após migração (Ajustado para PostgreSQL)"""
+def disable_foreign_keys(conn):
+    """Remove as FKs de conditions/medications antes da carga inicial e devolve [(tabela, nome, definição)]
+
+    Sem elas o COPY não consulta patients linha a linha e as tabelas de fatos
+    podem ser carregadas junto com patients. A integridade é conferida de
+    uma vez depois (NOT VALID + VALIDATE em rebuild_indexes); os dados já
+    passaram por validate_data_for_postgres no SQLite.
+    """
     cursor = conn.cursor()
     try:
-        # Recriar índices usando definições originais
-        cursor.execute(f"""
-            SELECT indexdef 
-            FROM pg_indexes 
-            WHERE schemaname = '{DB_CONFIG_POSTGRES['schema']}'
-            AND indexname = ANY(%s)
-        """, (indexes,))
-        
-        for row in cursor.fetchall():
-            cursor.execute(row[0])
-        
+        # Filtro por pg_class/pg_namespace (regclass::text sai sem schema com o
+        # search_path do pool); search_path vazio faz pg_get_constraintdef
+        # qualificar a tabela referenciada
+        cursor.execute("SET LOCAL search_path = pg_catalog")
+        cursor.execute("""
+            SELECT format('%%I.%%I', n.nspname, t.relname), quote_ident(c.conname), pg_get_constraintdef(c.oid)
+            FROM pg_constraint c
+            JOIN pg_class t ON t.oid = c.conrelid
+            JOIN pg_namespace n ON n.oid = t.relnamespace
+            WHERE n.nspname = %s
+            AND c.contype = 'f'
+            AND t.relname = ANY(%s)
+        """, (DB_CONFIG_POSTGRES['schema'], ['conditions', 'medications']))
+
+        foreign_keys = cursor.fetchall()
+
+        for table, constraint, _ in foreign_keys:
+            cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {constraint}")
+
         conn.commit()
+        return foreign_keys
+    except Exception as e:
+        conn.rollback()
+        print(f"Erro ao desabilitar chaves estrangeiras: {str(e)}")
+        return []
+
+def run_maintenance_statement(statement, maintenance_mem_mb):
+    """Executa um CREATE INDEX / VALIDATE / ANALYZE numa conexão própria do pool"""
+    conn = get_postgres_connection()
+    if conn is None:
+        raise Exception("Falha ao conectar ao PostgreSQL.")
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"SET maintenance_work_mem = '{maintenance_mem_mb}MB'")
+            cursor.execute(statement)
+            cursor.execute("RESET maintenance_work_mem")
+    finally:
+        # Numa conexão perdida o reset falha: ela é descartada, mas a vaga do pool sempre volta
+        reset = False
+        try:
+            conn.autocommit = False
+            reset = True
+        except psycopg2.Error:
+            pass
+        finally:
+            pg_pool.release_connection(conn, close=not reset)
+
+def run_maintenance_statements(statements, workers, maintenance_mem_mb, label):
+    """Executa as instruções em paralelo, uma conexão por worker, com progresso"""
+    completed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_maintenance_statement, statement, maintenance_mem_mb): statement
+                   for statement in statements}
+        for future in as_completed(futures):
+            future.result()
+            completed += 1
+            print_progress(completed, len(statements), prefix=label)
+    print()
+
+def rebuild_indexes(conn, indexes, foreign_keys=(), workers=1):
+    """Recria índices e FKs após a carga inicial, em paralelo entre conexões, e roda ANALYZE
+
+    As FKs voltam como NOT VALID (sem varrer as tabelas, só bloqueio curto)
+    e são validadas junto com os CREATE INDEX, cada instrução em sua conexão.
+    ETL_INDEX_BUILD_MEM_MB é dividido entre os workers (maintenance_work_mem
+    de cada sessão).
+    """
+    start_time = time.time()
+    statements = [indexdef for _, indexdef in indexes]
+    try:
+        with conn.cursor() as cursor:
+            for table, constraint, definition in foreign_keys:
+                cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {constraint} {definition} NOT VALID")
+                statements.append(f"ALTER TABLE {table} VALIDATE CONSTRAINT {constraint}")
+        conn.commit()
+
+        workers = max(1, min(workers, len(statements)))
+        maintenance_mem_mb = max(64, ETL_CONFIG['index_build_mem_mb'] // workers)
+        print(f"\nReconstruindo {len(indexes)} índices e {len(foreign_keys)} FKs "
+              f"({workers} conexões, maintenance_work_mem {maintenance_mem_mb}MB cada)")
+        if statements:
+            run_maintenance_statements(statements, workers, maintenance_mem_mb, "Índices/FKs")
+
+        tables = ('patients', 'conditions', 'medications', 'processed_files')
+        run_maintenance_statements(
+            [f"ANALYZE {DB_CONFIG_POSTGRES['schema']}.{table}" for table in tables],
+            min(workers, len(tables)), maintenance_mem_mb, "ANALYZE"
+        )
+        print(f"Índices, FKs e estatísticas prontos em {format_time(time.time() - start_time)}")
     except Exception as e:
         conn.rollback()
         print(f"Erro ao reconstruir índices: {str(e)}")
 
-def migrate_table_with_copy(sqlite_db_path, table_name, columns, query):
-    """Migra dados usando COPY para melhor performance"""
-    temp_file = None
+# Tipos das colunas migradas para o COPY binário (as demais são TEXT)
+COPY_COLUMN_TYPES = {
+    'source_id': 'bigint',
+    'source_rowid': 'bigint',
+    'data_inclusao': 'timestamp',
+    'count': 'integer'
+}
+
+# Tabelas migradas: colunas, consulta no SQLite e a chave inteira crescente
+# (id/rowid) usada como marca d'água e para dividir em faixas
+MIGRATION_TABLES = {
+    'patients': ('patient_id,gender,data_inclusao', "SELECT patient_id, gender, data_inclusao FROM patients", 'patient_key'),
+    'conditions': ('source_id,patient_id,condition_text,data_inclusao', "SELECT id, patient_id, condition_text, data_inclusao FROM conditions", 'id'),
+    'medications': ('source_id,patient_id,medication_text,data_inclusao', "SELECT id, patient_id, medication_text, data_inclusao FROM medications", 'id'),
+    'processed_files': ('file_name,source_rowid,data_inclusao', "SELECT file_name, rowid, data_inclusao FROM processed_files", 'rowid')
+}
+
+# Mesclagem da staging no destino: linhas já presentes (recarga ou nova
+# tentativa de uma faixa) não abortam a carga
+MIGRATION_CONFLICTS = {
+    'patients': "(patient_id) DO NOTHING",
+    'conditions': "(source_id) DO NOTHING",
+    'medications': "(source_id) DO NOTHING",
+    'processed_files': "(file_name) DO UPDATE SET source_rowid = EXCLUDED.source_rowid, data_inclusao = EXCLUDED.data_inclusao"
+}
+
+# Chave natural que identifica, nas tabelas da migração anterior às marcas
+# d'água, as linhas do SQLite já presentes no PostgreSQL (bootstrap_watermarks)
+BOOTSTRAP_NATURAL_KEYS = {
+    'patients': 'patient_id',
+    'processed_files': 'file_name'
+}
+
+# patients (e processed_files) entram antes, pois conditions e medications
+# referenciam patients por chave estrangeira
+MIGRATION_PHASES = [('patients', 'processed_files'), ('conditions', 'medications')]
+
+# Agregados mantidos dentro do PostgreSQL: tabela de origem e coluna
+# agrupada. Guardam a contagem completa; qualquer top-N sai de
+# ORDER BY count DESC LIMIT N
+AGGREGATE_TABLES = {
+    'aggregated_conditions': ('conditions', 'condition_text'),
+    'aggregated_medications': ('medications', 'medication_text'),
+    'gender_stats': ('patients', 'gender')
+}
+AGGREGATE_KEYS = {source: column for source, column in AGGREGATE_TABLES.values()}
+
+def get_key_bounds(sqlite_conn, table, key):
+    """Menor e maior chave da tabela, lidas pelas pontas da ordem da chave (sem varrer a tabela)"""
+    cursor = sqlite_conn.cursor()
+    cursor.execute(f"""
+        SELECT (SELECT {key} FROM {table} ORDER BY {key} LIMIT 1),
+               (SELECT {key} FROM {table} ORDER BY {key} DESC LIMIT 1)
+    """)
+    bounds = cursor.fetchone()
+    cursor.close()
+    return bounds
+
+def get_migrated_ranges(postgres_conn):
+    """Faixas de chave já migradas de cada tabela, em ordem (migration_watermarks)"""
+    ranges = {table: [] for table in MIGRATION_TABLES}
+    with postgres_conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT table_name, range_start, range_end
+            FROM {DB_CONFIG_POSTGRES['schema']}.migration_watermarks
+            ORDER BY table_name, range_start
+        """)
+        for table, range_start, range_end in cursor.fetchall():
+            ranges.setdefault(table, []).append((range_start, range_end))
+    return ranges
+
+def get_pending_ranges(migrated, low, high):
+    """Faixas de [low, high] não cobertas pelas faixas migradas
+
+    Normalmente é só o intervalo acima da marca d'água; lacunas de faixas que
+    falharam numa execução anterior também voltam a ser copiadas.
+    """
+    pending = []
+    next_key = low
+    for range_start, range_end in migrated:
+        if next_key > high:
+            break
+        if range_start > next_key:
+            pending.append((next_key, min(range_start - 1, high)))
+        next_key = max(next_key, range_end + 1)
+    if next_key <= high:
+        pending.append((next_key, high))
+    return pending
+
+def get_pending_migration(sqlite_conn, postgres_conn):
+    """Faixas pendentes de cada tabela com o número de linhas: {tabela: [(início, fim, linhas)]}"""
+    migrated = get_migrated_ranges(postgres_conn)
+    pending = {}
+    cursor = sqlite_conn.cursor()
+    for table, (_, _, key) in MIGRATION_TABLES.items():
+        pending[table] = []
+        low, high = get_key_bounds(sqlite_conn, table, key)
+        if low is None:
+            continue
+        for range_start, range_end in get_pending_ranges(migrated[table], low, high):
+            cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {key} BETWEEN ? AND ?", (range_start, range_end))
+            pending[table].append((range_start, range_end, cursor.fetchone()[0]))
+    cursor.close()
+    return pending
+
+def iter_migrated_keys(sqlite_conn, pg_cursor, table, key):
+    """Percorre as chaves do SQLite em ordem indicando se a linha já está no PostgreSQL
+
+    patients e processed_files são conferidos pela chave natural, em lotes
+    de migration_chunk_rows. As tabelas de fatos da migração antiga não têm
+    chave natural (source_id vazio): valem as linhas do SQLite incluídas até
+    a última data_inclusao presente no PostgreSQL.
+    """
+    schema = DB_CONFIG_POSTGRES['schema']
+    natural_key = BOOTSTRAP_NATURAL_KEYS.get(table)
+    sqlite_cursor = sqlite_conn.cursor()
+    try:
+        if natural_key:
+            sqlite_cursor.execute(f"SELECT {key}, {natural_key} FROM {table} ORDER BY {key}")
+            while rows := sqlite_cursor.fetchmany(ETL_CONFIG['migration_chunk_rows']):
+                pg_cursor.execute(f"SELECT {natural_key} FROM {schema}.{table} WHERE {natural_key} = ANY(%s)",
+                                  ([value for _, value in rows],))
+                present = {value for value, in pg_cursor.fetchall()}
+                for key_value, value in rows:
+                    yield key_value, value in present
+            return
+
+        pg_cursor.execute(f"SELECT MAX(data_inclusao) FROM {schema}.{table}")
+        cutoff = pg_cursor.fetchone()[0]
+        if cutoff is None:
+            return
+        sqlite_cursor.execute(f"SELECT {key}, data_inclusao <= ? FROM {table} ORDER BY {key}",
+                              (cutoff.strftime('%Y-%m-%d %H:%M:%S'),))
+        for key_value, migrated in sqlite_cursor:
+            yield key_value, bool(migrated)
+    finally:
+        sqlite_cursor.close()
+
+def get_covered_ranges(migrated_keys):
+    """Agrupa as chaves já migradas em faixas contíguas (na ordem das chaves do SQLite)"""
+    ranges = []
+    range_start = range_end = None
+    for key_value, migrated in migrated_keys:
+        if migrated:
+            if range_start is None:
+                range_start = key_value
+            range_end = key_value
+        elif range_start is not None:
+            ranges.append((range_start, range_end))
+            range_start = None
+    if range_start is not None:
+        ranges.append((range_start, range_end))
+    return ranges
+
+def bootstrap_watermarks(sqlite_conn, postgres_conn):
+    """Registra como migradas as linhas carregadas antes do controle por marca d'água
+
+    Uma tabela com linhas no PostgreSQL e nenhuma faixa registrada veio da
+    migração completa anterior. Só as linhas do SQLite que ela de fato
+    contém (iter_migrated_keys) viram faixas migradas; o que foi ingerido
+    depois dela fica pendente e é copiado.
+    """
+    migrated = get_migrated_ranges(postgres_conn)
+    with postgres_conn.cursor() as cursor:
+        for table, (_, _, key) in MIGRATION_TABLES.items():
+            if migrated[table]:
+                continue
+            cursor.execute(f"SELECT EXISTS(SELECT 1 FROM {DB_CONFIG_POSTGRES['schema']}.{table})")
+            if not cursor.fetchone()[0]:
+                continue
+            covered = get_covered_ranges(iter_migrated_keys(sqlite_conn, cursor, table, key))
+            for key_range in covered:
+                record_migrated_range(cursor, table, key_range)
+            if covered:
+                print(f"• {table}: dados de uma migração anterior, {len(covered)} faixas já migradas "
+                      f"(até {covered[-1][1]:,})")
+    postgres_conn.commit()
+
+def record_migrated_range(pg_cursor, table_name, key_range):
+    """Registra a faixa copiada na transação corrente (confirmada junto com os dados)"""
+    pg_cursor.execute(
+        f"INSERT INTO {DB_CONFIG_POSTGRES['schema']}.migration_watermarks (table_name, range_start, range_end) "
+        "VALUES (%s, %s, %s)",
+        (table_name, *key_range)
+    )
+
+def remove_replaced_files(pg_cursor, sqlite_conn, key_range):
+    """Remove do PostgreSQL as versões anteriores dos arquivos de uma faixa de processed_files
+
+    Um arquivo alterado na origem é regravado no SQLite com rowid novo e
+    reaparece acima da marca d'água. A linha anterior em processed_files
+    (source_rowid diferente) e os fatos do paciente saem na mesma transação
+    do COPY (os fatos novos chegam na fase seguinte, acima das marcas de
+    conditions e medications) e o gênero do paciente é atualizado. Uma faixa
+    copiada de novo sem alteração mantém o source_rowid e não remove nada.
+    Os fatos removidos entram em aggregate_changes com delta -1; o gênero
+    anterior com -1 e o novo com +1.
+    """
+    schema = DB_CONFIG_POSTGRES['schema']
+    rows = sqlite_conn.execute("""
+        SELECT f.file_name, f.rowid, f.patient_id, p.gender
+        FROM processed_files f
+        LEFT JOIN patients p ON p.patient_id = f.patient_id
+        WHERE f.rowid BETWEEN ? AND ?
+    """, key_range).fetchall()
+
+    pg_cursor.execute(f"""
+        DELETE FROM {schema}.processed_files pf
+        USING unnest(%s::text[], %s::bigint[]) AS s(file_name, source_rowid)
+        WHERE pf.file_name = s.file_name AND pf.source_rowid IS DISTINCT FROM s.source_rowid
+        RETURNING pf.file_name
+    """, ([row[0] for row in rows], [row[1] for row in rows]))
+    replaced = {file_name for file_name, in pg_cursor.fetchall()}
+    patients = [(gender, patient_id) for file_name, _, patient_id, gender in rows
+                if file_name in replaced and patient_id]
+    if patients:
+        patient_ids = [patient_id for _, patient_id in patients]
+        for table in ('conditions', 'medications'):
+            mark_aggregate_changes(
+                pg_cursor, table, 'deleted', -1, (patient_ids,),
+                with_clause=f"WITH deleted AS (DELETE FROM {schema}.{table} WHERE patient_id = ANY(%s) "
+                            f"RETURNING {AGGREGATE_KEYS[table]})"
+            )
+        # Gênero anterior sai da contagem e o novo entra
+        genders = f"WITH affected AS (SELECT gender FROM {schema}.patients WHERE patient_id = ANY(%s))"
+        mark_aggregate_changes(pg_cursor, 'patients', 'affected', -1, (patient_ids,), with_clause=genders)
+        execute_batch(pg_cursor, f"UPDATE {schema}.patients SET gender = %s WHERE patient_id = %s", patients)
+        mark_aggregate_changes(pg_cursor, 'patients', 'affected', 1, (patient_ids,), with_clause=genders)
+    return len(replaced)
+
+def mark_aggregate_changes(pg_cursor, table_name, source, sign, params=(), with_clause=''):
+    """Registra em aggregate_changes a variação de contagem de cada chave (texto/gênero) de source
+
+    source é uma CTE de with_clause (ex.: INSERT/DELETE ... RETURNING) cujas
+    linhas somam sign (+1 ou -1) à sua chave; params são os da with_clause.
+    Roda na transação de quem alterou os dados.
+    """
+    column = AGGREGATE_KEYS[table_name]
+    pg_cursor.execute(
+        f"{with_clause} INSERT INTO {DB_CONFIG_POSTGRES['schema']}.aggregate_changes (table_name, key, delta) "
+        f"SELECT %s, {column}, %s * COUNT(*) FROM {source} WHERE {column} IS NOT NULL GROUP BY {column}",
+        (*params, table_name, sign)
+    )
+
+def create_staging_table(pg_cursor, table_name, columns, key_range=None):
+    """Cria a tabela UNLOGGED que recebe o COPY de uma faixa (sem WAL nem restrições)"""
+    schema = DB_CONFIG_POSTGRES['schema']
+    suffix = f"_{key_range[0]}_{key_range[1]}" if key_range else ''
+    staging = f"{schema}.staging_{table_name}{suffix}"
+    pg_cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+    pg_cursor.execute(
+        f"CREATE UNLOGGED TABLE {staging} AS "
+        f"SELECT {','.join(columns)} FROM {schema}.{table_name} WITH NO DATA"
+    )
+    return staging
+
+def merge_staging_table(pg_cursor, staging, table_name, columns):
+    """Mescla a staging no destino com um único INSERT ... SELECT ... ON CONFLICT e a descarta
+
+    Nas tabelas agregadas só as linhas de fato inseridas (RETURNING) somam
+    +1 às suas chaves em aggregate_changes; as já existentes não contam.
+    """
+    column_list = ','.join(columns)
+    merge = (f"INSERT INTO {DB_CONFIG_POSTGRES['schema']}.{table_name} ({column_list}) "
+             f"SELECT {column_list} FROM {staging} "
+             f"ON CONFLICT {MIGRATION_CONFLICTS[table_name]}")
+    if table_name in AGGREGATE_KEYS:
+        mark_aggregate_changes(pg_cursor, table_name, 'merged', 1,
+                               with_clause=f"WITH merged AS ({merge} RETURNING {AGGREGATE_KEYS[table_name]})")
+    else:
+        pg_cursor.execute(merge)
+    pg_cursor.execute(f"DROP TABLE {staging}")
+
+def migrate_table_with_copy(sqlite_db_path, table_name, columns, query, key_range=None):
+    """Migra dados usando COPY, lendo o SQLite em lotes direto para o STDIN do PostgreSQL
+
+    O formato segue ETL_CONFIG['copy_format']: 'csv' ou 'binary' (sem
+    conversão para texto no cliente nem parsing de CSV no servidor). O COPY
+    vai para uma staging UNLOGGED, mesclada no destino com ON CONFLICT: uma
+    linha já existente não aborta a faixa e recargas são idempotentes. Com
+    key_range, a consulta é filtrada pela faixa e a faixa é registrada em
+    migration_watermarks no mesmo commit dos dados.
+    """
     postgres_conn = None
     sqlite_conn = None
     
@@ -476,47 +1143,26 @@ def migrate_table_with_copy(sqlite_db_path, table_name, columns, query):
             check_same_thread=False  # Permitir acesso de múltiplas threads
         )
         sqlite_cursor = sqlite_conn.cursor()
-        
-        # Exportar para CSV com tratamento seguro
-        temp_file = f"{table_name}.csv"
-        with open(temp_file, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.writer(f)
-            
-            # Escrever cabeçalho
-            writer.writerow(columns)
-            
-            sqlite_cursor.execute(query)
-            
-            while True:
-                batch = sqlite_cursor.fetchmany(5000)
-                if not batch:
-                    break
-                
-                # Processar linhas com tratamento de caracteres
-                cleaned_batch = []
-                for row in batch:
-                    cleaned_row = []
-                    for item in row:
-                        # Converter para string e limpar caracteres problemáticos
-                        str_item = str(item) if item is not None else ''
-                        str_item = str_item.replace('\r', ' ').replace('\n', ' ')
-                        cleaned_row.append(str_item)
-                    cleaned_batch.append(cleaned_row)
-                
-                writer.writerows(cleaned_batch)
+        sqlite_cursor.execute(query, key_range or ())
 
-        # Importar para PostgreSQL
         postgres_conn = get_postgres_connection()
         if postgres_conn is None:
             raise Exception("Falha ao conectar ao PostgreSQL.")
         
+        # Sem CSV temporário: os lotes do fetchmany são convertidos à medida
+        # que o COPY consome o fluxo
         with postgres_conn.cursor() as pg_cursor:
-            with open(temp_file, 'r', encoding='utf-8') as f:
-                    pg_cursor.copy_expert(
-                        f"COPY {DB_CONFIG_POSTGRES['schema']}.{table_name} ({','.join(columns)}) " 
-                        "FROM STDIN WITH (FORMAT CSV, HEADER, DELIMITER ',', NULL '')",
-                        f
-                    )
+            if table_name == 'processed_files' and key_range:
+                remove_replaced_files(pg_cursor, sqlite_conn, key_range)
+            staging = create_staging_table(pg_cursor, table_name, columns, key_range)
+            if ETL_CONFIG['copy_format'] == 'binary':
+                column_types = [COPY_COLUMN_TYPES.get(column, 'text') for column in columns]
+                pg_copy.copy_binary_from_cursor(pg_cursor, staging, columns, column_types, sqlite_cursor)
+            else:
+                pg_copy.copy_csv_from_cursor(pg_cursor, staging, columns, sqlite_cursor)
+            merge_staging_table(pg_cursor, staging, table_name, columns)
+            if key_range:
+                record_migrated_range(pg_cursor, table_name, key_range)
             postgres_conn.commit()
         return True
 
@@ -529,15 +1175,69 @@ def migrate_table_with_copy(sqlite_db_path, table_name, columns, query):
         if sqlite_conn:
             sqlite_conn.close()
         if postgres_conn:
-            postgres_conn.close()
-        if temp_file and os.path.exists(temp_file):
-            os.remove(temp_file)
+            release_postgres_connection(postgres_conn)
+
+def get_migration_workers(postgres_conn):
+    """Número de workers de COPY: CPUs disponíveis, limitado pelas conexões livres do PostgreSQL
+
+    Reserva as conexões de superusuário e a conexão principal da migração,
+    que também ocupa uma vaga do pool.
+    """
+    requested = ETL_CONFIG['migration_workers'] or os.cpu_count() or 1
+    with postgres_conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT current_setting('max_connections')::int
+                 - current_setting('superuser_reserved_connections')::int
+                 - (SELECT COUNT(*) FROM pg_stat_activity)
+        """)
+        # Conexões ociosas do próprio pool contam como ocupadas no servidor, mas serão reusadas
+        free_connections = cursor.fetchone()[0] + pg_pool.get_pool_stats()['idle']
+    return max(1, min(requested, free_connections - 1, ETL_CONFIG['pg_pool_max'] - 1))
+
+def plan_migration_chunks(table, columns, query, key, pending_range):
+    """Divide uma faixa pendente (início, fim, linhas) em faixas de até migration_chunk_rows linhas
+
+    Retorna a lista de (tabela, colunas, consulta, faixa, rótulo) de cada
+    faixa; faixas pequenas viram uma única tarefa.
+    """
+    low, high, count = pending_range
+    chunk_rows = ETL_CONFIG['migration_chunk_rows']
+    chunk_count = max(1, -(-count // chunk_rows))
+    width = -(-(high - low + 1) // chunk_count)
+    chunks = []
+    for start in range(low, high + 1, width):
+        end = min(start + width - 1, high)
+        chunks.append((
+            table, columns, f"{query} WHERE {key} BETWEEN ? AND ?", (start, end),
+            f"{table}[{start}:{end}]"
+        ))
+    return chunks
+
+def run_migration_chunks(chunks, workers):
+    """Copia as faixas em paralelo, cada uma em sua própria conexão, com progresso por faixa"""
+    completed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(migrate_table_with_copy, DB_CONFIG_SQLITE['database'],
+                            table, columns, query, key_range): label
+            for table, columns, query, key_range, label in chunks
+        }
+        for future in as_completed(futures):
+            if not future.result():
+                raise Exception(f"Falha na migração da faixa {futures[future]}")
+            completed += 1
+            print_progress(completed, len(chunks), prefix=f"Migração ({futures[future]})")
 
 # Função principal de migração
 def migrate_to_postgres():
-    """Migra dados do SQLite para o PostgreSQL de forma otimizada."""
+    """Migra para o PostgreSQL as linhas do SQLite acima das marcas d'água (incremental)
+
+    A primeira execução copia tudo; as seguintes só o que foi ingerido
+    depois, com custo proporcional aos dados novos. Cada faixa é confirmada
+    junto com o seu registro em migration_watermarks.
+    """
     if check_migration_status():
-        print("\nOs dados processados e inseridos já foram migrados.")
+        print("\nO PostgreSQL já está em dia: não há dados novos no SQLite desde a última migração.")
         return
     
     global cancel_flag
@@ -562,25 +1262,29 @@ def migrate_to_postgres():
             print("\nMigração cancelada devido a problemas nos dados.")
             return
 
-        # Criar cursor para SQLite
-        sqlite_cursor = sqlite_conn.cursor()
+        # Sem o registro de alterações os agregados vieram da versão que só
+        # guardava o top 10: são recalculados por completo desta vez
+        aggregates_tracked = postgres_table_exists(postgres_conn, 'aggregate_changes')
 
-        # Definir as tabelas e suas colunas
-        tables = {
-            'patients': ('patient_id,gender,data_inclusao', "SELECT patient_id, gender, data_inclusao FROM patients"),
-            'conditions': ('patient_id,condition_text,data_inclusao', "SELECT patient_id, condition_text, data_inclusao FROM conditions"),
-            'medications': ('patient_id,medication_text,data_inclusao', "SELECT patient_id, medication_text, data_inclusao FROM medications"),
-            'processed_files': ('file_name,data_inclusao', "SELECT file_name, data_inclusao FROM processed_files")
-        }
+        # Criar schema (e as tabelas de controle) no PostgreSQL
+        create_postgres_schema(postgres_conn)
+        bootstrap_watermarks(sqlite_conn, postgres_conn)
 
-        # Contar o número total de registros para progresso
+        # Contar as linhas pendentes (acima das marcas d'água) para progresso
+        initial_load = not any(get_migrated_ranges(postgres_conn).values())
+        pending = get_pending_migration(sqlite_conn, postgres_conn)
         total_records = 0
-        for table, (_, query) in tables.items():
-            sqlite_cursor.execute(f"SELECT COUNT(*) FROM ({query})")
-            count = sqlite_cursor.fetchone()[0]
+        for table, ranges in pending.items():
+            count = sum(rows for _, _, rows in ranges)
             total_records += count
             print(f"• {table.capitalize()}: {count:,}")
 
+        if not total_records:
+            print("\nO PostgreSQL já está em dia: não há dados novos no SQLite desde a última migração.")
+            if not aggregates_tracked:
+                migrate_aggregated_data_to_postgres(full=True)
+            return
+
         print(f"\n⚠️ ATENÇÃO: Esta operação pode levar aproximadamente {format_time(total_records * 0.02)}")
         print(f"• Total de registros: {total_records:,}")
 
@@ -589,42 +1293,37 @@ def migrate_to_postgres():
             print("\nMigração cancelada pelo usuário.")
             return
         
-        # Otimizar configurações do PostgreSQL
-        postgres_conn.autocommit = False
-        with postgres_conn.cursor() as postgres_cursor:
-            postgres_cursor.execute("SET synchronous_commit = off;")
-            postgres_cursor.execute("SET maintenance_work_mem = '1GB';")
-
-        # Criar schema no PostgreSQL
-        create_postgres_schema(postgres_conn)
-
-        # Desabilitar índices
-        disabled_indexes = disable_indexes(postgres_conn)
-
-        # Migrar tabelas em paralelo usando COPY
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            futures = []
-            for table, (columns, query) in tables.items():
-                futures.append(
-                    executor.submit(
-                        migrate_table_with_copy,
-                        DB_CONFIG_SQLITE['database'],  # Passar o caminho do banco
-                        table,
-                        columns.split(','),
-                        query
-                    )
-                )
-            
-            # Verificar resultados
-            for future in futures:
-                if not future.result():
-                    raise Exception("Falha na migração de uma das tabelas")
-
-        # Reconstruir índices
-        rebuild_indexes(postgres_conn, disabled_indexes)
+        # Encerra a transação aberta pelas leituras das marcas d'água; a
+        # conexão do pool já trabalha sem autocommit (e synchronous_commit
+        # vem das sessões do pool: ETL_PG_SYNCHRONOUS_COMMIT)
+        postgres_conn.commit()
 
-        # Migrar dados agregados
-        migrate_aggregated_data_to_postgres()
+        # Desabilitar índices e FKs só na carga inicial: num delta,
+        # reconstruí-los custaria o tamanho da tabela inteira
+        disabled_indexes = disable_indexes(postgres_conn) if initial_load else []
+        disabled_foreign_keys = disable_foreign_keys(postgres_conn) if initial_load else []
+
+        # Migrar as faixas pendentes em paralelo usando COPY, divididas em
+        # faixas de id, uma fase de cada vez. Sem as FKs não há ordem a
+        # respeitar e todas as tabelas entram numa única fase
+        workers = get_migration_workers(postgres_conn)
+        phases = [sum(MIGRATION_PHASES, ())] if disabled_foreign_keys else MIGRATION_PHASES
+        print(f"\nMigrando com {workers} workers (faixas de até {ETL_CONFIG['migration_chunk_rows']:,} linhas)")
+        for phase in phases:
+            chunks = []
+            for table in phase:
+                columns, query, key = MIGRATION_TABLES[table]
+                for pending_range in pending[table]:
+                    chunks.extend(plan_migration_chunks(table, columns.split(','), query, key, pending_range))
+            if chunks:
+                run_migration_chunks(chunks, workers)
+
+        # Reconstruir índices e FKs em paralelo, seguidos de ANALYZE
+        if initial_load:
+            rebuild_indexes(postgres_conn, disabled_indexes, disabled_foreign_keys, workers)
+
+        # Atualizar os agregados: só as chaves alteradas por este delta
+        migrate_aggregated_data_to_postgres(full=initial_load or not aggregates_tracked)
 
         elapsed = time.time() - start_time
         print(f"\n\nMigração concluída com sucesso!")
@@ -637,12 +1336,9 @@ def migrate_to_postgres():
         print(f"\n❌ ERRO NA MIGRAÇÃO: {str(e)}")
         traceback.print_exc()
     finally:
-        # Restaurar configurações
         if postgres_conn:
-            with postgres_conn.cursor() as cursor:
-                cursor.execute("RESET synchronous_commit;")
-                cursor.execute("RESET maintenance_work_mem;")
-            postgres_conn.close()
+            release_postgres_connection(postgres_conn)
+        pg_pool.print_pool_stats()
         if sqlite_conn:
             sqlite_conn.close()
         cancel_flag = True
@@ -658,84 +1354,95 @@ def get_sqlite_connection():
         print(f"Erro ao conectar ao SQLite: {e}")
         return None
 
-def migrate_aggregated_data_to_postgres():
-    """Migra os dados agregados do SQLite para o PostgreSQL"""
-    print("Iniciando migração de dados agregados para PostgreSQL...")
+def refresh_aggregates(postgres_conn, full=False):
+    """Atualiza as tabelas agregadas dentro do PostgreSQL com instruções set-based
+
+    Incremental: os deltas com sinal registrados em aggregate_changes são
+    consumidos, somados por chave e aplicados com count = count + delta,
+    sem reler a tabela de origem; chaves que chegam a zero saem do agregado.
+    O custo acompanha só as linhas inseridas ou removidas. Registros sem
+    delta (anteriores a ele) forçam a recontagem completa da tabela.
+    full=True recalcula cada tabela inteira num único GROUP BY. Retorna as
+    chaves gravadas por tabela; o commit fica com quem chama.
+    """
+    schema = DB_CONFIG_POSTGRES['schema']
+    refreshed = {}
+    with postgres_conn.cursor() as cursor:
+        for aggregate, (source, column) in AGGREGATE_TABLES.items():
+            recount = full
+            if not recount:
+                cursor.execute(f"SELECT EXISTS(SELECT 1 FROM {schema}.aggregate_changes "
+                               "WHERE table_name = %s AND delta IS NULL)", (source,))
+                recount = cursor.fetchone()[0]
+            if recount:
+                cursor.execute(f"DELETE FROM {schema}.aggregate_changes WHERE table_name = %s", (source,))
+                cursor.execute(f"DELETE FROM {schema}.{aggregate}")
+                cursor.execute(f"""
+                    INSERT INTO {schema}.{aggregate} ({column}, count)
+                    SELECT {column}, COUNT(*)
+                    FROM {schema}.{source}
+                    WHERE {column} IS NOT NULL
+                    GROUP BY {column}
+                """)
+                refreshed[aggregate] = cursor.rowcount
+            else:
+                cursor.execute(f"""
+                    WITH claimed AS (
+                        DELETE FROM {schema}.aggregate_changes WHERE table_name = %s RETURNING key, delta
+                    ), deltas AS (
+                        SELECT key, SUM(delta) AS delta FROM claimed GROUP BY key HAVING SUM(delta) <> 0
+                    )
+                    INSERT INTO {schema}.{aggregate} AS a ({column}, count, data_inclusao)
+                    SELECT key, delta, CURRENT_TIMESTAMP FROM deltas
+                    ON CONFLICT ({column}) DO UPDATE
+                    SET count = a.count + EXCLUDED.count, data_inclusao = EXCLUDED.data_inclusao
+                    RETURNING {column}, count
+                """, (source,))
+                updated = cursor.fetchall()
+                emptied = [key for key, count in updated if count <= 0]
+                if emptied:
+                    cursor.execute(f"DELETE FROM {schema}.{aggregate} WHERE {column} = ANY(%s)", (emptied,))
+                refreshed[aggregate] = len(updated)
+    return refreshed
+
+def migrate_aggregated_data_to_postgres(full=True):
+    """Atualiza os dados agregados dentro do PostgreSQL, sem reler o SQLite
+
+    full=False reconta apenas as chaves alteradas desde a última atualização.
+    """
+    print("Atualizando dados agregados no PostgreSQL...")
+    postgres_conn = None
     try:
         postgres_conn = get_postgres_connection()
         create_postgres_schema(postgres_conn)
     except Exception as e:
         print(f"Erro ao conectar ao PostgreSQL: {str(e)}")
+        release_postgres_connection(postgres_conn)
         return
         
     start_time = time.time()
     
-    sqlite_conn = get_sqlite_connection()
-    sqlite_cursor = sqlite_conn.cursor()
-    postgres_cursor = postgres_conn.cursor()
-    
     try:
-        print("Migrando aggregated_conditions...")
-        sqlite_cursor.execute("""
-            SELECT condition_text, COUNT(*) as count 
-            FROM conditions 
-            GROUP BY condition_text 
-            ORDER BY count DESC 
-            LIMIT 10
-        """)
-        for row in sqlite_cursor.fetchall():
-            postgres_cursor.execute(
-                f"INSERT INTO {DB_CONFIG_POSTGRES['schema']}.aggregated_conditions VALUES (%s, %s) ON CONFLICT (condition_text) DO UPDATE SET count = EXCLUDED.count",
-                row
-            )
-        
-        print("\nMigrando aggregated_medications...")
-        sqlite_cursor.execute("""
-            SELECT medication_text, COUNT(*) as count 
-            FROM medications 
-            GROUP BY medication_text 
-            ORDER BY count DESC 
-            LIMIT 10
-        """)
-        for row in sqlite_cursor.fetchall():
-            postgres_cursor.execute(
-                f"INSERT INTO {DB_CONFIG_POSTGRES['schema']}.aggregated_medications VALUES (%s, %s) ON CONFLICT (medication_text) DO UPDATE SET count = EXCLUDED.count",
-                row
-            )
-        
-        print("\nMigrando gender_stats...")
-        sqlite_cursor.execute("""
-            SELECT gender, COUNT(*) as count 
-            FROM patients 
-            GROUP BY gender
-        """)
-        for row in sqlite_cursor.fetchall():
-            postgres_cursor.execute(
-                f"INSERT INTO {DB_CONFIG_POSTGRES['schema']}.gender_stats VALUES (%s, %s) ON CONFLICT (gender) DO UPDATE SET count = EXCLUDED.count",
-                row
-            )
-        
+        refreshed = refresh_aggregates(postgres_conn, full)
         postgres_conn.commit()
+        for aggregate, keys in refreshed.items():
+            print(f"- {aggregate}: {keys:,} {'linhas' if full else 'chaves alteradas'}")
         elapsed = time.time() - start_time
-        print(f"\nMigração de dados agregados concluída em {format_time(elapsed)}")
+        print(f"\nAtualização de dados agregados concluída em {format_time(elapsed)}")
 
     except Exception as e:
         postgres_conn.rollback()
         print(f"\nERRO: {str(e)}")
-        import traceback
         traceback.print_exc()
     finally:
-        sqlite_cursor.close()
-        postgres_cursor.close()
-        sqlite_conn.close()
-        postgres_conn.close()
+        release_postgres_connection(postgres_conn)
 
 def check_postgres_connection():
     """Verifica se a conexão com PostgreSQL está ativa"""
     try:
         conn = get_postgres_connection()
-        conn.close()
-        return True
+        release_postgres_connection(conn)
+        return conn is not None
     except psycopg2.OperationalError as e:
         print(f"\nERRO: Não foi possível conectar ao PostgreSQL - {str(e)}")
         return False
@@ -745,10 +1452,10 @@ def handle_migration_choice2(choice):
     try:
         if choice == 'M':
             if check_migration_status():
-                print("\n✓ A Migração dos dados já foi realizada.")
+                print("\n✓ O PostgreSQL já está em dia com o SQLite.")
                 return
                 
-            print("\nIniciando migração completa...")
+            print("\nIniciando migração incremental...")
             migrate_to_postgres()
             
         elif choice == 'A':
@@ -765,10 +1472,10 @@ def handle_migration_choice(choice):
     try:
         if choice == 'M':
             if check_migration_status():
-                print("\n✓ Migração já foi realizada e os dados estão íntegros")
+                print("\n✓ O PostgreSQL já está em dia com o SQLite")
                 return
                 
-            print("\nIniciando migração completa...")
+            print("\nIniciando migração incremental...")
             migrate_to_postgres()
             
     except Exception as e:
@@ -810,177 +1517,1339 @@ def mark_file_as_processed(conn, file_name):
     finally:
         cursor.close()
 
-def get_remote_files():
-    """Obtém arquivos com tratamento de erro melhorado"""
-    try:
-        page = 1
-        all_files = []
+def list_remote_files_paged(per_page=100):
+    """Lista os arquivos paginando a API de conteúdo"""
+    page = 1
+    all_files = []
+    
+    while True:
+        response = downloads.get_http_session().get(
+            f"{DATA_URL}&page={page}&per_page={per_page}",
+            headers={"Accept": "application/vnd.github+json"},
+            timeout=ETL_CONFIG['http_timeout']
+        )
+        response.raise_for_status()
         
-        while True:
-            response = requests.get(
-                f"{DATA_URL}&page={page}&per_page=100",
-                headers={"Accept": "application/vnd.github+json"},
-                timeout=30
-            )
-            response.raise_for_status()
+        files = response.json()
+        if not files:
+            break
             
-            files = response.json()
-            if not files:
-                break
-                
-            all_files.extend([
-                f for f in files 
-                if isinstance(f, dict) and f.get('type') == 'file' and f.get('name', '').endswith('.json')
-            ])
+        all_files.extend([
+            f for f in files 
+            if isinstance(f, dict) and f.get('type') == 'file' and f.get('name', '').endswith('.json')
+        ])
+        
+        if 'next' not in response.links:
+            break
             
-            if 'next' not in response.links:
-                break
-                
-            page += 1
+        page += 1
+
+    return {f['name']: f for f in all_files if 'name' in f}
 
-        return {f['name']: f for f in all_files if 'name' in f}
+def parse_tree_listing(tree):
+    """Converte a resposta do endpoint git/trees (subárvore data/) no formato da API de conteúdo"""
+    files = {}
+    for item in tree.get('tree', []):
+        name = item.get('path', '')
+        if item.get('type') != 'blob' or not name.endswith('.json'):
+            continue
+        files[name] = {
+            'name': name,
+            'path': f"{DATA_PATH_PREFIX}{name}",
+            'sha': item.get('sha'),
+            'size': item.get('size'),
+            'type': 'file'
+        }
+    return files
+
+def load_listing_cache():
+    """Carrega a última listagem remota salva localmente"""
+    try:
+        with open(LISTING_CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_listing_cache(response, files):
+    """Persiste a listagem junto com ETag/Last-Modified para revalidação"""
+    os.makedirs(os.path.dirname(LISTING_CACHE_FILE), exist_ok=True)
+    tmp_path = f"{LISTING_CACHE_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'files': files
+        }, f)
+    os.replace(tmp_path, LISTING_CACHE_FILE)
+
+def get_remote_files():
+    """Obtém a listagem remota via git/trees com revalidação condicional
+
+    Um repositório inalterado custa uma única resposta 304; a listagem salva
+    localmente é reaproveitada. Se a árvore vier truncada, recorre à
+    paginação da API de conteúdo.
+    """
+    try:
+        cache = load_listing_cache()
+        headers = {"Accept": "application/vnd.github+json"}
+        if cache:
+            if cache.get('etag'):
+                headers['If-None-Match'] = cache['etag']
+            if cache.get('last_modified'):
+                headers['If-Modified-Since'] = cache['last_modified']
+
+        response = downloads.get_http_session().get(TREE_URL, headers=headers, timeout=ETL_CONFIG['http_timeout'])
+        if response.status_code == 304 and cache:
+            return cache['files']
+        response.raise_for_status()
+
+        tree = response.json()
+        if tree.get('truncated'):
+            files = list_remote_files_paged()
+        else:
+            files = parse_tree_listing(tree)
+
+        save_listing_cache(response, files)
+        return files
         
     except Exception as e:
         print(f"\nERRO: Falha na conexão com o GitHub - {str(e)}")
         return None
 
-def download_files():
-    """Baixa os arquivos JSON do repositório e os adiciona à fila"""
+def stream_download(session, file_url, file_path, blob_sha=None, size=None):
+    """Baixa em blocos direto para o disco calculando o SHA-256 durante a escrita
+
+    Quando o sha do blob e o tamanho são conhecidos, o conteúdo também é
+    conferido contra o sha do git antes de o arquivo ser publicado.
+    """
+    download = downloads.open_download(file_path, blob_sha, size)
+    try:
+        with session.get(file_url, timeout=ETL_CONFIG['http_timeout'], stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                downloads.write_download_chunk(download, chunk)
+        digest = downloads.finish_download(download)
+    except Exception:
+        downloads.abort_download(download)
+        raise
+
+    return digest, download['written']
+
+def download_to_memory(session, file_url, blob_sha=None, size=None):
+    """Baixa o arquivo para um único buffer em memória e devolve um memoryview somente leitura
+
+    Com o tamanho conhecido o buffer é alocado de uma vez e os blocos são
+    copiados direto para sua posição final. O sha do blob é conferido como
+    em stream_download.
+    """
+    buffer = bytearray(size or 0)
+    view = memoryview(buffer)
+    blob = hashlib.sha1(f"blob {size}\0".encode()) if blob_sha and size is not None else None
+    written = 0
+
+    with session.get(file_url, timeout=ETL_CONFIG['http_timeout'], stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            if blob:
+                blob.update(chunk)
+            end = written + len(chunk)
+            if end <= len(buffer):
+                view[written:end] = chunk
+            else:
+                view.release()
+                buffer[written:] = chunk
+                view = memoryview(buffer)
+            written = end
+
+    if blob and blob.hexdigest() != blob_sha:
+        raise ValueError(f"sha do blob divergente (esperado {blob_sha}, obtido {blob.hexdigest()})")
+
+    view.release()
+    del buffer[written:]
+    return memoryview(buffer).toreadonly()
+
+def archive_worker():
+    """Grava no cache, em segundo plano, os brutos baixados em memória
+
+    Os arquivos entram no mesmo cache por sha do blob usado por fetch_file,
+    com o .sha256 ao lado, e são reaproveitados nas próximas execuções.
+    O sha do blob é conferido durante a gravação, para que um conteúdo
+    divergente nunca vire entrada de cache. Falhas não afetam a ingestão.
+    """
+    while True:
+        item = archive_queue.get()
+        if item is None:
+            break
+
+        name, blob_sha, content = item
+        try:
+            chunks = (content[start:start + DOWNLOAD_CHUNK_SIZE]
+                      for start in range(0, len(content), DOWNLOAD_CHUNK_SIZE))
+            downloads.store_cached_file(CACHE_DIR, blob_sha, name, chunks, len(content))
+        except Exception as e:
+            print(f"\nErro ao arquivar {name}: {str(e)}")
+
+def start_archive_worker():
+    """Inicia o arquivamento dos brutos se o modo em memória o pedir; retorna a thread"""
+    if not (ETL_CONFIG['in_memory'] and ETL_CONFIG['archive_raw']):
+        return None
+    archiver = threading.Thread(target=archive_worker, name="archive-worker")
+    archiver.start()
+    return archiver
+
+def stop_archive_worker(archiver):
+    """Aguarda o arquivamento pendente terminar"""
+    if archiver:
+        archive_queue.put(None)
+        archiver.join()
+
+def fetch_file_in_memory(session, name, meta):
+    """Obtém um arquivo para o parsing sem gravá-lo no diretório da execução
+
+    Acertos de cache seguem como caminho do próprio cache; downloads seguem
+    como (nome, memoryview) e, se configurado, vão ao arquivamento assíncrono.
+    Retorna (item da fila, bytes baixados).
+    """
+    blob_sha = meta.get('sha')
+    if blob_sha:
+        cached = downloads.get_cached_file(CACHE_DIR, blob_sha, name)
+        if cached:
+            return cached, 0
+
+    content = download_to_memory(session, urljoin(RAW_BASE_URL, name), blob_sha, meta.get('size'))
+    if blob_sha and ETL_CONFIG['archive_raw']:
+        archive_queue.put((name, blob_sha, content))
+    return (name, content), len(content)
+
+def fetch_file(session, name, meta):
+    """Obtém um arquivo do cache ou baixa-o para o cache; retorna (caminho, bytes baixados)"""
+    file_url = urljoin(RAW_BASE_URL, name)
+    file_path = os.path.join(LOCAL_DATA_DIR, name)
+    blob_sha = meta.get('sha')
+
+    if not blob_sha:
+        stream_download(session, file_url, file_path)
+        return file_path, os.path.getsize(file_path)
+
+    cached = downloads.get_cached_file(CACHE_DIR, blob_sha, name)
+    if cached:
+        return downloads.link_into_process_dir(cached, file_path), 0
+
+    cache_path = downloads.get_cache_path(CACHE_DIR, blob_sha, name)
+    digest, written = stream_download(session, file_url, cache_path, blob_sha, meta.get('size'))
+    downloads.write_cache_hash(cache_path, digest)
+    return downloads.link_into_process_dir(cache_path, file_path), written
+
+def load_run_journal():
+    """Lê o diário de uma execução interrompida; retorna (diretório, {nome: registro})
+
+    Cada linha é um evento JSON; vale o último estado de cada arquivo. Uma
+    linha final incompleta (queda durante a escrita) é ignorada.
+    """
+    if not os.path.exists(RUN_JOURNAL_FILE):
+        return None, {}
+
+    process_dir = None
+    states = {}
+    with open(RUN_JOURNAL_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if 'process_dir' in record:
+                process_dir = record['process_dir']
+            else:
+                states[record['name']] = record
+    return process_dir, states
+
+def open_run_journal(process_dir, files):
+    """Abre (ou retoma) o diário da execução e registra os arquivos como 'listed'"""
+    global run_journal
+    os.makedirs(os.path.dirname(RUN_JOURNAL_FILE), exist_ok=True)
+    resumed = os.path.exists(RUN_JOURNAL_FILE)
+    run_journal = open(RUN_JOURNAL_FILE, 'a', encoding='utf-8')
+    if not resumed:
+        write_journal([{'process_dir': process_dir}])
+    journal_event([name for name in files if name not in journal_states], 'listed')
+
+def write_journal(records, sync=True):
+    """Acrescenta registros ao diário; com sync eles vão ao disco antes de retornar
+
+    Sem sync o fsync é agrupado a cada ETL_CONFIG['journal_sync_every']
+    registros ou no fim da fase (sync_run_journal). Perder numa queda um
+    evento ainda não sincronizado só faz o arquivo ser obtido de novo.
+    """
+    global journal_unsynced
+    if run_journal is None or not records:
+        return
+    with journal_lock:
+        run_journal.write(''.join(json.dumps(record) + '\n' for record in records))
+        run_journal.flush()
+        journal_unsynced += len(records)
+        if sync or journal_unsynced >= ETL_CONFIG['journal_sync_every']:
+            os.fsync(run_journal.fileno())
+            journal_unsynced = 0
+
+def sync_run_journal():
+    """Leva ao disco os eventos do diário ainda não sincronizados (fim de fase)"""
+    global journal_unsynced
+    with journal_lock:
+        if run_journal is not None and journal_unsynced:
+            os.fsync(run_journal.fileno())
+            journal_unsynced = 0
+
+def journal_event(names, state, path=None, sync=True):
+    """Registra a transição de estado dos arquivos: listed, downloaded, parsed ou committed"""
+    records = []
+    for name in names:
+        record = {'name': name, 'state': state}
+        if path:
+            record['path'] = path
+        elif name in journal_states and 'path' in journal_states[name]:
+            record['path'] = journal_states[name]['path']
+        journal_states[name] = record
+        records.append(record)
+    write_journal(records, sync)
+
+def close_run_journal():
+    """Encerra o diário de uma execução que chegou ao fim
+
+    Só uma execução interrompida deixa o diário no disco; arquivos com erro
+    voltam a ser pendentes pela ausência em processed_files.
+    """
+    global run_journal, journal_unsynced
+    if run_journal is None:
+        return
+    run_journal.close()
+    journal_unsynced = 0
+    run_journal = None
+    journal_states.clear()
+    os.remove(RUN_JOURNAL_FILE)
+
+def resume_downloaded_files(files_to_download):
+    """Publica na download_queue os arquivos já baixados pela execução interrompida
+
+    Retorna os que ainda precisam ser baixados.
+    """
+    global downloaded_count
+    remaining = {}
+    for name, meta in files_to_download.items():
+        record = journal_states.get(name, {})
+        if record.get('state') in ('downloaded', 'parsed') and os.path.isfile(record.get('path', '')):
+            download_queue.put(record['path'])
+            with counter_lock:
+                downloaded_count += 1
+        else:
+            remaining[name] = meta
+
+    resumed = len(files_to_download) - len(remaining)
+    if resumed:
+        print(f"\n{resumed} arquivos reaproveitados da execução interrompida")
+    return remaining
+
+def prepare_process_dir(base_dir):
+    """Define o diretório da execução, retomando o de uma execução interrompida
+
+    Carrega o diário anterior (se houver) em journal_states.
+    """
+    process_dir, states = load_run_journal()
+    if process_dir and (os.path.isdir(process_dir) or ETL_CONFIG['in_memory']):
+        print(f"\nRetomando a execução interrompida em {process_dir}")
+        journal_states.update(states)
+        return process_dir
+
+    if os.path.exists(RUN_JOURNAL_FILE):
+        os.remove(RUN_JOURNAL_FILE)
+    current_time = datetime.now().strftime("%Y%m%d_Hs%H-%M")
+    return os.path.join(base_dir, 'data', f'data_process_{current_time}')
+
+def fetch_bundle(session, name, meta):
+    """Obtém um arquivo para o worker de download, em memória ou pelo cache em disco"""
+    if ETL_CONFIG['in_memory']:
+        return fetch_file_in_memory(session, name, meta)
+    return fetch_file(session, name, meta)
+
+def publish_download(name, item):
+    """Registra o download no diário e entrega o arquivo ao processamento"""
+    global downloaded_count
+    journal_event([name], 'downloaded', item if isinstance(item, str) else None, sync=False)
+    download_queue.put(item)
+    with counter_lock:
+        downloaded_count += 1
+        print_progress(downloaded_count, total_to_download, prefix="Download")
+
+def get_processed_files(conn):
+    """Carrega em uma única consulta os arquivos já processados e seus hashes de conteúdo"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT file_name, content_hash FROM processed_files")
+    processed = {file_name: content_hash for file_name, content_hash in cursor}
+    cursor.close()
+    return processed
+
+def is_file_current(processed, file_name, content_hash):
+    """Indica se a versão do arquivo já está no banco
+
+    Sem hash de um dos lados (fonte sem sha ou registro anterior à detecção
+    de alterações) vale apenas o nome, como antes.
+    """
+    if file_name not in processed:
+        return False
+    return content_hash is None or processed[file_name] is None or processed[file_name] == content_hash
+
+def exclude_changed_ndjson_files(processed, chunks):
+    """Recusa retomar arquivos NDJSON reescritos desde a ingestão anterior
+
+    Suas faixas antigas não correspondem mais às atuais e reprocessá-las
+    duplicaria fatos; o arquivo é ignorado com um aviso.
+    """
+    changed = sources.get_changed_ndjson_files(chunks, processed)
+    for path in sorted(changed):
+        print(f"\nERRO: {path} foi alterado desde a última ingestão e não será retomado. "
+              "Carregue a nova exportação em outro diretório.")
+    return {key: meta for key, meta in chunks.items() if meta['path'] not in changed}
+
+def get_files_to_download(conn, remote_files):
+    """Filtra os arquivos remotos novos ou alterados desde o último processamento"""
+    processed = get_processed_files(conn)
+    if any(meta.get('type') == 'chunk' for meta in remote_files.values()):
+        remote_files = exclude_changed_ndjson_files(processed, remote_files)
+    files_to_download = {
+        name: meta for name, meta in remote_files.items()
+        if not is_file_current(processed, name, meta.get('sha'))
+    }
+    listed_hashes.update({name: meta['sha'] for name, meta in files_to_download.items() if meta.get('sha')})
+    skipped = len(remote_files) - len(files_to_download)
+    changed = sum(1 for name in files_to_download if name in processed)
+    if skipped:
+        print(f"{skipped} arquivos já foram processados, pulando...")
+    if changed:
+        print(f"{changed} arquivos alterados na origem serão reprocessados")
+    return files_to_download
+
+def resolve_files_to_download(files_to_download=None):
+    """Reaproveita a lista de pendentes já calculada ou a obtém do repositório"""
+    if files_to_download is not None:
+        return files_to_download
+
+    remote_files = list_source_files()
+    if not remote_files:
+        return None
+
+    conn = get_sqlite_connection()
+    try:
+        return get_files_to_download(conn, remote_files)
+    finally:
+        conn.close()
+
+def download_files(files_to_download=None):
+    """Baixa os arquivos JSON do repositório com um pool de workers e os adiciona à fila"""
     global downloaded_count, total_to_download, total_to_process
     start_time = time.time()
-    conn = get_sqlite_connection()
     try:
-        remote_files = get_remote_files()
+        files_to_download = resolve_files_to_download(files_to_download)
         
-        if not remote_files:
+        if files_to_download is None:
             print("Nenhum arquivo encontrado no repositório!")
             return
-
-        files_to_download = {}
-        for name, meta in remote_files.items():
-            if is_file_processed(conn, name):
-                print(f"Arquivo {name} já foi processado, pulando...")
-                continue
-            files_to_download[name] = meta
         
         total_to_download = len(files_to_download)
         total_to_process = total_to_download
+        files_to_download = resume_downloaded_files(files_to_download)
 
-        print(f"\nTotal de arquivos a baixar: {total_to_download}")
+        num_workers = max(1, min(ETL_CONFIG['download_workers'], len(files_to_download)))
+        print(f"\nTotal de arquivos a baixar: {len(files_to_download)} ({num_workers} workers)")
 
-        for name, meta in files_to_download.items():
-            file_url = urljoin(RAW_BASE_URL, name)
-            file_path = os.path.join(LOCAL_DATA_DIR, name)
-            
-            try:
-                response = requests.get(file_url)
-                response.raise_for_status()
-                
-                with open(file_path, 'wb') as f:
-                    f.write(response.content)
-                    
-                download_queue.put(file_path)
-                with counter_lock:
-                    downloaded_count += 1
-                    print_progress(downloaded_count, total_to_download, prefix="Download")
-            except Exception as e:
-                print(f"\nErro ao baixar {name}: {str(e)}")
-                if os.path.exists(file_path):
-                    os.remove(file_path)
+        archiver = start_archive_worker()
+        downloads.run_download_workers(files_to_download, fetch_bundle, publish_download, num_workers)
+        stop_archive_worker(archiver)
         
+        elapsed = time.time() - start_time
+        print(f"\nDownload concluído: {downloaded_count} novos arquivos")
+        print(f"Tempo total: {int(elapsed // 60)}m {int(elapsed % 60)}s")
+        downloads.print_download_stats()
+    finally:
+        sync_run_journal()
         download_queue.put(None)
+
+def download_files_async(files_to_download=None):
+    """Alternativa asyncio ao download_files, com o mesmo contrato da download_queue"""
+    global downloaded_count, total_to_download, total_to_process
+    start_time = time.time()
+    try:
+        files_to_download = resolve_files_to_download(files_to_download)
+
+        if files_to_download is None:
+            print("Nenhum arquivo encontrado no repositório!")
+            return
+
+        total_to_download = len(files_to_download)
+        total_to_process = total_to_download
+        files_to_download = resume_downloaded_files(files_to_download)
+
+        print(f"\nTotal de arquivos a baixar: {len(files_to_download)} "
+              f"(asyncio, {ETL_CONFIG['async_concurrency']} simultâneos)")
+
+        def on_downloaded(item, size):
+            global downloaded_count
+            blob_sha = files_to_download[get_bundle_name(item)].get('sha')
+            if archiver and blob_sha and isinstance(item, tuple):
+                archive_queue.put((get_bundle_name(item), blob_sha, item[1]))
+            journal_event([get_bundle_name(item)], 'downloaded', item if isinstance(item, str) else None,
+                          sync=False)
+            with counter_lock:
+                downloaded_count += 1
+                print_progress(downloaded_count, total_to_download, prefix="Download")
+
+        def on_error(error):
+            print(f"\nErro ao baixar arquivo: {str(error)}")
+
+        archiver = start_archive_worker()
+        async_fetch.fetch_files(
+            list(files_to_download),
+            None if ETL_CONFIG['in_memory'] else LOCAL_DATA_DIR,
+            download_queue,
+            RAW_BASE_URL,
+            concurrency=ETL_CONFIG['async_concurrency'],
+            limit_per_host=ETL_CONFIG['async_limit_per_host'],
+            timeout=ETL_CONFIG['http_timeout'],
+            on_downloaded=on_downloaded,
+            on_error=on_error,
+            file_meta=files_to_download,
+            cache_dir=CACHE_DIR
+        )
+        stop_archive_worker(archiver)
+
         elapsed = time.time() - start_time
         print(f"\nDownload concluído: {downloaded_count} novos arquivos")
         print(f"Tempo total: {int(elapsed // 60)}m {int(elapsed % 60)}s")
     finally:
-        conn.close()
+        sync_run_journal()
+        download_queue.put(None)
 
-def clean_text(text):
-    """Substitui barras e colchetes nos textos."""
-    return text.replace("/", "-").replace("\\", "-").replace("[", "(").replace("]", ")")
+def list_source_files():
+    """Lista os bundles da fonte configurada: GitHub, diretório/arquivo local ou faixas NDJSON"""
+    if not ETL_CONFIG['source']:
+        return get_remote_files()
 
-def process_files():
-    """Processa os arquivos da fila"""
+    try:
+        if ETL_CONFIG['source_format'] == 'ndjson':
+            return sources.list_ndjson_chunks(
+                ETL_CONFIG['source'], ETL_CONFIG['ndjson_chunk_bytes'], NDJSON_RESOURCE_TYPES
+            )
+        return sources.list_source_files(ETL_CONFIG['source'])
+    except Exception as e:
+        print(f"\nERRO: Falha ao ler a fonte local {ETL_CONFIG['source']} - {str(e)}")
+        return None
+
+def load_local_source(files_to_download=None):
+    """Publica na download_queue os bundles de um diretório ou arquivo tar/zip
+
+    Diretórios entram como caminhos; membros de arquivos compactados entram
+    como (nome, bytes), sem extração para disco.
+    """
+    global downloaded_count, total_to_download, total_to_process
+    start_time = time.time()
+    try:
+        files_to_download = resolve_files_to_download(files_to_download)
+
+        if files_to_download is None:
+            print("Nenhum arquivo encontrado na fonte local!")
+            return
+
+        total_to_download = len(files_to_download)
+        total_to_process = total_to_download
+        print(f"\nTotal de arquivos a carregar de {ETL_CONFIG['source']}: {total_to_download}")
+
+        for bundle in sources.iter_source_bundles(ETL_CONFIG['source'], files_to_download):
+            download_queue.put(bundle)
+            with counter_lock:
+                downloaded_count += 1
+                print_progress(downloaded_count, total_to_download, prefix="Leitura")
+
+        elapsed = time.time() - start_time
+        print(f"\nLeitura concluída: {downloaded_count} arquivos")
+        print(f"Tempo total: {int(elapsed // 60)}m {int(elapsed % 60)}s")
+    except Exception as e:
+        print(f"\nErro ao ler a fonte local: {str(e)}")
+    finally:
+        download_queue.put(None)
+
+def get_download_target():
+    """Seleciona a fonte/motor de download conforme ETL_CONFIG"""
+    if ETL_CONFIG['source']:
+        return load_local_source
+    if ETL_CONFIG['fetch_engine'] == 'asyncio':
+        return download_files_async
+    return download_files
+
+# Extratores habilitados (resourceType -> destino) e tipos materializados
+ENABLED_EXTRACTORS = extractors.get_enabled_extractors(ETL_CONFIG['resource_types'])
+BUNDLE_RESOURCE_TYPES = {'Patient'} | set(ENABLED_EXTRACTORS)
+
+def collect_bundle_rows(resources):
+    """Varre os recursos uma única vez e monta os lotes compactos de linhas
+
+    Cada recurso é despachado pelo resourceType ao extrator registrado; o
+    custo da varredura não cresce com o número de tipos habilitados.
+    Retorna {'patient': (id, gender), 'rows': {destino: [linhas]}}.
+    """
+    patient = None
+    rows = {spec['target']: [] for spec in ENABLED_EXTRACTORS.values()}
+
+    for resource in resources:
+        resource_type = resource.get('resourceType')
+
+        if resource_type == 'Patient':
+            if patient is None:
+                patient = resource
+            continue
+
+        spec = ENABLED_EXTRACTORS.get(resource_type)
+        if spec:
+            row = spec['extract'](resource)
+            if row:
+                rows[spec['target']].append(row)
+
+    if not patient:
+        return None
+
+    return {
+        'patient': (patient.get('id'), patient.get('gender', 'unknown')),
+        'rows': rows
+    }
+
+def get_bundle_name(bundle):
+    """Nome do arquivo de um item da fila: caminho em disco ou (nome, bytes)"""
+    if isinstance(bundle, tuple):
+        return bundle[0]
+    return os.path.basename(bundle)
+
+def get_bundle_size(bundle):
+    """Tamanho em bytes de um item da fila"""
+    if isinstance(bundle, tuple):
+        return len(bundle[1])
+    return os.path.getsize(bundle)
+
+def open_bundle(bundle):
+    """Abre um item da fila em modo binário, seja arquivo em disco ou conteúdo em memória"""
+    if isinstance(bundle, tuple):
+        if isinstance(bundle[1], memoryview):
+            return fhir_stream.open_memory(bundle[1])
+        return io.BytesIO(bundle[1])
+    return open(bundle, 'rb')
+
+def get_bundle_buffer(bundle):
+    """Conteúdo de um item em memória num tipo aceito por json.loads, sem cópia
+
+    O memoryview entregue pelo download cobre o bytearray inteiro, então o
+    próprio buffer de origem é usado.
+    """
+    content = bundle[1]
+    if isinstance(content, memoryview):
+        return content.obj if content.nbytes == len(content.obj) else content.tobytes()
+    return content
+
+def to_pool_item(bundle):
+    """Converte o memoryview de um item em algo serializável para o pool de processos"""
+    if isinstance(bundle, tuple) and isinstance(bundle[1], memoryview):
+        return bundle[0], get_bundle_buffer(bundle)
+    return bundle
+
+def parse_bundle_json(bundle):
+    """Lê o bundle inteiro com json.load (caminho original)"""
+    if isinstance(bundle, tuple):
+        data = json.loads(get_bundle_buffer(bundle))
+    else:
+        with open_bundle(bundle) as f:
+            data = json.load(f)
+    return collect_bundle_rows(e.get('resource', {}) for e in data.get('entry', []))
+
+def parse_bundle_stream(bundle):
+    """Percorre o bundle em streaming, materializando só os recursos usados"""
+    with open_bundle(bundle) as f:
+        return collect_bundle_rows(fhir_stream.iter_bundle_resources(f, BUNDLE_RESOURCE_TYPES))
+
+def parse_bundle(bundle):
+    """Converte um bundle FHIR em lotes compactos de linhas
+
+    Recebe o caminho do arquivo ou uma tupla (nome, bytes) vinda de uma
+    fonte compactada. Retorna None quando o bundle não tem Patient.
+    Executada tanto no process_files sequencial quanto nos processos do
+    pool de parsing. Bundles a partir de ETL_CONFIG['stream_parse_min_bytes']
+    usam o extrator incremental (se o ijson estiver instalado), limitando a
+    memória de pico; os menores seguem com json.load, que é mais rápido.
+    """
+    min_bytes = ETL_CONFIG['stream_parse_min_bytes']
+    if min_bytes >= 0 and fhir_stream.is_available() and get_bundle_size(bundle) >= min_bytes:
+        return parse_bundle_stream(bundle)
+    return parse_bundle_json(bundle)
+
+def safe_parse_bundle(bundle):
+    """Envolve parse_bundle para que erros voltem como resultado e não interrompam o pool"""
+    file_name = get_bundle_name(bundle)
+    try:
+        return file_name, parse_bundle(bundle), None
+    except Exception as e:
+        return file_name, None, str(e)
+
+def new_vocabulary_cache():
+    """Cache texto -> id de cada vocabulário, mantido por escritor"""
+    return {view: {} for view in SQLITE_VOCABULARIES}
+
+def get_vocabulary_ids(conn, vocab_cache, view, texts):
+    """Converte textos nos ids do vocabulário, inserindo os que ainda não existem
+
+    Só os textos ausentes do cache vão ao banco. Após um rollback o cache
+    deve ser descartado, pois pode conter ids que não foram confirmados.
+    """
+    domain = SQLITE_VOCABULARIES[view]
+    ids = vocab_cache[view]
+    missing = list({text for text in texts if text not in ids})
+
+    if missing:
+        cursor = conn.cursor()
+        cursor.executemany(
+            f"INSERT OR IGNORE INTO {domain['vocab']} ({domain['text']}) VALUES (?)",
+            [(text,) for text in missing]
+        )
+        for i in range(0, len(missing), 500):
+            batch = missing[i:i + 500]
+            cursor.execute(
+                f"SELECT id, {domain['text']} FROM {domain['vocab']} "
+                f"WHERE {domain['text']} IN ({','.join('?' * len(batch))})",
+                batch
+            )
+            for vocab_id, text in cursor.fetchall():
+                ids[text] = vocab_id
+        cursor.close()
+
+    return [ids[text] for text in texts]
+
+def get_facts_insert(view, source):
+    """Monta o INSERT na tabela de fatos do destino, incluindo as colunas extras
+
+    source recebe '{}' onde entram os placeholders do id do vocabulário e
+    das colunas extras (ex.: "VALUES (?, {})").
+    """
+    domain = SQLITE_VOCABULARIES[view]
+    extra_names = [name for name, _ in domain.get('columns', [])]
+    columns = ', '.join(['patient_key', domain['id']] + extra_names)
+    placeholders = ', '.join('?' * (1 + len(extra_names)))
+    return f"INSERT INTO {domain['facts']} ({columns}) {source.format(placeholders)}"
+
+def delete_patient_facts(cursor, patient_ids):
+    """Remove as linhas de fatos (conditions, medications...) dos pacientes informados"""
+    placeholders = ','.join('?' * len(patient_ids))
+    for domain in SQLITE_VOCABULARIES.values():
+        cursor.execute(
+            f"DELETE FROM {domain['facts']} WHERE patient_key IN "
+            f"(SELECT patient_key FROM patients WHERE patient_id IN ({placeholders}))",
+            list(patient_ids)
+        )
+
+def write_parsed_bundle(conn, vocab_cache, file_name, parsed, replacing=False):
+    """Grava as linhas de um bundle e a marca em processed_files na transação corrente
+
+    Com replacing (arquivo alterado na origem) as linhas anteriores do
+    paciente são removidas antes, na mesma transação, e o gênero atualizado.
+    """
+    patient_id, gender = parsed['patient']
+
+    cursor = conn.cursor()
+    if replacing:
+        cursor.execute("SELECT patient_id FROM processed_files WHERE file_name = ?", (file_name,))
+        previous = cursor.fetchone()
+        delete_patient_facts(cursor, {patient_id} | ({previous[0]} if previous and previous[0] else set()))
+        cursor.execute("UPDATE patients SET gender = ? WHERE patient_id = ?", (gender, patient_id))
+
+    cursor.execute(
+        "INSERT OR IGNORE INTO patients (patient_id, gender) VALUES (?, ?)",
+        (patient_id, gender)
+    )
+    cursor.execute("SELECT patient_key FROM patients WHERE patient_id = ?", (patient_id,))
+    patient_key = cursor.fetchone()[0]
+
+    for view, rows in parsed['rows'].items():
+        vocab_ids = get_vocabulary_ids(conn, vocab_cache, view, [row[0] for row in rows])
+        cursor.executemany(
+            get_facts_insert(view, "VALUES (?, {})"),
+            [(patient_key, vocab_id, *row[1:]) for vocab_id, row in zip(vocab_ids, rows)]
+        )
+
+    # rowid sempre acima do maior atual (calculado antes do REPLACE remover a
+    # linha anterior): um arquivo regravado reaparece acima da marca d'água
+    # da migração incremental
+    cursor.execute(
+        "INSERT OR REPLACE INTO processed_files (rowid, file_name, content_hash, patient_id) "
+        "VALUES ((SELECT IFNULL(MAX(rowid), 0) + 1 FROM processed_files), ?, ?, ?)",
+        (file_name, listed_hashes.get(file_name), patient_id)
+    )
+    cursor.close()
+
+def new_commit_group(conn):
+    """Cria o estado do escritor: grupo pendente e arquivos já processados
+
+    O conjunto de processados é carregado uma vez e atualizado a cada
+    commit com os arquivos do grupo ({nome: hash}), evitando uma consulta
+    por arquivo.
+    """
+    return {'files': {}, 'started': time.time(), 'processed': get_processed_files(conn),
+            'vocab': new_vocabulary_cache()}
+
+def flush_commit_group(conn, group):
+    """Confirma de uma vez todos os arquivos pendentes do grupo
+
+    Só após o commit os arquivos passam a contar como processados; se ele
+    falhar, uma nova versão do mesmo arquivo ainda será gravada.
+    """
     global processed_count, errors_count
+    if not group['files']:
+        group['started'] = time.time()
+        return
+
+    try:
+        conn.commit()
+        group['processed'].update(group['files'])
+        journal_event(list(group['files']), 'committed')
+        with counter_lock:
+            processed_count += len(group['files'])
+            print_progress(processed_count, total_to_process, prefix="Ingestão")
+        print(f"\n{len(group['files'])} arquivos confirmados no banco.")
+    except Exception as e:
+        conn.rollback()
+        group['vocab'] = new_vocabulary_cache()
+        with counter_lock:
+            errors_count += len(group['files'])
+        print(f"\nErro ao confirmar {len(group['files'])} arquivos: {str(e)}")
+    finally:
+        group['files'] = {}
+        group['started'] = time.time()
+
+def commit_group_is_due(group):
+    """Indica se o grupo atingiu o limite de arquivos ou de tempo"""
+    elapsed_ms = (time.time() - group['started']) * 1000
+    return (len(group['files']) >= ETL_CONFIG['commit_files']
+            or elapsed_ms >= ETL_CONFIG['commit_interval_ms'])
+
+def store_parse_result(conn, group, file_name, parsed, error):
+    """Etapa de escrita única: grava o resultado do parsing de um arquivo
+
+    Cada arquivo é isolado por um SAVEPOINT dentro da transação do grupo,
+    então um erro descarta apenas aquele arquivo. Dados e marca em
+    processed_files são confirmados juntos no commit do grupo.
+    """
+    global errors_count
+
+    if error is None and parsed is None:
+        return
+
+    try:
+        if error is not None:
+            raise Exception(error)
+
+        content_hash = listed_hashes.get(file_name)
+        if (is_file_current(group['processed'], file_name, content_hash)
+                or is_file_current(group['files'], file_name, content_hash)):
+            print(f"\nArquivo {file_name} já foi processado, pulando...")
+            return
+
+        if not conn.in_transaction:
+            conn.execute("BEGIN")
+        conn.execute("SAVEPOINT bundle")
+        try:
+            write_parsed_bundle(conn, group['vocab'], file_name, parsed,
+                                replacing=file_name in group['processed'] or file_name in group['files'])
+        except Exception:
+            conn.execute("ROLLBACK TO bundle")
+            group['vocab'] = new_vocabulary_cache()
+            raise
+        finally:
+            conn.execute("RELEASE bundle")
+
+        group['files'][file_name] = content_hash
+        journal_event([file_name], 'parsed', sync=False)
+    except Exception as e:
+        with counter_lock:
+            errors_count += 1
+        print(f"\nErro no arquivo {file_name}: {str(e)}")
+    finally:
+        if commit_group_is_due(group):
+            flush_commit_group(conn, group)
+
+def print_process_summary(start_time):
+    """Exibe o resumo da etapa de processamento"""
+    elapsed = time.time() - start_time
+    print("\nProcessamento concluído:")
+    print(f"- Arquivos processados: {processed_count}")
+    print(f"- Erros: {errors_count}")
+    print(f"- Tempo total: {int(elapsed // 60)}m {int(elapsed % 60)}s")
+
+def process_files():
+    """Processa os arquivos da fila com commits agrupados"""
     start_time = time.time()
-    conn = get_sqlite_connection()
+    conn = apply_write_pragmas(get_sqlite_connection())
+    group = new_commit_group(conn)
+    interval = ETL_CONFIG['commit_interval_ms'] / 1000
     try:
         while True:
-            file_path = download_queue.get()
+            try:
+                file_path = download_queue.get(timeout=interval)
+            except queue.Empty:
+                flush_commit_group(conn, group)
+                continue
+
             if file_path is None:
                 download_queue.put(None)
                 break
 
-            file_name = os.path.basename(file_path)
-            if is_file_processed(conn, file_name):
-                print(f"\nArquivo {file_name} já foi processado, pulando...")
+            try:
+                file_name = get_bundle_name(file_path)
+                if is_file_current(group['processed'], file_name, listed_hashes.get(file_name)):
+                    print(f"\nArquivo {file_name} já foi processado, pulando...")
+                    continue
+
+                store_parse_result(conn, group, *safe_parse_bundle(file_path))
+            finally:
                 download_queue.task_done()
+
+        flush_commit_group(conn, group)
+    finally:
+        conn.close()
+        print_process_summary(start_time)
+
+def safe_parse_bundles(file_paths):
+    """Faz o parsing de um lote de arquivos dentro de um processo do pool"""
+    return [safe_parse_bundle(file_path) for file_path in file_paths]
+
+def iter_download_batches(batch_size, wait=0.1):
+    """Agrupa os caminhos da download_queue em lotes até o sentinela
+
+    Um lote incompleto é liberado quando a fila fica ociosa por `wait`
+    segundos, para não segurar arquivos esperando o lote encher.
+    """
+    batch = []
+    while True:
+        try:
+            file_path = download_queue.get(timeout=wait if batch else None)
+        except queue.Empty:
+            yield batch
+            batch = []
+            continue
+
+        download_queue.task_done()
+        if file_path is None:
+            download_queue.put(None)
+            if batch:
+                yield batch
+            return
+
+        batch.append(to_pool_item(file_path))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+def process_files_parallel():
+    """Processa os arquivos da fila com um pool de processos e um único escritor
+
+    Os processos fazem json.load, varredura dos recursos e clean_text; esta
+    thread apenas grava os lotes no SQLite. Com ETL_CONFIG['parse_ordered']
+    desligado os resultados chegam fora de ordem, sem esperar arquivos lentos.
+    """
+    start_time = time.time()
+    conn = apply_write_pragmas(get_sqlite_connection())
+    group = new_commit_group(conn)
+    interval = ETL_CONFIG['commit_interval_ms'] / 1000
+    try:
+        with multiprocessing.Pool(processes=ETL_CONFIG['parse_workers']) as pool:
+            imap = pool.imap if ETL_CONFIG['parse_ordered'] else pool.imap_unordered
+            results = imap(safe_parse_bundles, iter_download_batches(ETL_CONFIG['parse_chunksize']))
+            while True:
+                try:
+                    batch = results.next(timeout=interval)
+                except multiprocessing.TimeoutError:
+                    flush_commit_group(conn, group)
+                    continue
+                except StopIteration:
+                    break
+                for result in batch:
+                    store_parse_result(conn, group, *result)
+
+        flush_commit_group(conn, group)
+    finally:
+        conn.close()
+        print_process_summary(start_time)
+
+def get_shard_path(index):
+    """Caminho do arquivo de um shard, ao lado do banco principal"""
+    base, ext = os.path.splitext(DB_CONFIG_SQLITE['database'])
+    return f"{base}.shard{index}{ext or '.db'}"
+
+def list_shard_paths():
+    """Shards existentes em disco (inclusive os deixados por uma execução interrompida)"""
+    base, ext = os.path.splitext(DB_CONFIG_SQLITE['database'])
+    return sorted(glob.glob(f"{glob.escape(base)}.shard[0-9]*{ext or '.db'}"))
+
+def get_shard_connection(index):
+    """Abre um shard com o mesmo schema do banco principal e sem índices secundários
+
+    Os shards são temporários: WAL e synchronous=NORMAL bastam, pois o que
+    não for mesclado é refeito a partir de processed_files.
+    """
+    conn = sqlite3.connect(get_shard_path(index), check_same_thread=False)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{max(1, ETL_CONFIG['bulk_cache_kb'] // ETL_CONFIG['write_shards'])}")
+    create_sqlite_schema(conn)
+    for index_name in SQLITE_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+    conn.commit()
+    return conn
+
+def get_shard_index(patient_id, shards):
+    """Shard de um paciente: hash estável de patient_id (igual entre execuções)"""
+    return zlib.crc32((patient_id or '').encode('utf-8')) % shards
+
+def shard_writer(index, results):
+    """Escritor de um shard: grava os resultados roteados para ele com commits agrupados"""
+    conn = get_shard_connection(index)
+    group = new_commit_group(conn)
+    interval = ETL_CONFIG['commit_interval_ms'] / 1000
+    try:
+        while True:
+            try:
+                result = results.get(timeout=interval)
+            except queue.Empty:
+                flush_commit_group(conn, group)
                 continue
+            if result is None:
+                break
+            store_parse_result(conn, group, *result)
+        flush_commit_group(conn, group)
+    finally:
+        conn.close()
+
+def iter_parse_results(pool=None):
+    """Resultados de parsing da download_queue: no pool (em lotes) ou nesta thread"""
+    if pool:
+        imap = pool.imap if ETL_CONFIG['parse_ordered'] else pool.imap_unordered
+        for batch in imap(safe_parse_bundles, iter_download_batches(ETL_CONFIG['parse_chunksize'])):
+            yield from batch
+        return
+
+    while True:
+        bundle = download_queue.get()
+        download_queue.task_done()
+        if bundle is None:
+            download_queue.put(None)
+            return
+        yield safe_parse_bundle(bundle)
+
+def process_files_sharded():
+    """Processa os arquivos com N escritores, um por shard do SQLite
+
+    Cada resultado de parsing é roteado pelo hash de patient_id para a fila
+    do seu shard; cada shard tem conexão, transações e lock próprios, então
+    as escritas não disputam o lock único do banco principal. Ao final os
+    shards são mesclados em medicaldatabase.db (merge_sqlite_shards).
+    """
+    start_time = time.time()
+    shards = ETL_CONFIG['write_shards']
+    shard_queues = [queue.Queue(maxsize=ETL_CONFIG['commit_files']) for _ in range(shards)]
+    writers = [
+        threading.Thread(target=shard_writer, args=(i, shard_queues[i]), name=f"shard-writer-{i}")
+        for i in range(shards)
+    ]
+    for writer in writers:
+        writer.start()
+
+    pool = multiprocessing.Pool(processes=ETL_CONFIG['parse_workers']) if ETL_CONFIG['parse_workers'] > 1 else None
+    try:
+        for file_name, parsed, error in iter_parse_results(pool):
+            index = get_shard_index(parsed['patient'][0], shards) if parsed else 0
+            shard_queues[index].put((file_name, parsed, error))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        for shard_queue in shard_queues:
+            shard_queue.put(None)
+        for writer in writers:
+            writer.join()
+        print_process_summary(start_time)
+
+    merge_sqlite_shards()
+
+def merge_sqlite_shard(conn, shard_path):
+    """Mescla um shard no banco principal numa única transação
+
+    Pacientes e textos entram com INSERT OR IGNORE; os fatos são remapeados
+    para patient_key e ids de vocabulário do banco principal pelos valores
+    naturais (patient_id e texto). Arquivos alterados na origem têm as
+    linhas anteriores do paciente removidas do banco principal antes. Um
+    shard cujos arquivos (com o mesmo hash) já constam em processed_files
+    foi mesclado antes de uma queda e é apenas descartado.
+    """
+    cursor = conn.cursor()
+    cursor.execute("ATTACH DATABASE ? AS shard", (shard_path,))
+    try:
+        cursor.execute("""
+            SELECT EXISTS(
+                SELECT 1 FROM shard.processed_files s
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM main.processed_files m
+                    WHERE m.file_name = s.file_name AND m.content_hash IS s.content_hash
+                )
+            )
+        """)
+        if not cursor.fetchone()[0]:
+            return 0
+
+        cursor.execute("BEGIN")
+        changed_patients = """
+            SELECT p.patient_key
+            FROM main.processed_files m
+            JOIN shard.processed_files s
+              ON s.file_name = m.file_name AND m.content_hash IS NOT s.content_hash
+            JOIN main.patients p ON p.patient_id IN (m.patient_id, s.patient_id)
+        """
+        for domain in SQLITE_VOCABULARIES.values():
+            cursor.execute(f"DELETE FROM main.{domain['facts']} WHERE patient_key IN ({changed_patients})")
+        cursor.execute(f"""
+            UPDATE main.patients
+            SET gender = (SELECT sp.gender FROM shard.patients sp WHERE sp.patient_id = main.patients.patient_id)
+            WHERE patient_key IN ({changed_patients})
+              AND patient_id IN (SELECT patient_id FROM shard.patients)
+        """)
+        cursor.execute("""
+            INSERT OR IGNORE INTO main.patients (patient_id, gender, data_inclusao)
+            SELECT patient_id, gender, data_inclusao FROM shard.patients ORDER BY patient_key
+        """)
+        for domain in SQLITE_VOCABULARIES.values():
+            extra_names = [name for name, _ in domain.get('columns', [])]
+            insert_columns = ''.join(f", {name}" for name in extra_names)
+            select_columns = ''.join(f", f.{name}" for name in extra_names)
+            cursor.execute(f"""
+                INSERT OR IGNORE INTO main.{domain['vocab']} ({domain['text']})
+                SELECT {domain['text']} FROM shard.{domain['vocab']} ORDER BY id
+            """)
+            cursor.execute(f"""
+                INSERT INTO main.{domain['facts']} (patient_key, {domain['id']}{insert_columns}, data_inclusao)
+                SELECT p.patient_key, v.id{select_columns}, f.data_inclusao
+                FROM shard.{domain['facts']} f
+                JOIN shard.patients sp ON sp.patient_key = f.patient_key
+                JOIN main.patients p ON p.patient_id = sp.patient_id
+                JOIN shard.{domain['vocab']} sv ON sv.id = f.{domain['id']}
+                JOIN main.{domain['vocab']} v ON v.{domain['text']} = sv.{domain['text']}
+                ORDER BY f.id
+            """)
+        cursor.execute("""
+            INSERT OR REPLACE INTO main.processed_files (rowid, file_name, content_hash, patient_id, data_inclusao)
+            SELECT (SELECT IFNULL(MAX(rowid), 0) FROM main.processed_files) + rowid,
+                   file_name, content_hash, patient_id, data_inclusao
+            FROM shard.processed_files
+        """)
+        merged = cursor.rowcount
+        conn.commit()
+        return merged
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("DETACH DATABASE shard")
+        cursor.close()
+
+def merge_sqlite_shards():
+    """Mescla todos os shards no banco principal e constrói os índices uma única vez
+
+    Também é chamada no início de uma execução para recuperar shards de uma
+    execução interrompida antes da mesclagem. No modo de carga em massa os
+    índices já foram removidos e quem os reconstrói (com o ANALYZE) é
+    finish_bulk_load, então a mesclagem não os toca.
+    """
+    shard_paths = list_shard_paths()
+    if not shard_paths:
+        return
+
+    start_time = time.time()
+    print(f"\nMesclando {len(shard_paths)} shards no banco principal...")
+    conn = get_sqlite_connection()
+    try:
+        conn.execute(f"PRAGMA cache_size = -{ETL_CONFIG['bulk_cache_kb']}")
+        if not bulk_load_active:
+            for index_name in SQLITE_INDEXES:
+                conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+            conn.commit()
+
+        for shard_path in shard_paths:
+            merged = merge_sqlite_shard(conn, shard_path)
+            print(f"- {os.path.basename(shard_path)}: {merged} arquivos")
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(shard_path + suffix):
+                    os.remove(shard_path + suffix)
+
+        if not bulk_load_active:
+            for index_ddl in SQLITE_INDEXES.values():
+                conn.execute(index_ddl)
+            conn.execute("ANALYZE")
+            conn.commit()
+    finally:
+        conn.close()
+    print(f"Mesclagem concluída em {format_time(time.time() - start_time)}")
+
+NDJSON_RESOURCE_TYPES = {'Patient'} | set(ENABLED_EXTRACTORS)
 
+def get_reference_id(reference):
+    """Extrai o id de uma referência FHIR ('Patient/<id>' ou 'urn:uuid:<id>')"""
+    if not reference:
+        return None
+    if reference.startswith('urn:uuid:'):
+        return reference[len('urn:uuid:'):]
+    return reference.rsplit('/', 1)[-1]
+
+def parse_ndjson_chunk(chunk):
+    """Converte uma faixa de um arquivo NDJSON em lotes de linhas (executado no pool)
+
+    Cada linha é um recurso; os tipos com extrator habilitado são ligados ao
+    paciente por subject.reference e geram linhas (patient_id, *linha).
+    Só a faixa corrente fica em memória.
+    """
+    result = {'name': chunk['name'], 'version': chunk.get('sha'), 'patients': [],
+              'rows': {spec['target']: [] for spec in ENABLED_EXTRACTORS.values()},
+              'invalid': 0, 'error': None}
+    try:
+        for line in sources.iter_ndjson_lines(chunk['path'], chunk['start'], chunk['end']):
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    entries = data.get('entry', [])
-
-                    patient = next(
-                        (e['resource'] for e in entries
-                         if e.get('resource', {}).get('resourceType') == 'Patient'),
-                        None
-                    )
+                resource = json.loads(line)
+            except ValueError:
+                result['invalid'] += 1
+                continue
 
-                    if not patient:
-                        download_queue.task_done()
-                        continue
+            resource_type = resource.get('resourceType')
+            if resource_type == 'Patient':
+                result['patients'].append((resource.get('id'), resource.get('gender', 'unknown')))
+                continue
 
-                    patient_id = patient.get('id')
-                    gender = patient.get('gender', 'unknown')
+            spec = ENABLED_EXTRACTORS.get(resource_type)
+            if not spec:
+                continue
+            patient_id = get_reference_id(resource.get('subject', {}).get('reference'))
+            row = spec['extract'](resource)
+            if patient_id and row:
+                result['rows'][spec['target']].append((patient_id, *row))
+    except Exception as e:
+        result['error'] = str(e)
+    return result
 
-                    cursor = conn.cursor()
-                    cursor.execute(
-                        "INSERT OR IGNORE INTO patients (patient_id, gender) VALUES (?, ?)",
-                        (patient_id, gender)
-                    )
+def write_ndjson_chunk(conn, vocab_cache, result):
+    """Grava uma faixa NDJSON e sua marca em processed_files numa única transação
 
-                    for entry in entries:
-                        resource = entry.get('resource', {})
-                        resource_type = resource.get('resourceType')
-
-                        if resource_type == 'Condition':
-                            condition_text = clean_text(resource.get('code', {}).get('text', ''))
-                            if condition_text:
-                                cursor.execute(
-                                    "INSERT INTO conditions (patient_id, condition_text) VALUES (?, ?)",
-                                    (patient_id, condition_text)
-                                )
-
-                        elif resource_type == 'MedicationRequest':
-                            medication_text = clean_text(resource.get('medicationCodeableConcept', {}).get('text', ''))
-                            if medication_text:
-                                cursor.execute(
-                                    "INSERT INTO medications (patient_id, medication_text) VALUES (?, ?)",
-                                    (patient_id, medication_text)
-                                )
-
-                    conn.commit()
-                    mark_file_as_processed(conn, file_name)
+    Retorna o número de linhas de pacientes inexistentes. Se houver alguma, a
+    transação é desfeita e a faixa não é marcada como processada: ela volta
+    na próxima execução, quando o paciente pode já ter sido carregado, em
+    vez de perder essas linhas em definitivo.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            "INSERT OR IGNORE INTO patients (patient_id, gender) VALUES (?, ?)",
+            result['patients']
+        )
+
+        orphans = 0
+        for view, rows in result['rows'].items():
+            vocab_ids = get_vocabulary_ids(conn, vocab_cache, view, [row[1] for row in rows])
+            cursor.executemany(
+                get_facts_insert(view, "SELECT patient_key, {} FROM patients WHERE patient_id = ?"),
+                [(vocab_id, *row[2:], row[0]) for vocab_id, row in zip(vocab_ids, rows)]
+            )
+            orphans += len(rows) - max(cursor.rowcount, 0)
+
+        if orphans:
+            conn.rollback()
+            vocab_cache.update(new_vocabulary_cache())
+            return orphans
+
+        cursor.execute("INSERT OR IGNORE INTO processed_files (file_name, content_hash) VALUES (?, ?)",
+                       (result['name'], result['version']))
+        conn.commit()
+        return 0
+    except Exception:
+        conn.rollback()
+        vocab_cache.update(new_vocabulary_cache())
+        raise
+    finally:
+        cursor.close()
+
+def process_ndjson_export(chunks):
+    """Ingestão de uma exportação FHIR Bulk Data ($export) em NDJSON
+
+    As faixas de Patient são carregadas primeiro, para que as referências
+    dos demais recursos encontrem seus pacientes; em seguida os demais tipos
+    habilitados (ETL_CONFIG['resource_types']). Cada fase é processada em paralelo pelo pool de
+    processos, com um único escritor. Se alguma faixa de Patient falhar, a
+    segunda fase não roda: as faixas dos demais tipos ficam pendentes para a
+    próxima execução em vez de perderem as linhas daqueles pacientes.
+    """
+    global processed_count, errors_count, total_to_process
+    start_time = time.time()
+    total_to_process = len(chunks)
+    orphans = 0
+    invalid = 0
+    conn = apply_write_pragmas(get_sqlite_connection())
+    vocab_cache = new_vocabulary_cache()
+
+    phases = [
+        [c for c in chunks.values() if c['resource_type'] == 'Patient'],
+        [c for c in chunks.values() if c['resource_type'] != 'Patient']
+    ]
+    print(f"\nTotal de faixas NDJSON a processar: {total_to_process}")
+
+    pool = multiprocessing.Pool(processes=ETL_CONFIG['parse_workers']) if ETL_CONFIG['parse_workers'] > 1 else None
+    try:
+        failed = 0
+        for phase in phases:
+            if failed:
+                print(f"\nFaixas de Patient com erro: {len(phase)} faixas dos demais tipos "
+                      f"ficam pendentes para a próxima execução")
+                break
+
+            results = pool.imap_unordered(parse_ndjson_chunk, phase) if pool else map(parse_ndjson_chunk, phase)
+            for result in results:
+                try:
+                    if result['error']:
+                        raise Exception(result['error'])
+                    chunk_orphans = write_ndjson_chunk(conn, vocab_cache, result)
+                    if chunk_orphans:
+                        orphans += chunk_orphans
+                        raise Exception(f"{chunk_orphans} registros sem paciente correspondente; "
+                                        f"a faixa fica pendente para a próxima execução")
+                    invalid += result['invalid']
                     with counter_lock:
                         processed_count += 1
-                        print_progress(processed_count, total_to_process, prefix="Ingestão")
-                    print(f"\nArquivo {file_name} processado com sucesso.")
-            except Exception as e:
-                with counter_lock:
-                    errors_count += 1
-                print(f"\nErro no arquivo {file_name}: {str(e)}")
-                conn.rollback()
-            finally:
-                download_queue.task_done()
+                        print_progress(processed_count, total_to_process, prefix="Ingestão NDJSON")
+                except Exception as e:
+                    failed += 1
+                    with counter_lock:
+                        errors_count += 1
+                    print(f"\nErro na faixa {result['name']}: {str(e)}")
     finally:
+        if pool:
+            pool.close()
+            pool.join()
         conn.close()
-        elapsed = time.time() - start_time
-        print("\nProcessamento concluído:")
-        print(f"- Arquivos processados: {processed_count}")
-        print(f"- Erros: {errors_count}")
-        print(f"- Tempo total: {int(elapsed // 60)}m {int(elapsed % 60)}s")
+        print_process_summary(start_time)
+        print(f"- Linhas inválidas: {invalid}")
+        print(f"- Registros sem paciente correspondente: {orphans}")
+
+def get_process_target():
+    """Seleciona a etapa de processamento conforme ETL_CONFIG (shards e parse_workers)"""
+    if ETL_CONFIG['write_shards'] > 1:
+        return process_files_sharded
+    if ETL_CONFIG['parse_workers'] > 1:
+        return process_files_parallel
+    return process_files
 
 def validate_environment():
     """Verifica estrutura de diretórios necessária"""
@@ -1003,9 +2872,10 @@ def run_full_pipeline():
             return
         conn = get_sqlite_connection()
         create_sqlite_schema(conn)
+        merge_sqlite_shards()  # Shards de uma execução interrompida antes da mesclagem
         
         try:
-            remote_files = get_remote_files()
+            remote_files = list_source_files()
         except Exception as e:
             print(f"Erro ao obter arquivos remotos: {str(e)}")
             conn.close()
@@ -1016,7 +2886,7 @@ def run_full_pipeline():
             conn.close()
             continue
             
-        files_to_process = [name for name in remote_files if not is_file_processed(conn, name)]
+        files_to_process = get_files_to_download(conn, remote_files)
         
         if not files_to_process:
             conn.close()
@@ -1033,6 +2903,7 @@ def run_full_pipeline():
                     handle_migration_choice('M')
                 elif choice == 'N':
                     print("\nEncerrando programa...")
+                    pg_pool.close_pool()
                     return
                 else:
                     print("Opção inválida. Tente novamente.")
@@ -1041,21 +2912,30 @@ def run_full_pipeline():
                 os.system('cls' if os.name == 'nt' else 'clear')  # Limpa a tela
                 
         else:
-            current_time = datetime.now().strftime("%Y%m%d_Hs%H-%M")
             base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-            process_dir = os.path.join(base_dir, 'data', f'data_process_{current_time}')
-            os.makedirs(process_dir, exist_ok=True)
+            process_dir = prepare_process_dir(base_dir)
+            if not ETL_CONFIG['in_memory']:  # No modo em memória nada é gravado por execução
+                os.makedirs(process_dir, exist_ok=True)
             LOCAL_DATA_DIR = process_dir
+            bulk_load = start_bulk_load_if_needed(conn)
             conn.close()
 
-            download_thread = threading.Thread(target=download_files)
-            process_thread = threading.Thread(target=process_files)
-            
-            download_thread.start()
-            process_thread.start()
-            
-            download_thread.join()
-            process_thread.join()
+            if ETL_CONFIG['source_format'] == 'ndjson':
+                process_ndjson_export(files_to_process)
+            else:
+                open_run_journal(process_dir, files_to_process)
+                download_thread = threading.Thread(target=get_download_target(), args=(files_to_process,))
+                process_thread = threading.Thread(target=get_process_target())
+                
+                download_thread.start()
+                process_thread.start()
+                
+                download_thread.join()
+                process_thread.join()
+                close_run_journal()
+
+            if bulk_load:
+                finish_bulk_load()
 
             while True:
                 visualization_choice = input("\nDeseja visualizar os dados agora? (V/N) ").strip().upper()
@@ -1075,9 +2955,10 @@ def main():
         # Conectar ao SQLite sem verificar PostgreSQL
         conn = get_sqlite_connection()
         create_sqlite_schema(conn)
+        merge_sqlite_shards()  # Shards de uma execução interrompida antes da mesclagem
         
         try:
-            remote_files = get_remote_files()
+            remote_files = list_source_files()
         except Exception as e:
             print(f"Erro ao obter arquivos remotos: {str(e)}")
             conn.close()
@@ -1088,7 +2969,7 @@ def main():
             conn.close()
             continue
             
-        files_to_process = [name for name in remote_files if not is_file_processed(conn, name)]
+        files_to_process = get_files_to_download(conn, remote_files)
         
         if not files_to_process:
             conn.close()
@@ -1105,6 +2986,7 @@ def main():
                     handle_migration_choice('M')
                 elif choice == 'N':
                     print("\nEncerrando programa...")
+                    pg_pool.close_pool()
                     return
                 else:
                     print("Opção inválida. Tente novamente.")
@@ -1113,21 +2995,30 @@ def main():
                 os.system('cls' if os.name == 'nt' else 'clear')  # Limpa a tela
                 
         else:
-            current_time = datetime.now().strftime("%Y%m%d_Hs%H-%M")
             base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-            process_dir = os.path.join(base_dir, 'data', f'data_process_{current_time}')
-            os.makedirs(process_dir, exist_ok=True)
+            process_dir = prepare_process_dir(base_dir)
+            if not ETL_CONFIG['in_memory']:  # No modo em memória nada é gravado por execução
+                os.makedirs(process_dir, exist_ok=True)
             LOCAL_DATA_DIR = process_dir
+            bulk_load = start_bulk_load_if_needed(conn)
             conn.close()
 
-            download_thread = threading.Thread(target=download_files)
-            process_thread = threading.Thread(target=process_files)
-            
-            download_thread.start()
-            process_thread.start()
-            
-            download_thread.join()
-            process_thread.join()
+            if ETL_CONFIG['source_format'] == 'ndjson':
+                process_ndjson_export(files_to_process)
+            else:
+                open_run_journal(process_dir, files_to_process)
+                download_thread = threading.Thread(target=get_download_target(), args=(files_to_process,))
+                process_thread = threading.Thread(target=get_process_target())
+                
+                download_thread.start()
+                process_thread.start()
+                
+                download_thread.join()
+                process_thread.join()
+                close_run_journal()
+
+            if bulk_load:
+                finish_bulk_load()
 
             while True:
                 visualization_choice = input("\nDeseja visualizar os dados agora? (V/N) ").strip().upper()
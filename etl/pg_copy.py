@@ -0,0 +1,163 @@
+import io
+import csv
+import struct
+import functools
+from datetime import datetime
+
+# Adaptadores para COPY ... FROM STDIN do psycopg2: o cursor do SQLite é
+# lido em lotes (fetchmany) e convertido sob demanda, à medida que o
+# copy_expert chama read(). Nenhum arquivo intermediário é gravado e a
+# memória fica limitada a um lote por worker.
+
+FETCH_SIZE = 5000
+READ_SIZE = 1024 * 1024
+
+# Formato binário do COPY: assinatura, flags e tamanho da extensão do cabeçalho;
+# o trailer é uma contagem de campos -1
+BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+BINARY_TRAILER = struct.pack('!h', -1)
+BINARY_NULL = struct.pack('!i', -1)
+POSTGRES_EPOCH = datetime(2000, 1, 1)
+
+
+def iter_batches(cursor, fetch_size=FETCH_SIZE):
+    """Gera os lotes de linhas do cursor até o fim do resultado"""
+    while True:
+        batch = cursor.fetchmany(fetch_size)
+        if not batch:
+            return
+        yield batch
+
+
+def clean_csv_value(item):
+    """Converte um valor para o CSV: None vira campo vazio (NULL) e quebras de linha viram espaço"""
+    if item is None:
+        return ''
+    return str(item).replace('\r', ' ').replace('\n', ' ')
+
+
+def iter_csv_chunks(cursor, fetch_size=FETCH_SIZE):
+    """Gera cada lote do cursor como CSV codificado em UTF-8"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for batch in iter_batches(cursor, fetch_size):
+        writer.writerows([clean_csv_value(item) for item in row] for row in batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def encode_text(value):
+    """TEXT: bytes UTF-8 do valor, sem escapes"""
+    data = (value if isinstance(value, str) else str(value)).encode('utf-8')
+    return struct.pack('!i', len(data)) + data
+
+
+def encode_integer(value):
+    """INTEGER (int4): inteiro de 32 bits big-endian"""
+    return struct.pack('!ii', 4, int(value))
+
+
+def encode_bigint(value):
+    """BIGINT (int8): inteiro de 64 bits big-endian"""
+    return struct.pack('!iq', 8, int(value))
+
+
+@functools.lru_cache(maxsize=4096)
+def encode_timestamp_text(value):
+    """TIMESTAMP a partir do texto do SQLite ('AAAA-MM-DD HH:MM:SS[.ffffff]')
+
+    Memoizado: as linhas de um mesmo commit compartilham o CURRENT_TIMESTAMP.
+    """
+    return encode_datetime(datetime.fromisoformat(value))
+
+
+def encode_datetime(value):
+    """TIMESTAMP: microssegundos desde 2000-01-01 em int8"""
+    delta = value.replace(tzinfo=None) - POSTGRES_EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+    return struct.pack('!iq', 8, micros)
+
+
+def encode_timestamp(value):
+    """TIMESTAMP a partir de texto ou datetime"""
+    if isinstance(value, datetime):
+        return encode_datetime(value)
+    return encode_timestamp_text(value)
+
+
+BINARY_ENCODERS = {
+    'text': encode_text,
+    'integer': encode_integer,
+    'bigint': encode_bigint,
+    'timestamp': encode_timestamp
+}
+
+
+def iter_binary_chunks(cursor, column_types, fetch_size=FETCH_SIZE):
+    """Gera o fluxo do COPY binário: cabeçalho, um bloco por lote do cursor e trailer
+
+    column_types lista o tipo ('text', 'integer', 'bigint' ou 'timestamp') de cada
+    coluna, na ordem do SELECT. None é gravado como NULL (tamanho -1).
+    """
+    encoders = [BINARY_ENCODERS[column_type] for column_type in column_types]
+    field_count = struct.pack('!h', len(encoders))
+    yield BINARY_HEADER
+    for batch in iter_batches(cursor, fetch_size):
+        parts = []
+        for row in batch:
+            parts.append(field_count)
+            for encode, item in zip(encoders, row):
+                parts.append(BINARY_NULL if item is None else encode(item))
+        yield b''.join(parts)
+    yield BINARY_TRAILER
+
+
+class ChunkReader(io.RawIOBase):
+    """Arquivo somente leitura sobre um iterador de blocos de bytes
+
+    Entregue ao copy_expert no lugar do arquivo CSV: cada read() consome só
+    os blocos necessários para atender ao tamanho pedido.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.pending = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.pending = memoryview(chunk)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def open_copy_stream(chunks):
+    """Abre os blocos gerados como arquivo binário para o copy_expert"""
+    return io.BufferedReader(ChunkReader(chunks), buffer_size=READ_SIZE)
+
+
+def copy_csv_from_cursor(pg_cursor, table, columns, sqlite_cursor, fetch_size=FETCH_SIZE):
+    """Executa COPY ... FROM STDIN (CSV) alimentado diretamente pelo cursor do SQLite"""
+    pg_cursor.copy_expert(
+        f"COPY {table} ({','.join(columns)}) "
+        "FROM STDIN WITH (FORMAT CSV, DELIMITER ',', NULL '', ENCODING 'UTF8')",
+        open_copy_stream(iter_csv_chunks(sqlite_cursor, fetch_size)),
+        size=READ_SIZE
+    )
+
+
+def copy_binary_from_cursor(pg_cursor, table, columns, column_types, sqlite_cursor, fetch_size=FETCH_SIZE):
+    """Executa COPY ... FROM STDIN (FORMAT binary), sem conversão para texto nem parsing de CSV"""
+    pg_cursor.copy_expert(
+        f"COPY {table} ({','.join(columns)}) FROM STDIN WITH (FORMAT binary)",
+        open_copy_stream(iter_binary_chunks(sqlite_cursor, column_types, fetch_size)),
+        size=READ_SIZE
+    )
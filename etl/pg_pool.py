@@ -0,0 +1,188 @@
+import time
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+from config.settings import DB_CONFIG_POSTGRES, ETL_CONFIG
+
+# Pool de conexões do PostgreSQL compartilhado pelo processo de ETL
+# (migração e agregados; o dashboard lê o SQLite). As conexões são abertas sob demanda até
+# ETL_PG_POOL_MAX e ficam abertas para reuso; acima do limite quem pede
+# espera uma ser devolvida, em vez de abrir mais conexões no servidor.
+# search_path e synchronous_commit vão nas opções de inicialização,
+# aplicados uma única vez por conexão física.
+#
+# O ThreadedConnectionPool do psycopg2 não serve aqui: ele fecha toda
+# conexão devolvida além de minconn e falha (em vez de esperar) quando
+# esgotado.
+
+pool_lock = threading.Lock()
+pool_slots = None
+
+# Conexões ociosas (a última devolvida sai primeiro) e a hora da devolução
+idle_connections = []
+last_used = {}
+
+pool_stats = {
+    'checkouts': 0,          # Conexões entregues
+    'created': 0,            # Conexões físicas abertas
+    'discarded': 0,          # Conexões descartadas (quebradas ou reprovadas no health check)
+    'health_checks': 0,      # SELECT 1 executados
+    'in_use': 0,             # Emprestadas no momento
+    'max_in_use': 0,         # Pico de conexões emprestadas
+    'waits': 0,              # Pedidos que esperaram uma conexão livre
+    'wait_seconds': 0.0      # Tempo total de espera
+}
+
+
+def get_session_options():
+    """Parâmetros de sessão enviados na conexão (libpq 'options')"""
+    return (f"-c search_path={DB_CONFIG_POSTGRES['schema']},public "
+            f"-c synchronous_commit={ETL_CONFIG['pg_synchronous_commit']}")
+
+
+def open_connection():
+    """Abre uma conexão física com os parâmetros de sessão do pool"""
+    conn = psycopg2.connect(
+        dbname=DB_CONFIG_POSTGRES['dbname'],
+        user=DB_CONFIG_POSTGRES['user'],
+        password=DB_CONFIG_POSTGRES['password'],
+        host=DB_CONFIG_POSTGRES['host'],
+        port=DB_CONFIG_POSTGRES['port'],
+        options=get_session_options(),
+        application_name='medical-etl'
+    )
+    update_stats(created=1)
+    return conn
+
+
+def get_slots():
+    """Semáforo que limita as conexões emprestadas a pg_pool_max (criado na primeira chamada)"""
+    global pool_slots
+    with pool_lock:
+        if pool_slots is None:
+            pool_slots = threading.BoundedSemaphore(ETL_CONFIG['pg_pool_max'])
+        return pool_slots
+
+
+def update_stats(**changes):
+    """Soma as variações informadas às métricas do pool"""
+    with pool_lock:
+        for name, delta in changes.items():
+            pool_stats[name] += delta
+        pool_stats['max_in_use'] = max(pool_stats['max_in_use'], pool_stats['in_use'])
+
+
+def is_healthy(conn):
+    """Health check: conexão aberta e, se ociosa há mais de pg_pool_check_idle_s, responde a SELECT 1"""
+    if conn.closed:
+        return False
+    if time.monotonic() - last_used.get(id(conn), 0) < ETL_CONFIG['pg_pool_check_idle_s']:
+        return True
+    update_stats(health_checks=1)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def discard_connection(conn):
+    """Fecha uma conexão que não volta ao pool"""
+    last_used.pop(id(conn), None)
+    update_stats(discarded=1)
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
+def get_connection():
+    """Empresta uma conexão saudável do pool, esperando se todas estiverem em uso
+
+    Conexões quebradas são descartadas e substituídas. Toda conexão
+    emprestada deve voltar por release_connection (ou use connection()).
+    """
+    slots = get_slots()
+    started = time.perf_counter()
+    if not slots.acquire(blocking=False):
+        slots.acquire()
+        update_stats(waits=1, wait_seconds=time.perf_counter() - started)
+
+    try:
+        while True:
+            with pool_lock:
+                conn = idle_connections.pop() if idle_connections else None
+            if conn is None:
+                conn = open_connection()
+            elif not is_healthy(conn):
+                discard_connection(conn)
+                continue
+            update_stats(checkouts=1, in_use=1)
+            return conn
+    except Exception:
+        slots.release()
+        raise
+
+
+def release_connection(conn, close=False):
+    """Devolve a conexão ao pool, desfazendo a transação aberta; close=True a descarta"""
+    if conn is None:
+        return
+    try:
+        status = psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN if conn.closed else conn.info.transaction_status
+        if close or status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            discard_connection(conn)
+            return
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        last_used[id(conn)] = time.monotonic()
+        with pool_lock:
+            idle_connections.append(conn)
+    except psycopg2.Error:
+        discard_connection(conn)
+    finally:
+        update_stats(in_use=-1)
+        pool_slots.release()
+
+
+@contextmanager
+def connection():
+    """with connection() as conn: empréstimo com devolução garantida"""
+    conn = get_connection()
+    try:
+        yield conn
+    finally:
+        release_connection(conn)
+
+
+def get_pool_stats():
+    """Cópia das métricas de uso do pool, com as conexões ociosas"""
+    with pool_lock:
+        return dict(pool_stats, idle=len(idle_connections))
+
+
+def print_pool_stats():
+    """Imprime as métricas de uso do pool"""
+    stats = get_pool_stats()
+    if not stats['checkouts']:
+        return
+    print(f"\nPool PostgreSQL (máx. {ETL_CONFIG['pg_pool_max']} conexões):")
+    print(f"- Empréstimos: {stats['checkouts']}, conexões abertas: {stats['created']}, "
+          f"ociosas: {stats['idle']}, descartadas: {stats['discarded']}")
+    print(f"- Pico em uso: {stats['max_in_use']}, esperas: {stats['waits']} "
+          f"({stats['wait_seconds']:.2f}s), health checks: {stats['health_checks']}")
+
+
+def close_pool():
+    """Fecha as conexões ociosas do pool (fim do processo)"""
+    with pool_lock:
+        connections = list(idle_connections)
+        idle_connections.clear()
+    for conn in connections:
+        last_used.pop(id(conn), None)
+        conn.close()
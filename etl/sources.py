@@ -0,0 +1,191 @@
+import os
+import json
+import tarfile
+import zipfile
+
+# Fontes locais de bundles FHIR: um diretório ou um arquivo tar/zip.
+# Os membros de arquivos compactados são lidos em memória e entregues
+# direto à etapa de parsing, sem extração para disco. Também divide
+# exportações FHIR Bulk Data (NDJSON) em faixas de bytes.
+
+
+def get_source_kind(source):
+    """Identifica o tipo da fonte: 'directory', 'zip' ou 'tar'"""
+    if os.path.isdir(source):
+        return 'directory'
+    if zipfile.is_zipfile(source):
+        return 'zip'
+    if tarfile.is_tarfile(source):
+        return 'tar'
+    raise ValueError(f"Fonte não suportada: {source}")
+
+
+def is_bundle_name(path):
+    """Aceita apenas arquivos .json, ignorando metadados ocultos do arquivo"""
+    name = os.path.basename(path)
+    return name.endswith('.json') and not name.startswith('.')
+
+
+def list_source_files(source):
+    """Lista os bundles da fonte no mesmo formato de get_remote_files"""
+    kind = get_source_kind(source)
+    files = {}
+
+    if kind == 'directory':
+        for entry in os.scandir(source):
+            if entry.is_file() and is_bundle_name(entry.name):
+                files[entry.name] = {
+                    'name': entry.name,
+                    'path': entry.path,
+                    'size': entry.stat().st_size,
+                    'type': 'file'
+                }
+
+    elif kind == 'zip':
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and is_bundle_name(info.filename):
+                    name = os.path.basename(info.filename)
+                    files[name] = {
+                        'name': name,
+                        'path': info.filename,
+                        'size': info.file_size,
+                        'sha': f"crc32-{info.CRC:08x}",  # Checksum do zip: detecta membros alterados
+                        'type': 'file'
+                    }
+
+    else:
+        with tarfile.open(source, 'r:*') as archive:
+            for member in archive:
+                if member.isfile() and is_bundle_name(member.name):
+                    name = os.path.basename(member.name)
+                    files[name] = {
+                        'name': name,
+                        'path': member.name,
+                        'size': member.size,
+                        'type': 'file'
+                    }
+
+    return files
+
+
+def iter_source_bundles(source, names):
+    """Gera os bundles pedidos como caminho (diretório) ou (nome, bytes) (arquivos)
+
+    Arquivos tar são percorridos em modo stream ('r|*'), uma única passada
+    sequencial, sem índice nem extração.
+    """
+    kind = get_source_kind(source)
+    names = set(names)
+
+    if kind == 'directory':
+        for name in sorted(names):
+            file_path = os.path.join(source, name)
+            if os.path.isfile(file_path):
+                yield file_path
+
+    elif kind == 'zip':
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                name = os.path.basename(info.filename)
+                if not info.is_dir() and name in names and is_bundle_name(name):
+                    yield name, archive.read(info)
+
+    else:
+        with tarfile.open(source, 'r|*') as archive:
+            for member in archive:
+                name = os.path.basename(member.name)
+                if member.isfile() and name in names and is_bundle_name(name):
+                    yield name, archive.extractfile(member).read()
+
+
+def get_ndjson_resource_type(file_path):
+    """Lê o resourceType da primeira linha de um arquivo NDJSON do $export"""
+    with open(file_path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                return json.loads(line).get('resourceType')
+    return None
+
+
+def list_ndjson_chunks(directory, chunk_bytes, resource_types):
+    """Divide os arquivos NDJSON do $export em faixas de bytes processáveis em paralelo
+
+    Cada faixa vira uma entrada {chave: metadados}, no mesmo formato da
+    listagem de bundles, para reaproveitar o controle de processed_files.
+    Em 'sha' vai a versão do arquivo (tamanho e mtime), gravada junto com a
+    faixa para que get_changed_ndjson_files detecte arquivos reescritos.
+    Arquivos de tipos fora de resource_types (ex.: Observation) são ignorados
+    sem serem lidos além da primeira linha.
+    """
+    export_name = os.path.basename(os.path.abspath(directory))
+    chunks = {}
+
+    for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+        if not entry.is_file() or not entry.name.endswith('.ndjson'):
+            continue
+
+        resource_type = get_ndjson_resource_type(entry.path)
+        if resource_type not in resource_types:
+            continue
+
+        stat = entry.stat()
+        size = stat.st_size
+        version = f"{size}-{stat.st_mtime_ns}"
+        for start in range(0, size, chunk_bytes):
+            end = min(start + chunk_bytes, size)
+            key = f"{export_name}/{entry.name}[{start}:{end}]"
+            chunks[key] = {
+                'name': key,
+                'path': entry.path,
+                'start': start,
+                'end': end,
+                'resource_type': resource_type,
+                'sha': version,
+                'type': 'chunk'
+            }
+
+    return chunks
+
+
+def get_changed_ndjson_files(chunks, processed):
+    """Arquivos NDJSON alterados desde a ingestão de alguma de suas faixas
+
+    processed é {chave: versão} de processed_files. Uma faixa gravada com
+    outra versão, ou (registros sem versão) cuja faixa não existe mais na
+    divisão atual, indica que o arquivo foi reescrito ou recebeu linhas: as
+    faixas antigas não correspondem mais às novas e retomar duplicaria os
+    fatos já carregados. Retorna os caminhos desses arquivos.
+    """
+    files = {}
+    for key, meta in chunks.items():
+        prefix = key.rsplit('[', 1)[0]
+        files.setdefault(prefix, (meta['path'], meta.get('sha'), set()))[2].add(key)
+
+    changed = set()
+    for key, version in processed.items():
+        prefix = key.rsplit('[', 1)[0]
+        if '[' not in key or prefix not in files:
+            continue
+        path, current_version, keys = files[prefix]
+        if (version is not None and version != current_version) or (version is None and key not in keys):
+            changed.add(path)
+    return changed
+
+
+def iter_ndjson_lines(file_path, start, end):
+    """Gera as linhas que começam dentro da faixa [start, end) do arquivo
+
+    A linha parcial no início da faixa pertence à faixa anterior e é
+    descartada; a última linha é lida até o fim mesmo que ultrapasse end.
+    """
+    with open(file_path, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                yield line
@@ -0,0 +1,187 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+import uuid
+import queue
+
+import pytest
+
+from config.settings import DB_CONFIG_POSTGRES, DB_CONFIG_SQLITE, ETL_CONFIG
+from etl import async_fetch
+
+
+def make_bundle(patient_id, gender='female', conditions=(), medications=()):
+    """Monta um bundle FHIR mínimo com um paciente, suas condições e medicações"""
+    entries = [{'resource': {'resourceType': 'Patient', 'id': patient_id, 'gender': gender}}]
+    entries += [{'resource': {'resourceType': 'Condition', 'code': {'text': text}}}
+                for text in conditions]
+    entries += [{'resource': {'resourceType': 'MedicationRequest', 'medicationCodeableConcept': {'text': text}}}
+                for text in medications]
+    return {'resourceType': 'Bundle', 'entry': entries}
+
+
+def write_bundles(directory, count, prefix='b'):
+    """Grava `count` bundles em `directory`; retorna {nome: bundle}"""
+    os.makedirs(directory, exist_ok=True)
+    bundles = {}
+    for i in range(count):
+        name = f"{prefix}{i}.json"
+        bundles[name] = make_bundle(
+            f"{prefix}-p{i}",
+            'male' if i % 2 else 'female',
+            conditions=[f"Condition {i % 3}", 'Flu/cold [x]'],
+            medications=[f"Drug {i % 2}"]
+        )
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+            json.dump(bundles[name], f)
+    return bundles
+
+
+@pytest.fixture
+def bundle_dir(tmp_path):
+    """Diretório com 6 bundles de exemplo"""
+    directory = tmp_path / 'bundles'
+    write_bundles(str(directory), 6)
+    return directory
+
+
+@pytest.fixture
+def bundle_server(bundle_dir):
+    """Servidor HTTP local que imita a API do GitHub sobre bundle_dir; retorna (data_url, raw_base_url)"""
+    server, data_url, raw_base_url = async_fetch.serve_bundle_directory(str(bundle_dir))
+    try:
+        yield data_url, raw_base_url
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def remote_files(pipeline, bundle_server, monkeypatch):
+    """Listagem de bundle_server obtida pela paginação da API de conteúdo do pipeline"""
+    monkeypatch.setattr(pipeline, 'DATA_URL', bundle_server[0])
+    return pipeline.list_remote_files_paged()
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """Aponta DB_CONFIG_SQLITE para um banco vazio em tmp_path"""
+    database = str(tmp_path / 'medicaldatabase.db')
+    monkeypatch.setitem(DB_CONFIG_SQLITE, 'database', database)
+    return database
+
+
+@pytest.fixture
+def etl_config(monkeypatch):
+    """Altera chaves do ETL_CONFIG só durante o teste: etl_config(chave=valor, ...)"""
+    def update(**values):
+        for key, value in values.items():
+            monkeypatch.setitem(ETL_CONFIG, key, value)
+    return update
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch, sqlite_db):
+    """etl.loader_pipeline com filas, contadores, diário e cache isolados em tmp_path"""
+    from etl import loader_pipeline
+
+    process_dir = tmp_path / 'data_process'
+    process_dir.mkdir()
+    cache_dir = tmp_path / 'cache'
+    monkeypatch.setattr(loader_pipeline, 'download_queue', queue.Queue())
+    monkeypatch.setattr(loader_pipeline, 'archive_queue', queue.Queue())
+    monkeypatch.setattr(loader_pipeline, 'LOCAL_DATA_DIR', str(process_dir))
+    monkeypatch.setattr(loader_pipeline, 'CACHE_DIR', str(cache_dir))
+    monkeypatch.setattr(loader_pipeline, 'LISTING_CACHE_FILE', str(cache_dir / 'remote_listing.json'))
+    monkeypatch.setattr(loader_pipeline, 'RUN_JOURNAL_FILE', str(tmp_path / 'run_journal.jsonl'))
+    monkeypatch.setattr(loader_pipeline, 'run_journal', None)
+    monkeypatch.setattr(loader_pipeline, 'journal_states', {})
+    monkeypatch.setattr(loader_pipeline, 'journal_unsynced', 0)
+    monkeypatch.setattr(loader_pipeline, 'listed_hashes', {})
+    for counter in ('downloaded_count', 'total_to_download', 'processed_count',
+                    'errors_count', 'total_to_process'):
+        monkeypatch.setattr(loader_pipeline, counter, 0)
+    return loader_pipeline
+
+
+def drain_queue(download_queue):
+    """Esvazia a fila até o sentinela None; retorna os itens"""
+    items = []
+    while True:
+        item = download_queue.get()
+        if item is None:
+            return items
+        items.append(item)
+
+
+def ingest_bundles(pipeline, paths):
+    """Processa os bundles informados no SQLite com a etapa sequencial do pipeline"""
+    conn = pipeline.get_sqlite_connection()
+    pipeline.create_sqlite_schema(conn)
+    conn.close()
+    pipeline.download_queue = queue.Queue()
+    for path in paths:
+        pipeline.download_queue.put(str(path))
+    pipeline.download_queue.put(None)
+    pipeline.process_files()
+
+
+@pytest.fixture
+def postgres(monkeypatch):
+    """Schema descartável no PostgreSQL de DB_CONFIG_POSTGRES; pula o teste sem servidor
+
+    Retorna uma conexão administrativa em autocommit. O pool é esvaziado
+    antes e depois, pois as sessões fixam o search_path do schema.
+    """
+    import psycopg2
+    from etl import pg_pool
+
+    try:
+        admin = psycopg2.connect(
+            dbname=DB_CONFIG_POSTGRES['dbname'],
+            user=DB_CONFIG_POSTGRES['user'],
+            password=DB_CONFIG_POSTGRES['password'],
+            host=DB_CONFIG_POSTGRES['host'],
+            port=DB_CONFIG_POSTGRES['port'],
+            connect_timeout=3
+        )
+    except psycopg2.OperationalError:
+        pytest.skip("PostgreSQL indisponível")
+
+    admin.autocommit = True
+    schema = f"etl_test_{uuid.uuid4().hex[:8]}"
+    monkeypatch.setitem(DB_CONFIG_POSTGRES, 'schema', schema)
+    monkeypatch.setattr('builtins.input', lambda *args: 'S')
+    pg_pool.close_pool()
+    try:
+        yield admin
+    finally:
+        pg_pool.close_pool()
+        with admin.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        admin.close()
+
+
+def fetch_value(conn, query, params=()):
+    """Primeira coluna da primeira linha da consulta"""
+    with conn.cursor() as cursor:
+        cursor.execute(query, params)
+        return cursor.fetchone()[0]
+
+
+def read_patients(database):
+    """{patient_id: (gender, condições, medicações)} lido das views do SQLite"""
+    import sqlite3
+    conn = sqlite3.connect(database)
+    try:
+        patients = {patient_id: (gender, [], [])
+                    for patient_id, gender in conn.execute("SELECT patient_id, gender FROM patients")}
+        for patient_id, text in conn.execute("SELECT patient_id, condition_text FROM conditions"):
+            patients[patient_id][1].append(text)
+        for patient_id, text in conn.execute("SELECT patient_id, medication_text FROM medications"):
+            patients[patient_id][2].append(text)
+    finally:
+        conn.close()
+    return {patient_id: (gender, sorted(conditions), sorted(medications))
+            for patient_id, (gender, conditions, medications) in patients.items()}
@@ -0,0 +1,78 @@
+from conftest import fetch_value, make_bundle, write_bundles
+from test_changed_bundles import ingest_source, write_zip
+
+
+def read_aggregates(admin, schema):
+    """{agregado: {chave: contagem}} gravado no PostgreSQL"""
+    with admin.cursor() as cursor:
+        result = {}
+        for aggregate, column in (('aggregated_conditions', 'condition_text'),
+                                  ('aggregated_medications', 'medication_text'),
+                                  ('gender_stats', 'gender')):
+            cursor.execute(f"SELECT {column}, count FROM {schema}.{aggregate}")
+            result[aggregate] = dict(cursor.fetchall())
+        return result
+
+
+def count_sources(admin, schema):
+    """As mesmas contagens calculadas com GROUP BY sobre as tabelas migradas"""
+    with admin.cursor() as cursor:
+        result = {}
+        for aggregate, source, column in (('aggregated_conditions', 'conditions', 'condition_text'),
+                                          ('aggregated_medications', 'medications', 'medication_text'),
+                                          ('gender_stats', 'patients', 'gender')):
+            cursor.execute(f"SELECT {column}, COUNT(*) FROM {schema}.{source} GROUP BY {column}")
+            result[aggregate] = dict(cursor.fetchall())
+        return result
+
+
+def test_incremental_refresh_applies_signed_deltas(pipeline, postgres, tmp_path, etl_config, monkeypatch):
+    """Linhas novas somam, fatos de arquivos substituídos subtraem e chaves zeradas saem do agregado"""
+    schema = pipeline.DB_CONFIG_POSTGRES['schema']
+    source = tmp_path / 'bundles.zip'
+    etl_config(parse_workers=1, write_shards=1, source=str(source), migration_workers=2, migration_chunk_rows=3)
+    refreshes = []
+    refresh_aggregates = pipeline.refresh_aggregates
+    monkeypatch.setattr(pipeline, 'refresh_aggregates',
+                        lambda conn, full=False: refreshes.append(full) or refresh_aggregates(conn, full))
+
+    bundles = write_bundles(str(tmp_path / 'in'), 4)
+    bundles['only.json'] = make_bundle('only', 'other', conditions=['Rare'], medications=['Drug 0'])
+    write_zip(source, bundles)
+    ingest_source(pipeline, str(source))
+    pipeline.migrate_to_postgres()
+    assert read_aggregates(postgres, schema)['aggregated_conditions']['Rare'] == 1
+
+    # Delta: dois bundles novos e o paciente 'only' regravado sem a condição rara e com outro gênero
+    bundles.update(write_bundles(str(tmp_path / 'new'), 2, prefix='n'))
+    bundles['only.json'] = make_bundle('only', 'female', conditions=['Condition 0'], medications=[])
+    write_zip(source, bundles)
+    ingest_source(pipeline, str(source))
+    pipeline.migrate_to_postgres()
+
+    assert refreshes == [True, False]
+    aggregates = read_aggregates(postgres, schema)
+    assert aggregates == count_sources(postgres, schema)
+    assert 'Rare' not in aggregates['aggregated_conditions']
+    assert 'other' not in aggregates['gender_stats']
+    assert aggregates['gender_stats']['female'] == 4
+    assert fetch_value(postgres, f"SELECT COUNT(*) FROM {schema}.aggregate_changes") == 0
+
+
+def test_rows_without_delta_force_a_recount(pipeline, postgres, tmp_path, etl_config):
+    """Registros de aggregate_changes sem delta (versão anterior) levam à recontagem da tabela"""
+    schema = pipeline.DB_CONFIG_POSTGRES['schema']
+    source = tmp_path / 'bundles.zip'
+    etl_config(parse_workers=1, write_shards=1, source=str(source))
+    write_zip(source, write_bundles(str(tmp_path / 'in'), 3))
+    ingest_source(pipeline, str(source))
+    pipeline.migrate_to_postgres()
+
+    with postgres.cursor() as cursor:
+        cursor.execute(f"UPDATE {schema}.aggregated_conditions SET count = 99")
+        cursor.execute(f"INSERT INTO {schema}.aggregate_changes (table_name, key) VALUES ('conditions', 'x')")
+    pipeline.migrate_aggregated_data_to_postgres(full=False)
+
+    assert read_aggregates(postgres, schema) == count_sources(postgres, schema)
+    assert fetch_value(postgres, f"SELECT COUNT(*) FROM {schema}.aggregate_changes") == 0
+
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import queue
+
+from conftest import drain_queue
+from etl import async_fetch
+
+
+def test_fetch_files_in_memory_publishes_contents(bundle_server, bundle_dir):
+    """Sem dest_dir cada arquivo vai para a fila como (nome, memoryview)"""
+    _, raw_base_url = bundle_server
+    out_queue = queue.Queue()
+    names = sorted(os.listdir(bundle_dir))
+
+    downloaded = async_fetch.fetch_files(names, None, out_queue, raw_base_url, concurrency=3)
+
+    out_queue.put(None)
+    items = drain_queue(out_queue)
+    assert downloaded == len(names)
+    assert {name: bytes(content) for name, content in items} == {
+        name: (bundle_dir / name).read_bytes() for name in names
+    }
+
+
+def test_fetch_files_uses_fixed_number_of_workers(bundle_server, bundle_dir, monkeypatch):
+    """Cada worker baixa um arquivo por vez: nunca há mais de `concurrency` downloads em curso"""
+    _, raw_base_url = bundle_server
+    original = async_fetch.download_file_async
+    state = {'running': 0, 'peak': 0}
+
+    async def tracked(*args, **kwargs):
+        state['running'] += 1
+        state['peak'] = max(state['peak'], state['running'])
+        try:
+            await asyncio.sleep(0.01)
+            return await original(*args, **kwargs)
+        finally:
+            state['running'] -= 1
+
+    monkeypatch.setattr(async_fetch, 'download_file_async', tracked)
+    out_queue = queue.Queue()
+    names = sorted(os.listdir(bundle_dir))
+
+    downloaded = async_fetch.fetch_files(names, None, out_queue, raw_base_url, concurrency=2)
+
+    assert downloaded == len(names)
+    assert state['peak'] == 2
+
+
+def test_download_files_async_feeds_download_queue(pipeline, bundle_server, remote_files, bundle_dir,
+                                                   etl_config, monkeypatch):
+    """download_files_async baixa a listagem do servidor local e encerra a fila com o sentinela"""
+    _, raw_base_url = bundle_server
+    monkeypatch.setattr(pipeline, 'RAW_BASE_URL', raw_base_url)
+    etl_config(in_memory=False, archive_raw=False, async_concurrency=4)
+    files = dict(remote_files)
+    files['missing.json'] = {'sha': 'f' * 40, 'size': 1}
+
+    pipeline.download_files_async(files)
+
+    paths = drain_queue(pipeline.download_queue)
+    assert sorted(os.path.basename(path) for path in paths) == sorted(os.listdir(bundle_dir))
+    for path in paths:
+        with open(path, 'rb') as f:
+            assert f.read() == (bundle_dir / os.path.basename(path)).read_bytes()
+    assert pipeline.downloaded_count == len(paths)
@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+
+from conftest import ingest_bundles, read_patients, write_bundles
+
+
+def sqlite_indexes(database):
+    conn = sqlite3.connect(database)
+    try:
+        return {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'")}
+    finally:
+        conn.close()
+
+
+def journal_mode(database):
+    conn = sqlite3.connect(database)
+    try:
+        return conn.execute("PRAGMA journal_mode").fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def schema_ready(pipeline, sqlite_db, monkeypatch):
+    monkeypatch.setattr(pipeline, 'bulk_load_active', False)
+    conn = pipeline.get_sqlite_connection()
+    pipeline.create_sqlite_schema(conn)
+    conn.close()
+    return pipeline
+
+
+def test_first_load_drops_and_rebuilds_indexes(schema_ready, sqlite_db, tmp_path, etl_config):
+    """Primeira carga: WAL sem índices durante a ingestão; depois índices, ANALYZE e journal DELETE"""
+    pipeline = schema_ready
+    etl_config(bulk_load='auto')
+    bundles = write_bundles(str(tmp_path / 'in'), 5)
+
+    conn = pipeline.get_sqlite_connection()
+    assert pipeline.start_bulk_load_if_needed(conn)
+    conn.close()
+    assert sqlite_indexes(sqlite_db) == set()
+    assert journal_mode(sqlite_db) == 'wal'
+
+    ingest_bundles(pipeline, sorted((tmp_path / 'in').iterdir()))
+    pipeline.finish_bulk_load()
+
+    assert sqlite_indexes(sqlite_db) == set(pipeline.SQLITE_INDEXES)
+    assert journal_mode(sqlite_db) == 'delete'
+    assert len(read_patients(sqlite_db)) == len(bundles)
+    assert not pipeline.bulk_load_active
+
+
+@pytest.mark.parametrize('mode, expected', [('auto', False), ('always', True), ('never', False)])
+def test_bulk_mode_on_existing_data(schema_ready, tmp_path, etl_config, mode, expected):
+    """Com dados já carregados só ETL_BULK_LOAD=always reativa o modo de carga em massa"""
+    pipeline = schema_ready
+    write_bundles(str(tmp_path / 'in'), 1)
+    ingest_bundles(pipeline, [tmp_path / 'in' / 'b0.json'])
+    etl_config(bulk_load=mode)
+
+    conn = pipeline.get_sqlite_connection()
+    try:
+        assert pipeline.start_bulk_load_if_needed(conn) is expected
+    finally:
+        conn.close()
+    if expected:
+        pipeline.finish_bulk_load()
@@ -0,0 +1,59 @@
+import json
+import queue
+import zipfile
+
+import pytest
+
+from conftest import make_bundle, read_patients, write_bundles
+from etl import sources
+
+
+def write_zip(path, bundles):
+    """Grava os bundles {nome: bundle} num zip sob data/"""
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, bundle in bundles.items():
+            archive.writestr(f"data/{name}", json.dumps(bundle))
+
+
+def ingest_source(pipeline, source):
+    """Lista a fonte, filtra os pendentes e os processa; retorna os pendentes"""
+    conn = pipeline.get_sqlite_connection()
+    pipeline.create_sqlite_schema(conn)
+    pending = pipeline.get_files_to_download(conn, sources.list_source_files(source))
+    conn.close()
+    pipeline.download_queue = queue.Queue()
+    pipeline.load_local_source(pending)
+    pipeline.get_process_target()()
+    return pending
+
+
+@pytest.mark.parametrize('write_shards', [1, 2])
+def test_changed_zip_member_replaces_only_its_patient(pipeline, sqlite_db, tmp_path, etl_config, write_shards):
+    """Um membro com CRC32 diferente é reprocessado e substitui só as linhas do seu paciente"""
+    etl_config(parse_workers=1, write_shards=write_shards)
+    source = tmp_path / 'bundles.zip'
+    bundles = write_bundles(str(tmp_path / 'in'), 4)
+    write_zip(source, bundles)
+    etl_config(source=str(source))
+    ingest_source(pipeline, str(source))
+    before = read_patients(sqlite_db)
+
+    bundles['b1.json'] = make_bundle('b-p1', 'female', conditions=['Asthma'], medications=[])
+    write_zip(source, bundles)
+
+    assert sorted(ingest_source(pipeline, str(source))) == ['b1.json']
+    after = read_patients(sqlite_db)
+    assert after['b-p1'] == ('female', ['Asthma'], [])
+    assert {pid: row for pid, row in after.items() if pid != 'b-p1'} == \
+        {pid: row for pid, row in before.items() if pid != 'b-p1'}
+
+    assert ingest_source(pipeline, str(source)) == {}
+
+
+def test_unchanged_hash_is_current_and_legacy_rows_match_by_name(pipeline):
+    """Mesmo hash, ou registro sem hash, conta como já processado; hash diferente não"""
+    processed = {'a.json': 'crc32-00000001', 'b.json': None}
+    assert pipeline.is_file_current(processed, 'a.json', 'crc32-00000001')
+    assert not pipeline.is_file_current(processed, 'a.json', 'crc32-00000002')
+    assert pipeline.is_file_current(processed, 'b.json', 'crc32-00000002')
+    assert not pipeline.is_file_current(processed, 'c.json', None)
@@ -0,0 +1,116 @@
+import os
+
+import aiohttp
+import pytest
+
+from conftest import drain_queue
+from etl import downloads
+
+
+@pytest.fixture(params=['threads', 'asyncio'])
+def engine(request, pipeline, bundle_server, remote_files, etl_config, monkeypatch):
+    """Roda a etapa de download do pipeline com o motor indicado; retorna (download, listagem)"""
+    _, raw_base_url = bundle_server
+    monkeypatch.setattr(pipeline, 'RAW_BASE_URL', raw_base_url)
+    etl_config(in_memory=False, archive_raw=False, download_workers=2, async_concurrency=4)
+    download = pipeline.download_files if request.param == 'threads' else pipeline.download_files_async
+    return download, remote_files
+
+
+def run_download(pipeline, download, files):
+    """Executa uma etapa de download isolada e devolve os caminhos publicados"""
+    pipeline.downloaded_count = 0
+    download(dict(files))
+    return drain_queue(pipeline.download_queue)
+
+
+def test_downloads_fill_content_addressed_cache(engine, pipeline, bundle_dir):
+    """Os dois motores gravam cada arquivo no cache sob o sha do blob, com o .sha256"""
+    download, files = engine
+    run_download(pipeline, download, files)
+
+    for name, meta in files.items():
+        cached = downloads.get_cached_file(pipeline.CACHE_DIR, meta['sha'], name)
+        assert cached is not None
+        with open(cached, 'rb') as f:
+            assert f.read() == (bundle_dir / name).read_bytes()
+
+
+def test_second_run_is_served_from_cache(engine, pipeline, bundle_dir):
+    """Com o cache preenchido, uma nova execução não depende mais do servidor"""
+    download, files = engine
+    run_download(pipeline, download, files)
+    for name in files:
+        os.remove(bundle_dir / name)
+
+    paths = run_download(pipeline, download, files)
+
+    assert sorted(os.path.basename(path) for path in paths) == sorted(files)
+    assert pipeline.downloaded_count == len(files)
+
+
+def test_content_not_matching_blob_sha_is_rejected(engine, pipeline, bundle_dir):
+    """Download divergente da listagem (truncado/alterado) não é publicado nem entra no cache"""
+    download, files = engine
+    name = sorted(files)[0]
+    (bundle_dir / name).write_bytes(b'{"entry": [')
+
+    paths = run_download(pipeline, download, files)
+
+    assert name not in {os.path.basename(path) for path in paths}
+    assert len(paths) == len(files) - 1
+    assert not os.path.exists(downloads.get_cache_path(pipeline.CACHE_DIR, files[name]['sha'], name))
+    assert not [file for _, _, names in os.walk(pipeline.CACHE_DIR) for file in names if '.part-' in file]
+
+
+def test_async_disk_download_streams_in_chunks(pipeline, bundle_server, remote_files, bundle_dir,
+                                               etl_config, monkeypatch):
+    """No disco o motor asyncio grava a resposta em blocos, sem ler o corpo inteiro em memória"""
+    _, raw_base_url = bundle_server
+    monkeypatch.setattr(pipeline, 'RAW_BASE_URL', raw_base_url)
+    monkeypatch.setattr(downloads, 'HASH_CHUNK_SIZE', 16)
+    etl_config(in_memory=False, archive_raw=False, async_concurrency=2)
+
+    async def no_read(self):
+        raise AssertionError("corpo lido inteiro em memória")
+
+    monkeypatch.setattr(aiohttp.ClientResponse, 'read', no_read)
+    writes = []
+    original_write = downloads.write_download_chunk
+    monkeypatch.setattr(downloads, 'write_download_chunk',
+                        lambda download, chunk: writes.append(len(chunk)) or original_write(download, chunk))
+
+    paths = run_download(pipeline, pipeline.download_files_async, remote_files)
+
+    assert sorted(os.path.basename(path) for path in paths) == sorted(remote_files)
+    assert max(writes) <= 16
+    for name, meta in remote_files.items():
+        cached = downloads.get_cached_file(pipeline.CACHE_DIR, meta['sha'], name)
+        with open(cached, 'rb') as f:
+            assert f.read() == (bundle_dir / name).read_bytes()
+
+
+def test_in_memory_downloads_are_archived(engine, pipeline, bundle_dir, etl_config):
+    """No modo em memória os itens seguem como (nome, bytes) e o arquivamento preenche o cache"""
+    download, files = engine
+    etl_config(in_memory=True, archive_raw=True)
+
+    items = run_download(pipeline, download, files)
+
+    assert sorted(name for name, _ in items) == sorted(files)
+    for name, meta in files.items():
+        assert downloads.get_cached_file(pipeline.CACHE_DIR, meta['sha'], name) is not None
+
+
+def test_archive_worker_skips_content_not_matching_blob_sha(pipeline, capsys):
+    """O arquivamento confere o sha do blob: conteúdo divergente não vira entrada de cache"""
+    good, bad = b'{"entry": []}', b'{"entry": ['
+    pipeline.archive_queue.put(('good.json', downloads.git_blob_sha(good), memoryview(good)))
+    pipeline.archive_queue.put(('bad.json', downloads.git_blob_sha(good), bad))
+    pipeline.archive_queue.put(None)
+
+    pipeline.archive_worker()
+
+    assert downloads.get_cached_file(pipeline.CACHE_DIR, downloads.git_blob_sha(good), 'good.json')
+    assert not os.path.exists(downloads.get_cache_path(pipeline.CACHE_DIR, downloads.git_blob_sha(good), 'bad.json'))
+    assert 'Erro ao arquivar bad.json: sha do blob divergente' in capsys.readouterr().out
@@ -0,0 +1,59 @@
+import os
+import threading
+from urllib.parse import urljoin
+
+from etl import downloads, loader
+
+
+def test_workers_fetch_every_file_and_count_errors(bundle_server, bundle_dir):
+    """Cada arquivo é entregue uma vez; falhas contam em 'errors' sem parar os workers"""
+    _, raw_base_url = bundle_server
+    files = {name: {} for name in os.listdir(bundle_dir)}
+    files['missing.json'] = {}
+    fetched = {}
+    lock = threading.Lock()
+
+    def fetch(session, name, meta):
+        response = session.get(urljoin(raw_base_url, name), timeout=5)
+        response.raise_for_status()
+        return response.content, len(response.content)
+
+    def on_fetched(name, content):
+        with lock:
+            fetched[name] = content
+
+    downloads.run_download_workers(files, fetch, on_fetched, num_workers=3)
+
+    assert set(fetched) == set(files) - {'missing.json'}
+    for name, content in fetched.items():
+        assert content == (bundle_dir / name).read_bytes()
+
+    stats = downloads.download_stats.values()
+    assert len(downloads.download_stats) == 3
+    assert sum(s['files'] for s in stats) == len(fetched)
+    assert sum(s['errors'] for s in stats) == 1
+
+
+def test_workers_count_cache_hits_separately():
+    """fetch que retorna 0 bytes (cache) conta em 'cached', não em 'files'"""
+    downloads.run_download_workers({'a.json': {}, 'b.json': {}},
+                                   lambda session, name, meta: (name, 0),
+                                   lambda name, item: None, num_workers=1)
+    stats = downloads.download_stats['worker-1']
+    assert (stats['files'], stats['cached'], stats['bytes']) == (0, 2, 0)
+
+
+def test_loader_uses_shared_worker_pool(bundle_server, bundle_dir, tmp_path, monkeypatch):
+    """etl.loader baixa pelo pool compartilhado e publica os caminhos na sua fila"""
+    _, raw_base_url = bundle_server
+    monkeypatch.setattr(loader, 'RAW_BASE_URL', raw_base_url)
+    monkeypatch.setattr(loader, 'LOCAL_DATA_DIR', str(tmp_path))
+    files = {name: {} for name in os.listdir(bundle_dir)}
+
+    downloads.run_download_workers(files, loader.fetch_file, loader.publish_download, num_workers=2)
+
+    published = []
+    while not loader.download_queue.empty():
+        published.append(loader.download_queue.get())
+    assert sorted(os.path.basename(path) for path in published) == sorted(files)
+    assert all(os.path.exists(path) for path in published)
@@ -0,0 +1,66 @@
+import json
+import sqlite3
+
+import pytest
+
+from conftest import ingest_bundles, make_bundle
+from etl import extractors
+
+
+def observation(text=None, display=None, value=None, unit=None):
+    concept = {'text': text} if text else {'coding': [{'code': '1'}, {'display': display}]}
+    resource = {'resourceType': 'Observation', 'code': concept, 'effectiveDateTime': '2020-01-01'}
+    if value is not None:
+        resource['valueQuantity'] = {'value': value, 'unit': unit}
+    return resource
+
+
+def test_enabled_extractors_reject_unknown_types():
+    """Tipos sem extrator registrado são recusados na configuração"""
+    assert set(extractors.get_enabled_extractors(' Condition , Observation,')) == {'Condition', 'Observation'}
+    with pytest.raises(ValueError, match='Encounter'):
+        extractors.get_enabled_extractors('Condition,Encounter')
+
+
+def test_observation_extractor():
+    """Observation usa o display da codificação na falta de texto e ignora valores não numéricos"""
+    assert extractors.extract_observation(observation(display='Body/height', value=170, unit='cm')) == \
+        ('Body-height', 170.0, 'cm', '2020-01-01')
+    assert extractors.extract_observation(observation(text='Smoker', value='yes')) == \
+        ('Smoker', None, None, '2020-01-01')
+    assert extractors.extract_observation({'resourceType': 'Observation', 'code': {}}) is None
+
+
+def test_bundle_rows_follow_enabled_types(pipeline, monkeypatch):
+    """A varredura única só gera linhas para os tipos habilitados"""
+    bundle = make_bundle('p1', conditions=['Asthma'], medications=['Aspirin'])
+    bundle['entry'].append({'resource': observation(text='Weight', value=70, unit='kg')})
+    resources = [entry['resource'] for entry in bundle['entry']]
+
+    monkeypatch.setattr(pipeline, 'ENABLED_EXTRACTORS', extractors.get_enabled_extractors('Condition'))
+    assert pipeline.collect_bundle_rows(resources) == {
+        'patient': ('p1', 'female'), 'rows': {'conditions': [('Asthma',)]}}
+
+    monkeypatch.setattr(pipeline, 'ENABLED_EXTRACTORS',
+                        extractors.get_enabled_extractors('Condition,MedicationRequest,Observation'))
+    rows = pipeline.collect_bundle_rows(resources)['rows']
+    assert rows['observations'] == [('Weight', 70.0, 'kg', '2020-01-01')]
+
+
+def test_observations_are_ingested_when_enabled(pipeline, sqlite_db, tmp_path, monkeypatch):
+    """Com Observation habilitado, valores e unidades chegam à view observations"""
+    monkeypatch.setattr(pipeline, 'ENABLED_EXTRACTORS',
+                        extractors.get_enabled_extractors('Condition,MedicationRequest,Observation'))
+    bundle = make_bundle('p1', conditions=['Asthma'])
+    bundle['entry'].append({'resource': observation(text='Weight', value=70, unit='kg')})
+    path = tmp_path / 'p1.json'
+    path.write_text(json.dumps(bundle), encoding='utf-8')
+
+    ingest_bundles(pipeline, [path])
+
+    conn = sqlite3.connect(sqlite_db)
+    try:
+        rows = conn.execute("SELECT patient_id, observation_text, value, unit FROM observations").fetchall()
+    finally:
+        conn.close()
+    assert rows == [('p1', 'Weight', 70.0, 'kg')]
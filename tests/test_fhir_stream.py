@@ -0,0 +1,50 @@
+import io
+import json
+
+import pytest
+
+from conftest import make_bundle
+from etl import fhir_stream
+
+pytestmark = pytest.mark.skipif(not fhir_stream.is_available(), reason="ijson não instalado")
+
+
+def large_bundle():
+    """Bundle com recursos ignorados (Observation, Encounter) entre os usados"""
+    bundle = make_bundle('p-large', 'male', conditions=['Asthma', 'Flu/cold [x]'], medications=['Aspirin'])
+    noise = [{'resource': {'resourceType': 'Observation', 'valueQuantity': {'value': i},
+                           'component': [{'code': {'text': 'x' * 50}}] * 5}} for i in range(200)]
+    bundle['entry'] = noise[:100] + bundle['entry'] + noise[100:] + [
+        {'resource': {'resourceType': 'Encounter', 'id': 'e1'}}
+    ]
+    return bundle
+
+
+def test_stream_yields_only_requested_resources():
+    """O extrator incremental materializa só os tipos pedidos, na ordem do bundle"""
+    data = json.dumps(large_bundle()).encode()
+    resources = list(fhir_stream.iter_bundle_resources(io.BytesIO(data), {'Patient', 'Condition'}))
+    assert [r['resourceType'] for r in resources] == ['Patient', 'Condition', 'Condition']
+    assert resources[0]['id'] == 'p-large'
+
+
+def test_stream_parse_matches_json_parse(pipeline, tmp_path, etl_config):
+    """parse_bundle em streaming (acima do limite) produz as mesmas linhas que json.load"""
+    path = tmp_path / 'large.json'
+    path.write_text(json.dumps(large_bundle()), encoding='utf-8')
+
+    etl_config(stream_parse_min_bytes=0)
+    streamed = pipeline.parse_bundle(str(path))
+    etl_config(stream_parse_min_bytes=-1)
+    loaded = pipeline.parse_bundle(str(path))
+
+    assert streamed == loaded
+    assert streamed['patient'] == ('p-large', 'male')
+
+
+def test_stream_parse_reads_in_memory_items(pipeline):
+    """Itens (nome, memoryview) do modo em memória também passam pelo streaming"""
+    content = memoryview(json.dumps(large_bundle()).encode()).toreadonly()
+    with pipeline.open_bundle(('large.json', content)) as f:
+        resources = list(fhir_stream.iter_bundle_resources(f, {'Patient'}))
+    assert resources == [{'resourceType': 'Patient', 'id': 'p-large', 'gender': 'male'}]
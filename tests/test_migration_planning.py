@@ -0,0 +1,68 @@
+from conftest import fetch_value, ingest_bundles, write_bundles
+
+
+def test_chunks_cover_pending_range_without_overlap(pipeline, etl_config):
+    """As faixas planejadas cobrem [início, fim] de forma contígua, com no máximo chunk_rows linhas cada"""
+    etl_config(migration_chunk_rows=100)
+    chunks = pipeline.plan_migration_chunks('conditions', ['id'], 'SELECT id FROM conditions', 'id',
+                                            (11, 1010, 950))
+    ranges = [key_range for _, _, _, key_range, _ in chunks]
+
+    assert len(ranges) == 10
+    assert ranges[0][0] == 11 and ranges[-1][1] == 1010
+    assert all(end + 1 == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+    assert chunks[0][2] == 'SELECT id FROM conditions WHERE id BETWEEN ? AND ?'
+    assert chunks[0][4] == 'conditions[11:110]'
+
+
+def test_small_range_is_a_single_chunk(pipeline, etl_config):
+    etl_config(migration_chunk_rows=100)
+    chunks = pipeline.plan_migration_chunks('patients', ['patient_key'], 'SELECT 1', 'patient_key', (5, 7, 3))
+    assert [key_range for _, _, _, key_range, _ in chunks] == [(5, 7)]
+
+
+def test_migration_workers_are_capped(pipeline, postgres, etl_config):
+    """Workers pedidos são limitados pelo pool e pelas conexões livres do servidor"""
+    etl_config(migration_workers=64, pg_pool_max=4)
+    conn = pipeline.get_postgres_connection()
+    try:
+        assert pipeline.get_migration_workers(conn) == 3
+        etl_config(migration_workers=2)
+        assert pipeline.get_migration_workers(conn) == 2
+    finally:
+        pipeline.release_postgres_connection(conn)
+
+
+def test_parallel_chunks_record_one_watermark_each(pipeline, postgres, tmp_path, etl_config):
+    """Cada faixa copiada em paralelo é confirmada com sua própria marca d'água"""
+    schema = pipeline.DB_CONFIG_POSTGRES['schema']
+    etl_config(migration_workers=4, migration_chunk_rows=2)
+    write_bundles(str(tmp_path / 'in'), 8)
+    ingest_bundles(pipeline, sorted((tmp_path / 'in').iterdir()))
+
+    pipeline.migrate_to_postgres()
+
+    assert fetch_value(postgres, f"SELECT COUNT(*) FROM {schema}.conditions") == 16
+    assert fetch_value(postgres, f"SELECT COUNT(*) FROM {schema}.migration_watermarks "
+                                 "WHERE table_name = 'conditions'") == 8
+    assert fetch_value(postgres, f"SELECT SUM(range_end - range_start + 1) FROM {schema}.migration_watermarks "
+                                 "WHERE table_name = 'conditions'") == 16
+
+
+def test_pending_ranges_include_gaps_left_by_failed_chunks(pipeline):
+    """Acima da marca d'água e nas lacunas de faixas que falharam, tudo volta a ser pendente"""
+    migrated = [(1, 10), (21, 30)]
+    assert pipeline.get_pending_ranges(migrated, 1, 40) == [(11, 20), (31, 40)]
+    assert pipeline.get_pending_ranges(migrated, 1, 30) == [(11, 20)]
+    assert pipeline.get_pending_ranges(migrated, 1, 15) == [(11, 15)]
+    assert pipeline.get_pending_ranges([], 5, 9) == [(5, 9)]
+    assert pipeline.get_pending_ranges([(1, 30)], 1, 30) == []
+
+
+def test_covered_ranges_leave_rows_missing_from_postgres_pending(pipeline):
+    """No bootstrap só as chaves presentes no PostgreSQL viram faixas migradas"""
+    keys = [(1, True), (2, True), (4, False), (7, True), (8, True), (9, False)]
+    covered = pipeline.get_covered_ranges(keys)
+    assert covered == [(1, 2), (7, 8)]
+    assert pipeline.get_pending_ranges(covered, 1, 9) == [(3, 6), (9, 9)]
+    assert pipeline.get_covered_ranges([(1, False)]) == []
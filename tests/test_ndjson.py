@@ -0,0 +1,137 @@
+import json
+import os
+
+from conftest import read_patients
+from etl import sources
+
+
+def write_ndjson(path, resources):
+    """Grava uma linha JSON por recurso"""
+    with open(path, 'a', encoding='utf-8') as f:
+        for resource in resources:
+            f.write(json.dumps(resource) + '\n')
+
+
+def patient(patient_id):
+    return {'resourceType': 'Patient', 'id': patient_id, 'gender': 'female'}
+
+
+def condition(patient_id, text):
+    return {'resourceType': 'Condition', 'subject': {'reference': f"Patient/{patient_id}"},
+            'code': {'text': text}}
+
+
+def write_export(directory, count):
+    """Exportação $export com `count` pacientes e uma condição por paciente"""
+    directory.mkdir(exist_ok=True)
+    write_ndjson(directory / 'Patient.ndjson', [patient(f"p{i}") for i in range(count)])
+    write_ndjson(directory / 'Condition.ndjson', [condition(f"p{i}", f"Condition {i}") for i in range(count)])
+    return str(directory)
+
+
+def ingest_export(pipeline, directory):
+    """Lista as faixas pendentes do export e as processa; retorna as faixas processadas"""
+    conn = pipeline.get_sqlite_connection()
+    pipeline.create_sqlite_schema(conn)
+    chunks = sources.list_ndjson_chunks(directory, 100, pipeline.NDJSON_RESOURCE_TYPES)
+    pending = pipeline.get_files_to_download(conn, chunks)
+    conn.close()
+    if pending:
+        pipeline.process_ndjson_export(pending)
+    return pending
+
+
+def test_chunks_split_lines_exactly_once(tmp_path):
+    """Faixas de bytes arbitrárias entregam cada linha uma única vez"""
+    directory = write_export(tmp_path / 'export', 20)
+    chunks = sources.list_ndjson_chunks(directory, 100, {'Patient'})
+    assert len(chunks) > 1
+    assert {meta['resource_type'] for meta in chunks.values()} == {'Patient'}
+
+    lines = [line for meta in sorted(chunks.values(), key=lambda m: m['start'])
+             for line in sources.iter_ndjson_lines(meta['path'], meta['start'], meta['end'])]
+    assert [json.loads(line)['id'] for line in lines] == [f"p{i}" for i in range(20)]
+
+
+def test_resume_skips_processed_chunks(pipeline, sqlite_db, tmp_path, etl_config):
+    """Reexecutar sobre o mesmo export não reprocessa faixas já gravadas"""
+    etl_config(parse_workers=1)
+    directory = write_export(tmp_path / 'export', 10)
+
+    assert ingest_export(pipeline, directory)
+    assert ingest_export(pipeline, directory) == {}
+
+    patients = read_patients(sqlite_db)
+    assert len(patients) == 10
+    assert all(len(conditions) == 1 for _, conditions, _ in patients.values())
+
+
+def test_rewritten_file_is_not_reingested(pipeline, sqlite_db, tmp_path, etl_config, capsys):
+    """Arquivo que recebeu linhas após a ingestão é recusado em vez de duplicar fatos"""
+    etl_config(parse_workers=1)
+    directory = write_export(tmp_path / 'export', 10)
+    ingest_export(pipeline, directory)
+
+    condition_path = os.path.join(directory, 'Condition.ndjson')
+    write_ndjson(condition_path, [condition('p0', 'Condition extra')])
+
+    pending = ingest_export(pipeline, directory)
+    assert all(meta['path'] != condition_path for meta in pending.values())
+    assert 'foi alterado desde a última ingestão' in capsys.readouterr().out
+
+    patients = read_patients(sqlite_db)
+    assert patients['p0'][1] == ['Condition 0']
+    assert sum(len(conditions) for _, conditions, _ in patients.values()) == 10
+
+
+def test_legacy_chunks_without_version_detect_misaligned_ranges():
+    """Registros sem versão: faixa gravada que não existe mais na divisão atual indica alteração"""
+    chunks = {'export/Condition.ndjson[0:100]': {'path': '/x/Condition.ndjson', 'sha': '150-1'},
+              'export/Condition.ndjson[100:150]': {'path': '/x/Condition.ndjson', 'sha': '150-1'}}
+    assert sources.get_changed_ndjson_files(chunks, {'export/Condition.ndjson[0:100]': None}) == set()
+    assert sources.get_changed_ndjson_files(chunks, {'export/Condition.ndjson[100:120]': None}) == {'/x/Condition.ndjson'}
+    assert sources.get_changed_ndjson_files(chunks, {'export/Condition.ndjson[0:100]': '120-1'}) == {'/x/Condition.ndjson'}
+
+
+def test_failed_patient_chunk_keeps_other_types_pending(pipeline, sqlite_db, tmp_path, etl_config, monkeypatch):
+    """Com uma faixa de Patient com erro, as faixas de Condition não rodam nem são marcadas"""
+    etl_config(parse_workers=1)
+    directory = write_export(tmp_path / 'export', 10)
+    parse = pipeline.parse_ndjson_chunk
+
+    def failing_parse(chunk):
+        result = parse(chunk)
+        if chunk['resource_type'] == 'Patient' and chunk['start'] == 0:
+            result['error'] = 'falha de leitura'
+        return result
+
+    monkeypatch.setattr(pipeline, 'parse_ndjson_chunk', failing_parse)
+    first = ingest_export(pipeline, directory)
+    monkeypatch.setattr(pipeline, 'parse_ndjson_chunk', parse)
+
+    pending = ingest_export(pipeline, directory)
+    assert {meta['resource_type'] for meta in pending.values()} == {'Patient', 'Condition'}
+    assert sum(meta['resource_type'] == 'Condition' for meta in pending.values()) == \
+        sum(meta['resource_type'] == 'Condition' for meta in first.values())
+
+    patients = read_patients(sqlite_db)
+    assert len(patients) == 10
+    assert all(len(conditions) == 1 for _, conditions, _ in patients.values())
+
+
+def test_chunk_with_unknown_subject_stays_pending(pipeline, sqlite_db, tmp_path, etl_config):
+    """Faixa com paciente ainda ausente não é marcada: é gravada quando o paciente chega"""
+    etl_config(parse_workers=1)
+    directory = write_export(tmp_path / 'export', 5)
+    write_ndjson(os.path.join(directory, 'Condition.ndjson'), [condition('p99', 'Condition late')])
+
+    ingest_export(pipeline, directory)
+    assert 'p99' not in read_patients(sqlite_db)
+
+    write_ndjson(os.path.join(directory, 'Patient-late.ndjson'), [patient('p99')])
+    pending = ingest_export(pipeline, directory)
+
+    assert any(meta['resource_type'] == 'Condition' for meta in pending.values())
+    patients = read_patients(sqlite_db)
+    assert patients['p99'][1] == ['Condition late']
+    assert sum(len(conditions) for _, conditions, _ in patients.values()) == 6
@@ -0,0 +1,28 @@
+def test_pending_files_use_a_single_query(pipeline, sqlite_db):
+    """Novos e alterados ficam pendentes; iguais são pulados; processed_files é lido uma vez"""
+    conn = pipeline.get_sqlite_connection()
+    pipeline.create_sqlite_schema(conn)
+    conn.executemany("INSERT INTO processed_files (file_name, content_hash) VALUES (?, ?)", [
+        ('same.json', 'a' * 40),
+        ('changed.json', 'b' * 40),
+        ('legacy.json', None)
+    ])
+    conn.commit()
+    statements = []
+    conn.set_trace_callback(statements.append)
+
+    remote = {
+        'same.json': {'sha': 'a' * 40},
+        'changed.json': {'sha': 'c' * 40},
+        'legacy.json': {'sha': 'd' * 40},
+        'new.json': {'sha': 'e' * 40},
+        'no-sha.json': {}
+    }
+    pending = pipeline.get_files_to_download(conn, remote)
+    conn.close()
+
+    assert sorted(pending) == ['changed.json', 'new.json', 'no-sha.json']
+    assert [s for s in statements if 'processed_files' in s] == [
+        "SELECT file_name, content_hash FROM processed_files"
+    ]
+    assert pipeline.listed_hashes == {'changed.json': 'c' * 40, 'new.json': 'e' * 40}
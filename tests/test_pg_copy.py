@@ -0,0 +1,91 @@
+import sqlite3
+
+import pytest
+
+from etl import pg_copy
+
+ROWS = [
+    (1, 'Asma', '2024-01-02 03:04:05'),
+    (2, 'linha\nquebrada, com "aspas"', '2024-01-02 03:04:05.123456'),
+    (3, None, None),
+    (4, 'Ação/ñ', '1999-12-31 23:59:59')
+]
+
+
+def sqlite_cursor(rows=ROWS):
+    """Cursor do SQLite em memória sobre as linhas informadas"""
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE t (id INTEGER, texto TEXT, criado TIMESTAMP)")
+    conn.executemany("INSERT INTO t VALUES (?, ?, ?)", rows)
+    return conn.execute("SELECT id, texto, criado FROM t ORDER BY id")
+
+
+@pytest.fixture
+def copy_target(postgres):
+    """Tabela temporária no PostgreSQL que recebe o COPY; retorna o cursor"""
+    cursor = postgres.cursor()
+    cursor.execute("CREATE TEMP TABLE copy_target (id INTEGER, texto TEXT, criado TIMESTAMP)")
+    yield cursor
+    cursor.close()
+
+
+def test_chunk_reader_serves_reads_across_chunks():
+    """read() de qualquer tamanho atravessa os blocos sem perder nem repetir bytes"""
+    stream = pg_copy.open_copy_stream(iter([b'abc', b'', b'defgh', b'i']))
+    assert stream.read(2) == b'ab'
+    assert stream.read(4) == b'cdef'
+    assert stream.read() == b'ghi'
+    assert stream.read(1) == b''
+
+
+def test_csv_chunks_are_generated_per_batch():
+    """Cada lote do cursor vira um bloco CSV; None sai vazio e quebras de linha viram espaço"""
+    chunks = list(pg_copy.iter_csv_chunks(sqlite_cursor(), fetch_size=2))
+    assert len(chunks) == 2
+    lines = b''.join(chunks).decode('utf-8').splitlines()
+    assert lines[1] == '2,"linha quebrada, com ""aspas""",2024-01-02 03:04:05.123456'
+    assert lines[2] == '3,,'
+
+
+def test_csv_copy_streams_sqlite_rows(copy_target):
+    """COPY CSV alimentado pelo cursor do SQLite grava as linhas sem arquivo intermediário"""
+    pg_copy.copy_csv_from_cursor(copy_target, 'copy_target', ['id', 'texto', 'criado'],
+                                 sqlite_cursor(), fetch_size=2)
+    copy_target.execute("SELECT id, texto, criado::text FROM copy_target ORDER BY id")
+    rows = copy_target.fetchall()
+    assert rows[1][1] == 'linha quebrada, com "aspas"'
+    assert rows[2] == (3, None, None)
+    assert rows[3] == (4, 'Ação/ñ', '1999-12-31 23:59:59')
+
+
+def test_binary_encoders():
+    """Cada campo é tamanho (int4) + valor big-endian; timestamps contam µs desde 2000-01-01"""
+    assert pg_copy.encode_integer(-2) == b'\x00\x00\x00\x04\xff\xff\xff\xfe'
+    assert pg_copy.encode_bigint(1) == b'\x00\x00\x00\x08' + b'\x00' * 7 + b'\x01'
+    assert pg_copy.encode_text('ç') == b'\x00\x00\x00\x02\xc3\xa7'
+    assert pg_copy.encode_timestamp('2000-01-01 00:00:01.5') == \
+        b'\x00\x00\x00\x08' + (1_500_000).to_bytes(8, 'big')
+    assert pg_copy.encode_timestamp('1999-12-31 23:59:59') == \
+        b'\x00\x00\x00\x08' + (-1_000_000).to_bytes(8, 'big', signed=True)
+
+
+def test_binary_stream_layout():
+    """Cabeçalho, contagem de campos por linha, NULL como -1 e trailer"""
+    chunks = list(pg_copy.iter_binary_chunks(sqlite_cursor([(7, None, None)]),
+                                             ['integer', 'text', 'timestamp']))
+    assert chunks[0] == b'PGCOPY\n\xff\r\n\x00' + b'\x00' * 8
+    assert chunks[1] == b'\x00\x03' + pg_copy.encode_integer(7) + b'\xff\xff\xff\xff' * 2
+    assert chunks[-1] == b'\xff\xff'
+
+
+def test_binary_copy_matches_csv_copy(copy_target):
+    """O COPY binário grava os valores sem conversão: quebras de linha, acentos, NULL e timestamps"""
+    pg_copy.copy_binary_from_cursor(copy_target, 'copy_target', ['id', 'texto', 'criado'],
+                                    ['integer', 'text', 'timestamp'], sqlite_cursor(), fetch_size=3)
+    copy_target.execute("SELECT id, texto, criado::text FROM copy_target ORDER BY id")
+    assert copy_target.fetchall() == [
+        (1, 'Asma', '2024-01-02 03:04:05'),
+        (2, 'linha\nquebrada, com "aspas"', '2024-01-02 03:04:05.123456'),
+        (3, None, None),
+        (4, 'Ação/ñ', '1999-12-31 23:59:59')
+    ]
@@ -0,0 +1,75 @@
+import threading
+
+import psycopg2
+import pytest
+
+from etl import pg_pool
+
+
+@pytest.fixture
+def pool(postgres, etl_config, monkeypatch):
+    """pg_pool com no máximo 2 conexões e semáforo recriado para o teste"""
+    etl_config(pg_pool_max=2, pg_pool_check_idle_s=30)
+    monkeypatch.setattr(pg_pool, 'pool_slots', None)
+    return pg_pool
+
+
+def test_connections_are_reused_with_session_options(pool):
+    """A conexão devolvida volta no próximo empréstimo, com o search_path do schema"""
+    created = pool.get_pool_stats()['created']
+    with pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SHOW search_path")
+            search_path = cursor.fetchone()[0]
+    with pool.connection() as again:
+        assert again is conn
+
+    assert search_path.startswith(pool.DB_CONFIG_POSTGRES['schema'])
+    assert pool.get_pool_stats()['created'] == created + 1
+
+
+def test_checkout_waits_for_a_free_slot(pool):
+    """Acima de pg_pool_max o pedido espera uma devolução em vez de abrir outra conexão"""
+    first, second = pool.get_connection(), pool.get_connection()
+    waits = pool.get_pool_stats()['waits']
+    borrowed = []
+    waiter = threading.Thread(target=lambda: borrowed.append(pool.get_connection()))
+    waiter.start()
+    waiter.join(0.3)
+    assert waiter.is_alive() and not borrowed
+
+    pool.release_connection(first)
+    waiter.join(5)
+    assert borrowed == [first]
+    assert pool.get_pool_stats()['waits'] == waits + 1
+    pool.release_connection(second)
+    pool.release_connection(borrowed[0])
+
+
+def test_broken_idle_connection_is_discarded(pool, postgres, etl_config):
+    """Conexão ociosa que não responde ao health check é descartada e substituída"""
+    etl_config(pg_pool_check_idle_s=0)
+    with pool.connection() as conn:
+        pid = conn.get_backend_pid()
+    with postgres.cursor() as cursor:
+        cursor.execute("SELECT pg_terminate_backend(%s)", (pid,))
+    discarded = pool.get_pool_stats()['discarded']
+
+    with pool.connection() as fresh, pool.connection() as other:
+        assert conn not in (fresh, other)
+        with fresh.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    assert pool.get_pool_stats()['discarded'] == discarded + 1
+
+
+def test_maintenance_statement_on_lost_connection_frees_the_slot(pool, pipeline):
+    """Mesmo com a conexão perdida durante a instrução, a vaga do pool é devolvida"""
+    in_use = pool.get_pool_stats()['in_use']
+    for _ in range(2):
+        with pytest.raises(psycopg2.Error):
+            pipeline.run_maintenance_statement("SELECT pg_terminate_backend(pg_backend_pid())", 16)
+
+    assert pool.get_pool_stats()['in_use'] == in_use
+    assert pool.pool_slots.acquire(blocking=False) and pool.pool_slots.acquire(blocking=False)
+    pool.pool_slots.release()
+    pool.pool_slots.release()
@@ -0,0 +1,181 @@
+import sqlite3
+
+from conftest import fetch_value, ingest_bundles, write_bundles
+
+MIGRATED_TABLES = ('patients', 'conditions', 'medications', 'processed_files')
+
+
+def count_rows(admin, schema, table):
+    return fetch_value(admin, f"SELECT COUNT(*) FROM {schema}.{table}")
+
+
+def test_incremental_migration_copies_only_new_rows(pipeline, postgres, tmp_path, etl_config):
+    """A segunda migração copia só as linhas acima das marcas d'água"""
+    schema = pipeline.DB_CONFIG_POSTGRES['schema']
+    etl_config(migration_workers=2, migration_chunk_rows=3)
+    write_bundles(str(tmp_path / 'first'), 5, prefix='a')
+    write_bundles(str(tmp_path / 'second'), 4, prefix='z')
+    ingest_bundles(pipeline, sorted((tmp_path / 'first').iterdir()))
+
+    pipeline.migrate_to_postgres()
+
+    assert count_rows(postgres, schema, 'patients') == 5
+    assert count_rows(postgres, schema, 'conditions') == 10
+    first_watermark = fetch_value(
+        postgres, f"SELECT MAX(range_end) FROM {schema}.migration_watermarks WHERE table_name = 'conditions'"
+    )
+    assert pipeline.check_migration_status()
+
+    ingest_bundles(pipeline, sorted((tmp_path / 'second').iterdir()))
+    assert not pipeline.check_migration_status()
+    pipeline.migrate_to_postgres()
+
+    for table, expected in zip(MIGRATED_TABLES, (9, 18, 9, 9)):
+        assert count_rows(postgres, schema, table) == expected
+    assert fetch_value(
+        postgres, f"SELECT MIN(range_start) FROM {schema}.migration_watermarks "
+                  f"WHERE table_name = 'conditions' AND range_start > %s", (first_watermark,)
+    ) == first_watermark + 1
+    assert pipeline.check_migration_status()
+
+
+def test_rows_ingested_after_a_migration_without_watermarks_are_copied(pipeline, postgres, sqlite_db,
+                                                                      tmp_path, etl_config):
+    """Migração completa antiga (sem marcas d'água): só o que o PostgreSQL contém vale como migrado"""
+    schema = pipeline.DB_CONFIG_POSTGRES['schema']
+    etl_config(migration_workers=2, migration_chunk_rows=3)
+    write_bundles(str(tmp_path / 'first'), 5, prefix='a')
+    write_bundles(str(tmp_path / 'second'), 4, prefix='z')
+    ingest_bundles(pipeline, sorted((tmp_path / 'first').iterdir()))
+    conn = sqlite3.connect(sqlite_db)
+    try:
+        for table in ('patients', 'condition_facts', 'medication_facts', 'processed_files'):
+            conn.execute(f"UPDATE {table} SET data_inclusao = '2020-01-01 00:00:00'")
+        conn.commit()
+    finally:
+        conn.close()
+    pipeline.migrate_to_postgres()
+
+    # Estado deixado pela migração antiga: sem marcas d'água nem ids de origem
+    with postgres.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {schema}.migration_watermarks")
+        for table in ('conditions', 'medications'):
+            cursor.execute(f"UPDATE {schema}.{table} SET source_id = NULL")
+        cursor.execute(f"UPDATE {schema}.processed_files SET source_rowid = NULL")
+
+    ingest_bundles(pipeline, sorted((tmp_path / 'second').iterdir()))
+    pipeline.migrate_to_postgres()
+
+    for table, expected in zip(MIGRATED_TABLES, (9, 18, 9, 9)):
+        assert count_rows(postgres, schema, table) == expected
+    assert fetch_value(postgres, f"SELECT COUNT(*) FROM {schema}.conditions WHERE patient_id LIKE 'z-%%'") == 8
+    assert pipeline.check_migration_status()
+
+
+def test_binary_copy_migration_matches_sqlite(pipeline, postgres, sqlite_db, tmp_path, etl_config):
+    """Com ETL_COPY_FORMAT=binary o PostgreSQL recebe os mesmos pacientes, textos e datas"""
+    schema = pipeline.DB_CONFIG_POSTGRES['schema']
+    etl_config(copy_format='binary', migration_workers=2, migration_chunk_rows=4)
+    write_bundles(str(tmp_path / 'in'), 6)
+    ingest_bundles(pipeline, sorted((tmp_path / 'in').iterdir()))
+
+    pipeline.migrate_to_postgres()
+
+    with postgres.cursor() as cursor:
+        cursor.execute(f"SELECT patient_id, condition_text, data_inclusao::text FROM {schema}.conditions "
+                       "ORDER BY 1, 2")
+        migrated = cursor.fetchall()
+    conn = sqlite3.connect(sqlite_db)
+    try:
+        expected = conn.execute("SELECT patient_id, condition_text, data_inclusao FROM conditions "
+                                "ORDER BY 1, 2").fetchall()
+    finally:
+        conn.close()
+    assert migrated == expected
+
+
+def test_reloading_ranges_is_idempotent(pipeline, postgres, tmp_path, etl_config):
+    """Faixas copiadas de novo (marcas perdidas) são mescladas sem duplicar nem abortar; staging é descartada"""
+    schema = pipeline.DB_CONFIG_POSTGRES['schema']
+    etl_config(migration_workers=2, migration_chunk_rows=4)
+    write_bundles(str(tmp_path / 'in'), 6)
+    ingest_bundles(pipeline, sorted((tmp_path / 'in').iterdir()))
+    pipeline.migrate_to_postgres()
+    before = [count_rows(postgres, schema, table) for table in MIGRATED_TABLES]
+
+    # Mantém só a primeira faixa de cada tabela: as demais viram lacunas e são copiadas de novo
+    with postgres.cursor() as cursor:
+        cursor.execute(f"""
+            DELETE FROM {schema}.migration_watermarks w
+            WHERE range_start > (SELECT MIN(range_start) FROM {schema}.migration_watermarks
+                                 WHERE table_name = w.table_name)
+            RETURNING 1
+        """)
+        assert cursor.rowcount > 0
+    pipeline.migrate_to_postgres()
+
+    assert [count_rows(postgres, schema, table) for table in MIGRATED_TABLES] == before
+    assert fetch_value(postgres, "SELECT COUNT(*) FROM pg_tables WHERE schemaname = %s "
+                                 "AND tablename LIKE 'staging%%'", (schema,)) == 0
+    assert pipeline.check_migration_status()
+
+
+def test_staging_merge_tolerates_rows_already_loaded(pipeline, postgres, sqlite_db, tmp_path):
+    """COPY repetido da mesma consulta não aborta nem duplica: ON CONFLICT na mesclagem da staging"""
+    schema = pipeline.DB_CONFIG_POSTGRES['schema']
+    write_bundles(str(tmp_path / 'in'), 3)
+    ingest_bundles(pipeline, sorted((tmp_path / 'in').iterdir()))
+    conn = pipeline.get_postgres_connection()
+    try:
+        pipeline.create_postgres_schema(conn)
+    finally:
+        pipeline.release_postgres_connection(conn)
+
+    for table in ('patients', 'conditions'):
+        columns, query, _ = pipeline.MIGRATION_TABLES[table]
+        for _ in range(2):
+            assert pipeline.migrate_table_with_copy(sqlite_db, table, columns.split(','), query)
+
+    assert count_rows(postgres, schema, 'patients') == 3
+    assert count_rows(postgres, schema, 'conditions') == 6
+    assert fetch_value(postgres, f"SELECT COUNT(DISTINCT source_id) FROM {schema}.conditions") == 6
+
+
+def read_foreign_keys(admin, schema):
+    """{tabela: convalidated} das FKs de conditions/medications"""
+    with admin.cursor() as cursor:
+        cursor.execute("""
+            SELECT t.relname, c.convalidated
+            FROM pg_constraint c
+            JOIN pg_class t ON t.oid = c.conrelid
+            JOIN pg_namespace n ON n.oid = t.relnamespace
+            WHERE n.nspname = %s AND c.contype = 'f'
+        """, (schema,))
+        return dict(cursor.fetchall())
+
+
+def test_initial_load_drops_and_restores_foreign_keys(pipeline, postgres, tmp_path, etl_config, monkeypatch):
+    """A carga inicial remove FKs e índices secundários e os devolve validados ao final"""
+    schema = pipeline.DB_CONFIG_POSTGRES['schema']
+    etl_config(migration_workers=2, migration_chunk_rows=4)
+    write_bundles(str(tmp_path / 'in'), 6)
+    ingest_bundles(pipeline, sorted((tmp_path / 'in').iterdir()))
+    disabled = {}
+    for name in ('disable_indexes', 'disable_foreign_keys'):
+        original = getattr(pipeline, name)
+        monkeypatch.setattr(pipeline, name,
+                            lambda conn, name=name, original=original: disabled.setdefault(name, original(conn)))
+
+    pipeline.migrate_to_postgres()
+
+    assert sorted(table for table, _, _ in disabled['disable_foreign_keys']) == \
+        [f"{schema}.conditions", f"{schema}.medications"]
+    assert all(f"REFERENCES {schema}.patients" in definition
+               for _, _, definition in disabled['disable_foreign_keys'])
+    assert {name for name, _ in disabled['disable_indexes']} == \
+        {'idx_conditions_text', 'idx_medications_text', 'idx_patients_gender'}
+    assert read_foreign_keys(postgres, schema) == {'conditions': True, 'medications': True}
+    assert fetch_value(postgres, "SELECT COUNT(*) FROM pg_indexes WHERE schemaname = %s "
+                                 "AND indexname IN ('idx_conditions_text', 'idx_medications_text', "
+                                 "'idx_patients_gender')", (schema,)) == 3
+    assert count_rows(postgres, schema, 'conditions') == 12
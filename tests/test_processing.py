@@ -0,0 +1,130 @@
+import queue
+import sqlite3
+
+import pytest
+
+from conftest import ingest_bundles, read_patients, write_bundles
+
+
+def expected_patients(bundles):
+    """Conteúdo esperado no SQLite para os bundles gerados por write_bundles"""
+    expected = {}
+    for bundle in bundles.values():
+        resources = [entry['resource'] for entry in bundle['entry']]
+        patient = resources[0]
+        expected[patient['id']] = (
+            patient['gender'],
+            sorted(r['code']['text'].replace('/', '-').replace('[', '(').replace(']', ')')
+                   for r in resources if r['resourceType'] == 'Condition'),
+            sorted(r['medicationCodeableConcept']['text']
+                   for r in resources if r['resourceType'] == 'MedicationRequest')
+        )
+    return expected
+
+
+def run_parallel(pipeline, paths):
+    """Processa os caminhos com o pool de processos e o escritor único"""
+    conn = pipeline.get_sqlite_connection()
+    pipeline.create_sqlite_schema(conn)
+    conn.close()
+    pipeline.download_queue = queue.Queue()
+    for path in paths:
+        pipeline.download_queue.put(str(path))
+    pipeline.download_queue.put(None)
+    pipeline.process_files_parallel()
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_parallel_parse_matches_sequential(pipeline, sqlite_db, tmp_path, etl_config, ordered):
+    """O pool de parsing grava no SQLite o mesmo conteúdo do processamento sequencial"""
+    bundles = write_bundles(str(tmp_path / 'in'), 9)
+    etl_config(parse_workers=2, parse_chunksize=1, parse_ordered=ordered)
+
+    run_parallel(pipeline, sorted((tmp_path / 'in').iterdir()))
+
+    assert read_patients(sqlite_db) == expected_patients(bundles)
+    assert pipeline.processed_count == 9
+    assert pipeline.errors_count == 0
+
+
+def test_sequential_processing(pipeline, sqlite_db, tmp_path):
+    """process_files grava pacientes, condições (com clean_text) e medicações"""
+    bundles = write_bundles(str(tmp_path / 'in'), 4)
+    ingest_bundles(pipeline, sorted((tmp_path / 'in').iterdir()))
+    assert read_patients(sqlite_db) == expected_patients(bundles)
+
+
+def test_parallel_parse_with_chunked_batches(pipeline, sqlite_db, tmp_path, etl_config):
+    """parse_chunksize > 1 agrupa os caminhos em lotes sem quebrar o next(timeout) do pool"""
+    bundles = write_bundles(str(tmp_path / 'in'), 9)
+    etl_config(parse_workers=2, parse_chunksize=4, parse_ordered=True)
+
+    run_parallel(pipeline, sorted((tmp_path / 'in').iterdir()))
+
+    assert read_patients(sqlite_db) == expected_patients(bundles)
+
+
+def test_failed_bundle_only_drops_itself_from_commit_group(pipeline, sqlite_db, tmp_path, etl_config):
+    """Um bundle que falha na escrita volta ao SAVEPOINT; o resto do grupo é confirmado"""
+    bundles = write_bundles(str(tmp_path / 'in'), 4)
+    broken = tmp_path / 'in' / 'b1.json'
+    broken.write_text('{"entry": [{"resource": {"resourceType": "Patient", "gender": "male"}}]}')
+    del bundles['b1.json']
+    etl_config(commit_files=10, commit_interval_ms=60000)
+
+    ingest_bundles(pipeline, sorted((tmp_path / 'in').iterdir()))
+
+    assert read_patients(sqlite_db) == expected_patients(bundles)
+    assert (pipeline.processed_count, pipeline.errors_count) == (3, 1)
+
+
+def test_commit_groups_respect_file_limit(pipeline, sqlite_db, tmp_path, etl_config, monkeypatch):
+    """Com commit_files=2, cinco arquivos são confirmados em três commits"""
+    write_bundles(str(tmp_path / 'in'), 5)
+    etl_config(commit_files=2, commit_interval_ms=60000)
+    groups = []
+    flush = pipeline.flush_commit_group
+    monkeypatch.setattr(pipeline, 'flush_commit_group',
+                        lambda conn, group: (groups.append(len(group['files'])), flush(conn, group)))
+
+    ingest_bundles(pipeline, sorted((tmp_path / 'in').iterdir()))
+
+    assert [size for size in groups if size] == [2, 2, 1]
+
+
+class FailingCommit:
+    """Conexão cujo commit falha (ex.: banco bloqueado); o resto é repassado à conexão real"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def commit(self):
+        raise sqlite3.OperationalError('database is locked')
+
+
+def test_failed_commit_does_not_mark_files_processed(pipeline, sqlite_db, tmp_path, etl_config):
+    """Arquivos só contam como processados após o commit: falhando, são gravados de novo"""
+    bundles = write_bundles(str(tmp_path / 'in'), 2)
+    etl_config(commit_files=10, commit_interval_ms=60000)
+    conn = pipeline.get_sqlite_connection()
+    pipeline.create_sqlite_schema(conn)
+    group = pipeline.new_commit_group(conn)
+    paths = [str(path) for path in sorted((tmp_path / 'in').iterdir())]
+
+    for path in paths:
+        pipeline.store_parse_result(conn, group, *pipeline.safe_parse_bundle(path))
+    pipeline.flush_commit_group(FailingCommit(conn), group)
+
+    assert group['processed'] == {}
+    assert pipeline.errors_count == 2
+
+    for path in paths:
+        pipeline.store_parse_result(conn, group, *pipeline.safe_parse_bundle(path))
+    pipeline.flush_commit_group(conn, group)
+    conn.close()
+
+    assert set(group['processed']) == set(bundles)
+    assert read_patients(sqlite_db) == expected_patients(bundles)
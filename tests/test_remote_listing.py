@@ -0,0 +1,102 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from etl import downloads
+
+TREE = {
+    'sha': 'd' * 40,
+    'truncated': False,
+    'tree': [
+        {'path': 'b0.json', 'type': 'blob', 'sha': 'a' * 40, 'size': 10},
+        {'path': 'b1.json', 'type': 'blob', 'sha': 'b' * 40, 'size': 20},
+        {'path': 'README.md', 'type': 'blob', 'sha': 'c' * 40, 'size': 5},
+        {'path': 'nested', 'type': 'tree', 'sha': 'e' * 40}
+    ]
+}
+
+
+@pytest.fixture
+def tree_server():
+    """Endpoint git/trees falso com ETag; registra (caminho, If-None-Match) de cada pedido"""
+    requests_seen = []
+    state = {'tree': TREE, 'etag': '"v1"'}
+
+    class TreeHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            requests_seen.append((self.path, self.headers.get('If-None-Match')))
+            if self.headers.get('If-None-Match') == state['etag']:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = json.dumps(state['tree']).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', state['etag'])
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TreeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/git/trees/main:data", requests_seen, state
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_tree_url_requests_only_data_subtree(pipeline):
+    """A listagem pede a subárvore data/, sem recursive=1 sobre o repositório inteiro"""
+    assert pipeline.TREE_URL.endswith('/git/trees/main:data')
+    assert 'recursive' not in pipeline.TREE_URL
+
+
+def test_subtree_entries_become_content_listing(pipeline):
+    """Só blobs .json da subárvore entram, com o caminho completo em 'path'"""
+    files = pipeline.parse_tree_listing(TREE)
+    assert sorted(files) == ['b0.json', 'b1.json']
+    assert files['b1.json'] == {'name': 'b1.json', 'path': 'data/b1.json', 'sha': 'b' * 40,
+                                'size': 20, 'type': 'file'}
+
+
+def test_unchanged_listing_is_revalidated_with_etag(pipeline, tree_server, monkeypatch):
+    """A segunda listagem envia If-None-Match e reaproveita a cópia local no 304"""
+    tree_url, requests_seen, _ = tree_server
+    monkeypatch.setattr(pipeline, 'TREE_URL', tree_url)
+
+    first = pipeline.get_remote_files()
+    second = pipeline.get_remote_files()
+
+    assert first == second == pipeline.parse_tree_listing(TREE)
+    assert requests_seen == [('/git/trees/main:data', None), ('/git/trees/main:data', '"v1"')]
+
+
+def test_truncated_tree_falls_back_to_contents_pagination(pipeline, tree_server, bundle_server,
+                                                          bundle_dir, monkeypatch):
+    """Árvore truncada: a listagem vem da API de conteúdo paginada"""
+    tree_url, _, state = tree_server
+    data_url, _ = bundle_server
+    state['tree'] = dict(TREE, truncated=True)
+    monkeypatch.setattr(pipeline, 'TREE_URL', tree_url)
+    monkeypatch.setattr(pipeline, 'DATA_URL', data_url)
+
+    files = pipeline.get_remote_files()
+
+    assert sorted(files) == sorted(path.name for path in bundle_dir.iterdir())
+
+
+def test_contents_listing_follows_link_pagination(pipeline, bundle_server, bundle_dir, monkeypatch):
+    """A paginação da API de conteúdo segue o cabeçalho Link "next" até a última página"""
+    monkeypatch.setattr(pipeline, 'DATA_URL', bundle_server[0])
+
+    files = pipeline.list_remote_files_paged(per_page=4)
+
+    assert sorted(files) == sorted(path.name for path in bundle_dir.iterdir())
+    assert all(meta['sha'] == downloads.git_blob_sha((bundle_dir / name).read_bytes())
+               for name, meta in files.items())
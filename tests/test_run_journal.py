@@ -0,0 +1,66 @@
+import json
+import os
+
+from conftest import drain_queue
+
+
+def interrupt_run(pipeline):
+    """Simula uma queda: o diário fica no disco e o estado em memória se perde"""
+    pipeline.run_journal.close()
+    pipeline.run_journal = None
+    pipeline.journal_states.clear()
+
+
+def test_interrupted_run_is_resumed(pipeline, tmp_path):
+    """A execução seguinte retoma o diretório e republica os arquivos já baixados"""
+    process_dir = tmp_path / 'data' / 'data_process_x'
+    process_dir.mkdir(parents=True)
+    downloaded = process_dir / 'a.json'
+    downloaded.write_text('{}', encoding='utf-8')
+    files = {'a.json': {}, 'b.json': {}, 'c.json': {}}
+
+    pipeline.open_run_journal(str(process_dir), files)
+    pipeline.journal_event(['a.json'], 'downloaded', str(downloaded), sync=False)
+    pipeline.journal_event(['b.json'], 'downloaded', str(process_dir / 'missing.json'), sync=False)
+    pipeline.sync_run_journal()
+    interrupt_run(pipeline)
+    with open(pipeline.RUN_JOURNAL_FILE, 'a', encoding='utf-8') as f:
+        f.write('{"name": "c.json", "sta')  # linha cortada pela queda
+
+    assert pipeline.prepare_process_dir(str(tmp_path)) == str(process_dir)
+    assert pipeline.journal_states['c.json']['state'] == 'listed'
+
+    remaining = pipeline.resume_downloaded_files(files)
+    pipeline.download_queue.put(None)
+    assert sorted(remaining) == ['b.json', 'c.json']
+    assert drain_queue(pipeline.download_queue) == [str(downloaded)]
+
+
+def test_download_events_are_synced_in_batches(pipeline, tmp_path, etl_config, monkeypatch):
+    """Eventos de download agrupam o fsync; fim de fase e commits sincronizam na hora"""
+    etl_config(journal_sync_every=3)
+    syncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: syncs.append(fd) or real_fsync(fd))
+    names = [f"f{i}.json" for i in range(7)]
+
+    pipeline.open_run_journal(str(tmp_path), names)
+    syncs.clear()
+    for name in names:
+        pipeline.journal_event([name], 'downloaded', sync=False)
+    assert len(syncs) == 2
+
+    pipeline.sync_run_journal()
+    assert len(syncs) == 3
+    pipeline.sync_run_journal()
+    assert len(syncs) == 3
+
+    pipeline.journal_event(names[:2], 'committed')
+    assert len(syncs) == 4
+
+    with open(pipeline.RUN_JOURNAL_FILE, encoding='utf-8') as f:
+        states = [json.loads(line).get('state') for line in f]
+    assert states.count('downloaded') == 7 and states.count('committed') == 2
+
+    pipeline.close_run_journal()
+    assert not os.path.exists(pipeline.RUN_JOURNAL_FILE)
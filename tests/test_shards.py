@@ -0,0 +1,93 @@
+import queue
+import shutil
+import sqlite3
+
+from conftest import read_patients, write_bundles
+from test_processing import expected_patients
+
+
+def run_sharded(pipeline, paths):
+    """Processa os caminhos com um escritor por shard e mescla no banco principal"""
+    conn = pipeline.get_sqlite_connection()
+    pipeline.create_sqlite_schema(conn)
+    conn.close()
+    pipeline.download_queue = queue.Queue()
+    for path in paths:
+        pipeline.download_queue.put(str(path))
+    pipeline.download_queue.put(None)
+    pipeline.process_files_sharded()
+
+
+def test_sharded_writers_match_single_writer(pipeline, sqlite_db, tmp_path, etl_config):
+    """Os shards são mesclados no banco principal com o mesmo conteúdo, e removidos em seguida"""
+    bundles = write_bundles(str(tmp_path / 'in'), 12)
+    etl_config(write_shards=3, parse_workers=1, commit_files=2)
+
+    run_sharded(pipeline, sorted((tmp_path / 'in').iterdir()))
+
+    assert read_patients(sqlite_db) == expected_patients(bundles)
+    assert pipeline.list_shard_paths() == []
+    conn = sqlite3.connect(sqlite_db)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM processed_files").fetchone()[0] == 12
+        indexes = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    finally:
+        conn.close()
+    assert set(pipeline.SQLITE_INDEXES) <= indexes
+
+
+def test_shard_left_by_interrupted_merge_is_not_merged_twice(pipeline, sqlite_db, tmp_path,
+                                                             etl_config, monkeypatch):
+    """Shard já mesclado antes de uma queda é descartado na recuperação, sem duplicar fatos"""
+    bundles = write_bundles(str(tmp_path / 'in'), 6)
+    etl_config(write_shards=2, parse_workers=1)
+    merge_sqlite_shards = pipeline.merge_sqlite_shards
+    monkeypatch.setattr(pipeline, 'merge_sqlite_shards', lambda: None)
+    run_sharded(pipeline, sorted((tmp_path / 'in').iterdir()))
+
+    shard_paths = pipeline.list_shard_paths()
+    assert len(shard_paths) == 2
+    leftover = str(tmp_path / 'leftover.db')
+    shutil.copy(shard_paths[0], leftover)
+
+    merge_sqlite_shards()
+    conn = pipeline.get_sqlite_connection()
+    try:
+        assert pipeline.merge_sqlite_shard(conn, leftover) == 0
+    finally:
+        conn.close()
+
+    assert read_patients(sqlite_db) == expected_patients(bundles)
+
+
+def test_bulk_load_rebuilds_indexes_once_after_merge(pipeline, sqlite_db, tmp_path, etl_config, monkeypatch):
+    """Shards + carga em massa: a mesclagem deixa os índices para finish_bulk_load (um só ANALYZE)"""
+    bundles = write_bundles(str(tmp_path / 'in'), 6)
+    etl_config(write_shards=2, parse_workers=1, bulk_load='always')
+    monkeypatch.setattr(pipeline, 'bulk_load_active', False)
+    statements = []
+    connect = pipeline.get_sqlite_connection
+
+    def traced_connection():
+        conn = connect()
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    conn = connect()
+    pipeline.create_sqlite_schema(conn)
+    assert pipeline.start_bulk_load_if_needed(conn)
+    conn.close()
+    monkeypatch.setattr(pipeline, 'get_sqlite_connection', traced_connection)
+
+    pipeline.download_queue = queue.Queue()
+    for path in sorted((tmp_path / 'in').iterdir()):
+        pipeline.download_queue.put(str(path))
+    pipeline.download_queue.put(None)
+    pipeline.process_files_sharded()
+    indexes_after_merge = [s for s in statements if s.startswith('CREATE INDEX')]
+    pipeline.finish_bulk_load()
+
+    assert indexes_after_merge == []
+    assert sum(s == 'ANALYZE' for s in statements) == 1
+    assert sum(s.startswith('CREATE INDEX') for s in statements) == len(pipeline.SQLITE_INDEXES)
+    assert read_patients(sqlite_db) == expected_patients(bundles)
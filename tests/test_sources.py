@@ -0,0 +1,98 @@
+import os
+import tarfile
+import threading
+import zipfile
+
+import pytest
+
+from conftest import read_patients, write_bundles
+from etl import sources
+
+
+def build_source(kind, bundle_dir, tmp_path):
+    """Empacota bundle_dir como diretório, zip ou tar.gz (com um metadado oculto a ignorar)"""
+    (bundle_dir / '._b0.json').write_bytes(b'\x00\x01')
+    if kind == 'directory':
+        return str(bundle_dir)
+    names = sorted(os.listdir(bundle_dir))
+    if kind == 'zip':
+        path = tmp_path / 'bundles.zip'
+        with zipfile.ZipFile(path, 'w') as archive:
+            for name in names:
+                archive.write(bundle_dir / name, f"data/{name}")
+    else:
+        path = tmp_path / 'bundles.tar.gz'
+        with tarfile.open(path, 'w:gz') as archive:
+            for name in names:
+                archive.add(bundle_dir / name, f"data/{name}")
+    return str(path)
+
+
+@pytest.mark.parametrize('kind', ['directory', 'zip', 'tar'])
+def test_local_source_is_ingested_offline(kind, pipeline, sqlite_db, tmp_path, etl_config):
+    """Diretório, zip e tar são listados e ingeridos sem rede, ignorando metadados ocultos"""
+    bundle_dir = tmp_path / 'bundles'
+    bundles = write_bundles(str(bundle_dir), 4)
+    source = build_source(kind, bundle_dir, tmp_path)
+    etl_config(source=source, source_format='bundle')
+
+    assert sources.get_source_kind(source) == kind
+    listing = sources.list_source_files(source)
+    assert sorted(listing) == sorted(bundles)
+
+    conn = pipeline.get_sqlite_connection()
+    pipeline.create_sqlite_schema(conn)
+    conn.close()
+    pipeline.load_local_source()
+    pipeline.process_files()
+
+    assert sorted(read_patients(sqlite_db)) == sorted(
+        bundle['entry'][0]['resource']['id'] for bundle in bundles.values()
+    )
+    assert pipeline.errors_count == 0
+
+
+def test_archive_members_are_read_in_memory(tmp_path):
+    """Membros de tar/zip saem como (nome, bytes), sem extração para disco"""
+    bundle_dir = tmp_path / 'bundles'
+    write_bundles(str(bundle_dir), 3)
+    source = build_source('tar', bundle_dir, tmp_path)
+
+    items = list(sources.iter_source_bundles(source, ['b1.json', 'b2.json']))
+
+    assert [name for name, _ in items] == ['b1.json', 'b2.json']
+    assert items[0][1] == (bundle_dir / 'b1.json').read_bytes()
+
+
+@pytest.mark.parametrize('kind, in_memory, maxsize', [
+    ('directory', False, 0), ('directory', True, 2), ('zip', False, 2), ('tar', False, 2)
+])
+def test_download_queue_is_bounded_when_items_carry_content(kind, in_memory, maxsize, pipeline,
+                                                           tmp_path, etl_config):
+    """Membros de tar/zip e downloads em memória passam por uma fila limitada"""
+    bundle_dir = tmp_path / 'bundles'
+    write_bundles(str(bundle_dir), 2)
+    etl_config(source=build_source(kind, bundle_dir, tmp_path), in_memory=in_memory, memory_queue_files=2)
+
+    assert pipeline.new_download_queue().maxsize == maxsize
+
+
+def test_archive_source_is_ingested_through_bounded_queue(pipeline, sqlite_db, tmp_path, etl_config):
+    """Com a fila limitada a leitura do zip espera o parsing em vez de enfileirar tudo"""
+    bundle_dir = tmp_path / 'bundles'
+    bundles = write_bundles(str(bundle_dir), 8)
+    etl_config(source=build_source('zip', bundle_dir, tmp_path), source_format='bundle',
+               in_memory=False, memory_queue_files=2)
+    conn = pipeline.get_sqlite_connection()
+    pipeline.create_sqlite_schema(conn)
+    conn.close()
+    pipeline.download_queue = pipeline.new_download_queue()
+    reader = threading.Thread(target=pipeline.load_local_source)
+    reader.start()
+    pipeline.process_files()
+    reader.join()
+
+    assert pipeline.download_queue.maxsize == 2
+    assert sorted(read_patients(sqlite_db)) == sorted(
+        bundle['entry'][0]['resource']['id'] for bundle in bundles.values()
+    )
@@ -0,0 +1,80 @@
+import sqlite3
+
+from conftest import ingest_bundles, read_patients, write_bundles
+from etl import loader
+
+
+def create_legacy_database(database):
+    """Banco no formato antigo (textos repetidos), criado pelo etl/loader.py"""
+    conn = sqlite3.connect(database)
+    loader.create_sqlite_schema(conn)
+    conn.executemany("INSERT INTO patients (patient_id, gender) VALUES (?, ?)",
+                     [('p1', 'female'), ('p2', 'male')])
+    conn.executemany("INSERT INTO conditions (patient_id, condition_text) VALUES (?, ?)",
+                     [('p1', 'Asthma'), ('p2', 'Asthma'), ('p2', 'Flu'), ('ghost', 'Flu')])
+    conn.execute("INSERT INTO medications (patient_id, medication_text) VALUES ('p1', 'Aspirin')")
+    conn.commit()
+    conn.close()
+
+
+def object_types(database):
+    conn = sqlite3.connect(database)
+    try:
+        return dict(conn.execute("SELECT name, type FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"))
+    finally:
+        conn.close()
+
+
+def test_bundles_are_stored_as_vocabulary_ids(pipeline, sqlite_db, bundle_dir):
+    """Textos repetidos ficam uma vez no vocabulário; as views devolvem os textos limpos"""
+    ingest_bundles(pipeline, sorted(bundle_dir.iterdir()))
+
+    conn = sqlite3.connect(sqlite_db)
+    try:
+        vocab = [text for text, in conn.execute("SELECT condition_text FROM condition_vocab ORDER BY 1")]
+        facts = conn.execute("SELECT COUNT(*) FROM condition_facts").fetchone()[0]
+    finally:
+        conn.close()
+    assert vocab == ['Condition 0', 'Condition 1', 'Condition 2', 'Flu-cold (x)']
+    assert facts == 12
+    assert read_patients(sqlite_db)['b-p4'] == ('female', ['Condition 1', 'Flu-cold (x)'], ['Drug 0'])
+
+
+def test_legacy_database_is_upgraded_and_quarantines_orphans(pipeline, sqlite_db, capsys):
+    """O upgrade preserva as linhas ligadas a pacientes e guarda as demais em quarentena"""
+    create_legacy_database(sqlite_db)
+
+    conn = pipeline.get_sqlite_connection()
+    pipeline.create_sqlite_schema(conn)
+    conn.close()
+
+    types = object_types(sqlite_db)
+    assert (types['conditions'], types['medications'], types['condition_facts']) == ('view', 'view', 'table')
+    assert 'medications_orphans' not in types
+    assert '1 linhas de conditions sem paciente correspondente ou sem texto foram guardadas em conditions_orphans' \
+        in capsys.readouterr().out
+    conn = sqlite3.connect(sqlite_db)
+    try:
+        orphans = conn.execute("SELECT id, patient_id, condition_text FROM conditions_orphans").fetchall()
+    finally:
+        conn.close()
+    assert orphans == [(4, 'ghost', 'Flu')]
+    assert read_patients(sqlite_db) == {'p1': ('female', ['Asthma'], ['Aspirin']),
+                                        'p2': ('male', ['Asthma', 'Flu'], [])}
+
+
+def test_legacy_loader_writes_into_upgraded_database(pipeline, sqlite_db, tmp_path):
+    """etl/loader.py continua funcionando sobre as views: schema e inserts passam pelos triggers"""
+    write_bundles(str(tmp_path / 'b'), 1)
+    ingest_bundles(pipeline, [tmp_path / 'b' / 'b0.json'])
+
+    conn = sqlite3.connect(sqlite_db)
+    try:
+        loader.create_sqlite_schema(conn)
+        conn.execute("INSERT INTO conditions (patient_id, condition_text) VALUES ('b-p0', 'Asthma')")
+        conn.commit()
+    finally:
+        conn.close()
+
+    assert object_types(sqlite_db)['conditions'] == 'view'
+    assert read_patients(sqlite_db)['b-p0'][1] == ['Asthma', 'Condition 0', 'Flu-cold (x)']